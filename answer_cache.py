@@ -0,0 +1,180 @@
+"""Persistent cache of generated answers, in front of the Ollama generate call.
+
+An answer is keyed on what determines it: the normalized question, the
+retrieved row IDs (sorted, deduplicated), a hash of the context text the
+prompt was built from (so a different token budget or a climatology
+update is a miss), the prompt template version, the generation model and
+its options. Entries expire after a TTL and the
+least recently used ones are evicted beyond `max_entries` / `max_bytes`.
+
+With `similarity` set (e.g. 0.95), a question that misses can reuse the
+answer of a near-duplicate one: same rows, context, template, model and options,
+and a question embedding at least that cosine-similar.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from rag import PROMPT_TEMPLATE_VERSION, build_prompt
+from tracing import TRACER, span
+
+ANSWER_CACHE_PATH = "answer_cache.sqlite"
+
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!").strip().lower()
+
+
+def context_key(row_ids, context, model, options, template_version=PROMPT_TEMPLATE_VERSION):
+    """Hash of everything besides the question that goes into an answer."""
+    rows = np.unique(np.asarray(row_ids, dtype=np.int64))
+    digest = hashlib.sha256()
+    digest.update(rows.tobytes())
+    digest.update(hashlib.sha256(context.encode()).digest())
+    digest.update(json.dumps([template_version, model, options or {}], sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=10_000, max_bytes=64 * 2 ** 20,
+                 ttl=30 * 24 * 3600, similarity=None):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # Used from the query server's event loop and the batch runner; every access goes through the lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                context TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                embedding BLOB,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (context, question)
+            );
+            CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+        """)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _embed(self, encode, question):
+        vector = np.asarray(encode(question), dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, row_ids, context, question, model, options, encode=None):
+        """The cached answer, or None. `encode` (text → vector) enables near-duplicate reuse."""
+        context, normalized = context_key(row_ids, context, model, options), normalize_question(question)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT answer, created_at FROM answers WHERE context = ? AND question = ?",
+                                    (context, normalized)).fetchone()
+        if row is not None and now - row[1] <= self.ttl:
+            self._touch(context, normalized, now)
+            self.hits += 1
+            return row[0]
+        if self.similarity is not None and encode is not None:
+            with self._lock:
+                candidates = self.conn.execute(
+                    "SELECT question, answer, embedding FROM answers "
+                    "WHERE context = ? AND embedding IS NOT NULL AND created_at >= ?",
+                    (context, now - self.ttl)).fetchall()
+            if candidates:
+                query = self._embed(encode, question)
+                stored = np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in candidates])
+                scores = stored @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    self._touch(context, candidates[best][0], now)
+                    self.near_hits += 1
+                    return candidates[best][1]
+        self.misses += 1
+        return None
+
+    def _touch(self, context, question, now):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE context = ? AND question = ?",
+                              (now, context, question))
+
+    def put(self, row_ids, context, question, model, options, answer, encode=None):
+        """Store a complete answer, then evict expired and least recently used entries."""
+        if not answer:
+            return
+        context, normalized = context_key(row_ids, context, model, options), normalize_question(question)
+        embedding = None
+        if self.similarity is not None and encode is not None:
+            embedding = self._embed(encode, question).tobytes()
+        now = time.time()
+        size = len(answer.encode()) + len(normalized.encode()) + len(embedding or b"")
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                              (context, normalized, answer, embedding, size, now, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self.conn.execute("""
+            DELETE FROM answers WHERE rowid IN (
+                SELECT rowid FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)
+        """, (self.max_entries,))
+        self.conn.execute("""
+            DELETE FROM answers WHERE rowid IN (
+                SELECT rowid FROM (SELECT rowid, SUM(size) OVER (ORDER BY last_used DESC, rowid) AS total
+                                   FROM answers)
+                WHERE total > ?)
+        """, (self.max_bytes,))
+
+    def stats(self):
+        with self._lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "near_hits": self.near_hits,
+                "misses": self.misses}
+
+
+async def cached_generate(client, cache, context, row_ids, question, encode=None):
+    """client.generate() on the prompt for `context` and `question`, behind the cache; returns (answer, cached)."""
+    if cache is not None:
+        answer = cache.get(row_ids, context, question, client.model, client.options, encode)
+        if answer is not None:
+            return answer, True
+    with span("generate", model=client.model):
+        answer = await client.generate(build_prompt(context, question))
+    if cache is not None:
+        cache.put(row_ids, context, question, client.model, client.options, answer, encode)
+    return answer, False
+
+
+async def cached_stream(client, cache, context, row_ids, question, encode=None):
+    """client.stream() behind the cache: a cached answer arrives as one token.
+
+    A streamed answer is stored only if it completed; a caller that stops
+    early (e.g. a disconnected client) leaves the cache untouched.
+    """
+    if cache is not None:
+        answer = cache.get(row_ids, context, question, client.model, client.options, encode)
+        if answer is not None:
+            yield answer
+            return
+    tokens = []
+    started = time.perf_counter()
+    async for token in client.stream(build_prompt(context, question)):
+        tokens.append(token)
+        yield token
+    TRACER.record("generate", time.perf_counter() - started, model=client.model, tokens=len(tokens))
+    if cache is not None:
+        cache.put(row_ids, context, question, client.model, client.options, "".join(tokens), encode)
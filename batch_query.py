@@ -0,0 +1,149 @@
+"""Answer many questions in one process: JSONL in, JSONL out.
+
+Each input line is a JSON object with a "question" (or just a JSON string).
+Optional "id", "k", "lat", "lon", "radius_km", "start", "end" and
+"float_ids" fields work as in the query server. Assets are loaded once.
+Questions are retrieved in batches (one encode call and one search per
+distinct filter, see rag.search_many), and their contexts are formatted
+together. Answers are generated concurrently, up to --concurrency at a
+time, while the next batch is being retrieved. A failed generation is
+retried on its own, and the output keeps the input order. Answers already
+in the answer cache (answer_cache.py) are reused, not regenerated.
+
+Run with:  python batch_query.py questions.jsonl answers.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from answer_cache import ANSWER_CACHE_PATH, AnswerCache, cached_generate
+from context_builder import CONTEXT_TOKENS, build_contexts
+from encoder import BACKENDS
+from ollama_client import OllamaClient, OllamaError
+from rag import load_assets, search_many
+from tracing import TRACER
+
+FILTER_FIELDS = ("lat", "lon", "radius_km", "start", "end", "float_ids")
+
+
+def read_questions(path):
+    """[{"id", "question", ...}, ...] from a JSONL file ("-" for stdin); ids default to the line number."""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    items = []
+    with stream:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            if not item.get("question"):
+                raise ValueError(f"{path}:{line_no}: 'question' is required")
+            item.setdefault("id", line_no)
+            items.append(item)
+    return items
+
+
+def retrieve_batch(assets, items, k=5, radius_km=1500, context_tokens=CONTEXT_TOKENS):
+    """Rows, parsed query and context for a batch of questions."""
+    results = search_many(assets, [item["question"] for item in items],
+                          k=[int(item.get("k", k)) for item in items], radius_km=radius_km,
+                          overrides=[{name: item.get(name) for name in FILTER_FIELDS} for item in items])
+    contexts = build_contexts([rows for rows, _ in results], context_tokens, climatology=assets.climatology)
+    return [(rows, parsed, context) for (rows, parsed), context in zip(results, contexts)]
+
+
+async def answer(client, semaphore, item, rows, parsed, context, retries=3, generate=True, cache=None):
+    """One output record; generation is retried up to `retries` times before giving up on the item."""
+    record = {"id": item["id"], "question": item["question"], "parsed": parsed.as_dict(),
+              "row_ids": rows.index.tolist(), "context": context}
+    if not generate or not len(rows):
+        return record
+    async with semaphore:
+        for attempt in range(1, retries + 1):
+            started = time.perf_counter()
+            try:
+                record["answer"], record["cached"] = await cached_generate(
+                    client, cache, context, rows.index, item["question"])
+                record.pop("error", None)
+                break
+            except OllamaError as e:
+                record["error"] = f"Generation failed: {e}"
+            finally:
+                record["attempts"] = attempt
+                record["generation_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+async def run(items, out, assets, batch_size=256, concurrency=8, retries=3, k=5, radius_km=1500,
+              generate=True, client=None, cache=None, context_tokens=CONTEXT_TOKENS):
+    """Retrieve in batches, generate concurrently, write records to `out` in input order."""
+    loop = asyncio.get_running_loop()
+    own_client = client is None
+    client = client or OllamaClient(max_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+    tasks = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                # Off the event loop, so answers for the previous batch keep streaming meanwhile
+                retrieved = await loop.run_in_executor(executor, retrieve_batch, assets, batch, k, radius_km,
+                                                       context_tokens)
+                tasks.extend(asyncio.create_task(answer(client, semaphore, item, *result, retries=retries,
+                                                        generate=generate, cache=cache))
+                             for item, result in zip(batch, retrieved))
+                print(f"🔎 Retrieved {start + len(batch)}/{len(items)} questions", file=sys.stderr)
+            for n, task in enumerate(tasks, 1):
+                record = await task
+                failed += "error" in record
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if n % 100 == 0:
+                    out.flush()
+                    print(f"✍️  {n}/{len(items)} answers written", file=sys.stderr)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if own_client:
+                await client.close()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="questions, one JSON object or string per line ('-' for stdin)")
+    parser.add_argument("output", nargs="?", default="-", help="answers JSONL (default stdout)")
+    parser.add_argument("--batch-size", type=int, default=256, help="questions retrieved per batch")
+    parser.add_argument("--concurrency", type=int, default=8, help="generation requests in flight")
+    parser.add_argument("--retries", type=int, default=3, help="generation attempts per question")
+    parser.add_argument("--k", type=int, default=5, help="rows retrieved per question")
+    parser.add_argument("--radius-km", type=float, default=1500, help="search radius when none is given")
+    parser.add_argument("--no-generate", action="store_true", help="only retrieve rows and contexts")
+    parser.add_argument("--encoder", choices=BACKENDS, default=None,
+                        help="query encoder backend (default $FLOATCHAT_ENCODER, else torch)")
+    parser.add_argument("--threads", type=int, default=None, help="encoder threads (default: all cores)")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS,
+                        help="approximate token budget of each context")
+    parser.add_argument("--answer-cache", default=ANSWER_CACHE_PATH, help="SQLite answer cache ('' to disable)")
+    args = parser.parse_args()
+
+    items = read_questions(args.input)
+    print(f"Loading metadata and FAISS index for {len(items)} questions...", file=sys.stderr)
+    assets = load_assets(backend=args.encoder, threads=args.threads)
+    cache = AnswerCache(args.answer_cache) if args.answer_cache else None
+    started = time.perf_counter()
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with out:
+        failed = asyncio.run(run(items, out, assets, args.batch_size, args.concurrency, args.retries,
+                                 args.k, args.radius_km, not args.no_generate, cache=cache,
+                                 context_tokens=args.context_tokens))
+    if cache is not None:
+        stats = cache.stats()
+        print(f"🗄️  Answer cache: {stats['hits']} reused, {stats['entries']} stored", file=sys.stderr)
+    print(f"✅ {len(items)} questions in {time.perf_counter() - started:.1f}s ({failed} failed)", file=sys.stderr)
+    TRACER.print_summary(file=sys.stderr)
+    TRACER.write_metrics()
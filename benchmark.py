@@ -0,0 +1,309 @@
+"""End-to-end benchmark on synthetic data, with machine-readable results.
+
+Stages (each run in a fresh process, so its peak RSS is its own):
+    generate    synthetic GADR NetCDF files (synth_data.py)
+    ingest      read_multiple.ingest() into the Parquet dataset and ragged store,
+                plus the profile summaries
+    build       vect_db.build(): row embeddings and the FAISS index
+    retrieve    rag.search() per question, and rag.search_many() over all of them
+    answer      retrieval + context + streamed generation against fake_ollama.py,
+                with bounded concurrency
+
+Every stage reports wall time, throughput and peak RSS; the query stages
+also report p50/p95/p99 latencies. Everything runs inside --workdir, using
+the default relative paths of the pipeline modules. The results are
+written as JSON with the git commit. Pass --compare with an earlier result
+to print the relative change of every metric.
+
+Run with:  python benchmark.py --floats 100 --cycles 100 --levels 100 --output bench.json
+           python benchmark.py --stages retrieve answer --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+STAGES = ("generate", "ingest", "build", "retrieve", "answer")
+DATA_DIR = "synth_nc"
+
+QUESTION_TEMPLATES = (
+    # Structured: answered from the spatial/time index alone
+    "Which floats were near {lat:.1f}, {lon:.1f} in {month}?",
+    "Show profiles within 300 km of {lat:.1f}, {lon:.1f} from {start} to {end}",
+    # Filter plus free text: ranked by embedding within the filter
+    "Is there a deep mixed layer near {lat:.1f}, {lon:.1f} in {year}?",
+    # No filter: full vector search
+    "Where do floats show warm fresh surface water?",
+)
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest finished child, in MiB."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) * scale / 2 ** 20, 1)
+
+
+def latency_summary(seconds):
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if not len(ms):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"count": int(len(ms)), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(ms.max()), 3)}
+
+
+def make_questions(df, n, seed=0):
+    """`n` questions about places and times that exist in the metadata, cycling through the templates."""
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(0, len(df), n)]
+    questions = []
+    for i, (_, row) in enumerate(rows.iterrows()):
+        when = row["datetime"]
+        questions.append(QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(
+            lat=row["latitude"], lon=row["longitude"], month=when.strftime("%B %Y"), year=when.year,
+            start=(when - np.timedelta64(30, "D")).strftime("%Y-%m-%d"),
+            end=(when + np.timedelta64(30, "D")).strftime("%Y-%m-%d")))
+    return questions
+
+
+def stage_generate(floats, cycles, levels, seed, workers, **_):
+    from synth_data import generate
+
+    started = time.perf_counter()
+    files = generate(DATA_DIR, floats, cycles, levels, seed=seed, workers=workers)
+    seconds = time.perf_counter() - started
+    return {"files": files, "levels": levels, "files_per_s": round(files / seconds, 1)}
+
+
+def stage_ingest(workers, **_):
+    from columnar_store import load_metadata
+    from read_multiple import ingest
+    from tracing import TRACER
+
+    started = time.perf_counter()
+    files = ingest(DATA_DIR, workers=workers, full=True)
+    ingest_s = time.perf_counter() - started
+    rows = len(load_metadata())
+    # The summaries are built inside ingest(); report that part separately as before
+    summaries_s = TRACER.summary().get("ingest.summaries", {}).get("total_s")
+    return {"files": files, "rows": rows, "ingest_s": round(ingest_s, 3),
+            "files_per_s": round(files / ingest_s, 1), "rows_per_s": round(rows / ingest_s, 1),
+            "summaries_s": summaries_s}
+
+
+def stage_build(index_type, dtype, batch_size, encode_processes, encoder, threads, **_):
+    from vector_index import read_manifest
+    from vect_db import build
+
+    started = time.perf_counter()
+    df, _, _ = build(index_type=index_type, dtype=dtype, batch_size=batch_size, processes=encode_processes,
+                     backend=encoder, threads=threads)
+    seconds = time.perf_counter() - started
+    manifest = read_manifest() or {}
+    return {"rows": len(df), "rows_per_s": round(len(df) / seconds, 1), "index_type": index_type, "dtype": dtype,
+            "encoder": encoder or "torch",
+            "recall": (manifest.get("recall") or {}).get("value")}
+
+
+def stage_retrieve(queries, k, seed, encoder, threads, **_):
+    from rag import load_assets, search, search_many
+
+    started = time.perf_counter()
+    assets = load_assets(backend=encoder, threads=threads)
+    load_s = time.perf_counter() - started
+    questions = make_questions(assets.df, queries, seed)
+    started = time.perf_counter()
+    assets.embedding_model  # loaded on first use; timed separately from the queries
+    model_s = time.perf_counter() - started
+    search(assets, questions[0], k=k)  # warm-up
+
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        search(assets, question, k=k)
+        latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    search_many(assets, questions, k=k)
+    batch_s = time.perf_counter() - started
+    return {"queries": len(questions), "load_s": round(load_s, 3), "model_load_s": round(model_s, 3),
+            "latency": latency_summary(latencies), "qps": round(len(latencies) / sum(latencies), 1),
+            "batched_qps": round(len(questions) / batch_s, 1)}
+
+
+async def _answer_all(assets, questions, k, concurrency, token_delay, first_token_delay):
+    from fake_ollama import start_fake_ollama
+    from ollama_client import OllamaClient
+    from context_builder import build_context
+    from rag import build_prompt, search
+
+    runner, url = await start_fake_ollama(token_delay=token_delay, first_token_delay=first_token_delay)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_tokens = [], []
+
+    async def one(question):
+        async with semaphore:
+            started = time.perf_counter()
+            rows, _ = await loop.run_in_executor(None, lambda: search(assets, question, k=k))
+            prompt = build_prompt(build_context(rows), question)
+            first = None
+            async for _ in client.stream(prompt):
+                first = first or time.perf_counter()
+            latencies.append(time.perf_counter() - started)
+            first_tokens.append((first or time.perf_counter()) - started)
+
+    try:
+        async with OllamaClient(url=url, max_connections=concurrency) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(q) for q in questions))
+            return time.perf_counter() - started, latencies, first_tokens
+    finally:
+        await runner.cleanup()
+
+
+def stage_answer(answer_queries, k, seed, concurrency, token_delay, first_token_delay, encoder, threads, **_):
+    from rag import load_assets
+
+    assets = load_assets(backend=encoder, threads=threads)
+    questions = make_questions(assets.df, answer_queries, seed + 1)
+    assets.embedding_model
+    seconds, latencies, first_tokens = asyncio.run(
+        _answer_all(assets, questions, k, concurrency, token_delay, first_token_delay))
+    return {"queries": len(questions), "concurrency": concurrency, "qps": round(len(questions) / seconds, 1),
+            "latency": latency_summary(latencies), "first_token": latency_summary(first_tokens)}
+
+
+def _run_stage(queue, workdir, name, options):
+    os.chdir(workdir)
+    started = time.perf_counter()
+    try:
+        result = globals()[f"stage_{name}"](**options)
+    except Exception as e:
+        result = {"error": f"{e.__class__.__name__}: {e}"}
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    result["peak_rss_mb"] = peak_rss_mb()
+    queue.put(result)
+
+
+def run_stage(workdir, name, options, poll_s=1.0):
+    """Run one stage in a fresh process; returns its result dict.
+
+    A process that dies without reporting (killed by the OOM killer, a
+    segfault in a native library) yields an "error" result, not a hang.
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_run_stage, args=(result_queue, workdir, name, options))
+    started = time.perf_counter()
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=poll_s)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # Exited: its result may still be in flight
+        try:
+            result = result_queue.get(timeout=poll_s)
+        except queue.Empty:
+            result = {"error": f"stage process exited with code {process.exitcode} without a result",
+                      "wall_s": round(time.perf_counter() - started, 3)}
+        break
+    process.join()
+    return result
+
+
+def git_commit():
+    repo = Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def _flatten(result, prefix=""):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current, baseline):
+    """Print every numeric metric present in both results with its relative change."""
+    before, after = _flatten(baseline.get("stages", {})), _flatten(current.get("stages", {}))
+    print(f"\n{'metric':<40} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{key:<40} {old:>12g} {new:>12g} {change:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workdir", type=Path, default=Path("bench_work"), help="data and outputs go here")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--floats", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=100)
+    parser.add_argument("--levels", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes for generation and ingestion")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--batch-size", type=int, default=256, help="encoder batch size")
+    parser.add_argument("--encode-processes", type=int, default=1)
+    parser.add_argument("--encoder", default=None, help="torch, onnx or onnx-int8 (see encoder.py)")
+    parser.add_argument("--threads", type=int, default=None, help="encoder threads")
+    parser.add_argument("--queries", type=int, default=500, help="questions for the retrieve stage")
+    parser.add_argument("--answer-queries", type=int, default=200, help="questions for the answer stage")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8, help="answers generated at once")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="fake LLM seconds per token")
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="fake LLM prefill seconds")
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON result here")
+    parser.add_argument("--compare", type=Path, default=None, help="earlier JSON result to compare against")
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    options = {name: getattr(args, name) for name in (
+        "floats", "cycles", "levels", "seed", "workers", "index_type", "dtype", "batch_size", "encode_processes",
+        "encoder", "threads", "queries", "answer_queries", "k", "concurrency", "token_delay", "first_token_delay")}
+    commit, dirty = git_commit()
+    report = {"commit": commit, "dirty": dirty, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "config": options, "stages": {}}
+    for name in STAGES:
+        if name not in args.stages:
+            continue
+        print(f"⏱️  {name}...", file=sys.stderr)
+        result = run_stage(str(args.workdir.resolve()), name, options)
+        report["stages"][name] = result
+        print(f"   {json.dumps(result)}", file=sys.stderr)
+        if "error" in result:
+            break
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    print(text)
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
@@ -0,0 +1,396 @@
+"""Gridded climatology of temperature and salinity, binned from QC-passed profile levels.
+
+A chunked Zarr cube over (month, depth bin, latitude, longitude), 1°×1° by
+default, holding per cell and variable the count, sum and sum of squares
+of the good levels, and per cell the number of distinct profiles they
+come from. Mean and standard deviation follow from those, so new
+profiles are added (and re-ingested ones subtracted) without reprocessing
+the archive. The cube records which profile-store entry of each profile
+it holds, so every run bins only what is new or changed, and takes out
+profiles that are no longer stored. After
+ProfileStore.compact() the entries no longer line up, and the cube is
+rebuilt. An interrupted update also leaves a marker that forces a rebuild.
+
+Layout of `argo_climatology.zarr/`:
+    count_t, count_s                    int32   [month, depth, lat, lon]
+    sum_t, sumsq_t, sum_s, sumsq_s      float64 [month, depth, lat, lon]
+    profiles                            int32   [month, depth, lat, lon]
+    profile_keys, profile_entries, ...  profiles already binned, with their positions
+                                        and what each added to its surface cell
+
+lookup() gives cell statistics for positions and months, and anomalies()
+compares retrieved profiles with the climatology of their cells, leaving
+each profile's own levels out of its cell mean. A spread or an anomaly is
+only given for cells with at least MIN_PROFILES distinct profiles. The
+context builder turns these into a few lines of regional context.
+
+read_multiple.py updates it after each ingestion. By hand:  python climatology.py
+"""
+import argparse
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import zarr
+
+from profile_store import ProfileStore, profile_key, valid_key
+from profile_summaries import qc_mask
+
+CLIMATOLOGY_PATH = "argo_climatology.zarr"
+RESOLUTION_DEG = 1.0
+DEPTH_EDGES = np.array([0, 10, 20, 30, 50, 75, 100, 125, 150, 200, 250, 300, 400, 500, 600, 700, 800, 900, 1000,
+                        1200, 1500, 2000, 6000], dtype=np.float64)  # dbar; bins are [edge, next edge)
+CHUNK_DEG = 10  # lat/lon cells per chunk; a chunk holds every depth of one month
+VARIABLES = {"t": 1, "s": 2}  # cube suffix → column in the profile store's values
+STAT_ARRAYS = ("count_t", "sum_t", "sumsq_t", "count_s", "sum_s", "sumsq_s", "profiles")
+# Per binned profile: its key, store entry and the position it was binned at (to subtract it exactly),
+# and its good levels and their sum in the surface bin (to leave it out of its own anomaly)
+SURFACE_FIELDS = {"surface_count_t": "int32", "surface_sum_t": "float64", "surface_count_s": "int32",
+                  "surface_sum_s": "float64"}
+PROFILE_FIELDS = {"keys": "int64", "entries": "int64", "lat": "float64", "lon": "float64", "month": "int64",
+                  **SURFACE_FIELDS}
+POSITION_COLUMNS = ["float_id", "cycle_number", "latitude", "longitude", "datetime"]  # what update() reads
+FORMAT_VERSION = 2  # cubes written with another layout are rebuilt
+MIN_PROFILES = 3  # distinct profiles a cell needs before its spread and anomalies are quoted
+MONTH_NAMES = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+               "November", "December")
+
+
+def cell_index(latitudes, longitudes, resolution=RESOLUTION_DEG):
+    """(lat, lon) grid indices; longitudes wrap, latitudes are clipped to the grid."""
+    n_lat, n_lon = int(round(180 / resolution)), int(round(360 / resolution))
+    lat = np.clip(np.floor((np.asarray(latitudes, np.float64) + 90.0) / resolution), 0, n_lat - 1).astype(np.int64)
+    lon = (np.floor((np.asarray(longitudes, np.float64) + 180.0) / resolution) % n_lon).astype(np.int64)
+    return lat, lon
+
+
+def cell_centre(lat_index, lon_index, resolution=RESOLUTION_DEG):
+    return -90.0 + (lat_index + 0.5) * resolution, -180.0 + (lon_index + 0.5) * resolution
+
+
+def depth_bin(pressures):
+    """Depth bin of each pressure, or -1 outside DEPTH_EDGES."""
+    pres = np.asarray(pressures, np.float64)
+    bins = np.searchsorted(DEPTH_EDGES, pres, side="right") - 1
+    return np.where((pres >= DEPTH_EDGES[0]) & (pres < DEPTH_EDGES[-1]), bins, -1)
+
+
+def bin_levels(values, qc, offsets, latitudes, longitudes, months, resolution=RESOLUTION_DEG):
+    """Per-cell sums for profiles laid out as values[offsets[i]:offsets[i + 1]].
+
+    `latitudes`, `longitudes` and `months` (1-12) are per profile. Returns
+    (coords, stats): coords a tuple of (month, depth, lat, lon) index arrays
+    of the touched cells, stats {name in STAT_ARRAYS: per-cell array}.
+    """
+    counts = np.diff(offsets)
+    lat_i, lon_i = cell_index(latitudes, longitudes, resolution)
+    month = np.asarray(months, np.int64) - 1
+    profile_ok = np.isfinite(np.asarray(latitudes, np.float64)) & np.isfinite(np.asarray(longitudes, np.float64))
+    profile_ok &= (month >= 0) & (month < 12)
+    level_profile = np.repeat(np.arange(len(counts)), counts)
+    good = qc_mask(values, qc)
+    depth = depth_bin(values[:, 0])
+    level_ok = profile_ok[level_profile] & (depth >= 0)
+
+    n_depth, n_lat, n_lon = len(DEPTH_EDGES) - 1, int(round(180 / resolution)), int(round(360 / resolution))
+    cells = (((month[level_profile] * n_depth + depth) * n_lat + lat_i[level_profile]) * n_lon
+             + lon_i[level_profile])
+    used = level_ok & (good[:, 1] | good[:, 2])
+    unique, inverse = np.unique(cells[used], return_inverse=True)
+    stats = {}
+    for suffix, column in VARIABLES.items():
+        ok = good[used, column]
+        x = np.where(ok, values[used, column].astype(np.float64), 0.0)
+        stats[f"count_{suffix}"] = np.bincount(inverse, weights=ok, minlength=len(unique)).astype(np.int32)
+        stats[f"sum_{suffix}"] = np.bincount(inverse, weights=x, minlength=len(unique))
+        stats[f"sumsq_{suffix}"] = np.bincount(inverse, weights=x * x, minlength=len(unique))
+    # Distinct profiles per cell: unique (cell, profile) pairs
+    n_profiles = max(len(counts), 1)
+    pairs = np.unique(inverse * n_profiles + level_profile[used])
+    stats["profiles"] = np.bincount(pairs // n_profiles, minlength=len(unique)).astype(np.int32)
+    coords = np.unravel_index(unique, (12, n_depth, n_lat, n_lon))
+    return tuple(np.asarray(c, np.int64) for c in coords), stats
+
+
+def surface_levels(values, qc, offsets):
+    """Per profile and variable: its good levels in the surface bin and their sum ({name in SURFACE_FIELDS})."""
+    counts = np.diff(offsets)
+    level_profile = np.repeat(np.arange(len(counts)), counts)
+    good = qc_mask(values, qc)
+    surface = depth_bin(values[:, 0]) == 0
+    out = {}
+    for suffix, column in VARIABLES.items():
+        ok = good[:, column] & surface
+        x = np.where(ok, values[:, column].astype(np.float64), 0.0)
+        out[f"surface_count_{suffix}"] = np.bincount(level_profile, weights=ok, minlength=len(counts)).astype(np.int32)
+        out[f"surface_sum_{suffix}"] = np.bincount(level_profile, weights=x, minlength=len(counts))
+    return out
+
+
+class Climatology:
+    """The cube on disk, with incremental updates and vectorized lookups."""
+
+    def __init__(self, path=CLIMATOLOGY_PATH, mode="r"):
+        self.path = Path(path)
+        self.group = zarr.open_group(str(self.path), mode=mode)
+        self.resolution = float(self.group.attrs.get("resolution", RESOLUTION_DEG))
+        self._profiles = None
+
+    @classmethod
+    def create(cls, path=CLIMATOLOGY_PATH, resolution=RESOLUTION_DEG):
+        shutil.rmtree(path, ignore_errors=True)
+        group = zarr.open_group(str(path), mode="w")
+        shape = (12, len(DEPTH_EDGES) - 1, int(round(180 / resolution)), int(round(360 / resolution)))
+        chunks = (1, shape[1], CHUNK_DEG, CHUNK_DEG)
+        for name in STAT_ARRAYS:
+            dtype = "int32" if name.startswith("count") or name == "profiles" else "float64"
+            group.create_array(name, shape=shape, chunks=chunks, dtype=dtype, fill_value=0)
+        for name, dtype in PROFILE_FIELDS.items():
+            group.create_array(f"profile_{name}", shape=(0,), dtype=dtype, fill_value=0)
+        group.attrs.update({"resolution": resolution, "depth_edges": DEPTH_EDGES.tolist(), "updating": False,
+                            "format": FORMAT_VERSION})
+        return cls(path, mode="a")
+
+    @property
+    def n_profiles(self):
+        return int(self.group["profile_keys"].shape[0])
+
+    @property
+    def outdated(self):
+        """True for a cube written with an older layout (it must be rebuilt)."""
+        return self.group.attrs.get("format") != FORMAT_VERSION
+
+    def _binned(self):
+        """The per-profile table, read once per instance."""
+        if self._profiles is None:
+            self._profiles = {name: self.group[f"profile_{name}"][:] for name in PROFILE_FIELDS}
+        return self._profiles
+
+    def _add(self, coords, stats, sign=1):
+        for name, delta in stats.items():
+            array = self.group[name]
+            current = array.vindex[coords]
+            array.vindex[coords] = current + (sign * delta).astype(current.dtype)
+
+    def update(self, store, metadata, chunk_profiles=100_000):
+        """Bring the binned profiles in line with the store; returns how many were binned.
+
+        Profiles that are new or whose store entry changed are binned (less
+        the previous entry, if any), and profiles no longer stored (their
+        batch was swept or dropped) are subtracted. `metadata` supplies
+        positions and dates by (float_id, cycle_number) and needs to cover
+        only the new profiles: a changed one keeps the position it was
+        binned at unless `metadata` has another. New profiles it does not
+        cover are left for a later update.
+        """
+        if self.group.attrs.get("updating"):
+            raise RuntimeError(f"{self.path} was left mid-update")
+        if self.outdated:
+            raise RuntimeError(f"{self.path} was written with an older layout")
+        float_ids, cycles = store.keys()
+        keys = profile_key(float_ids, cycles)
+        entries = store.find(float_ids, cycles)
+        done = {name: self.group[f"profile_{name}"][:] for name in PROFILE_FIELDS}
+        gone = np.ones(len(done["keys"]), dtype=bool)
+        if not len(done["keys"]):
+            # One sentinel row (key -1 matches nothing), so lookups below need no special case
+            done = {name: np.array([-1 if name in ("keys", "entries") else 0], dtype=dtype)
+                    for name, dtype in PROFILE_FIELDS.items()}
+            gone = np.zeros(1, dtype=bool)
+        pos = np.minimum(np.searchsorted(done["keys"], keys), len(done["keys"]) - 1)
+        known = done["keys"][pos] == keys
+        gone[pos[known]] = False
+
+        positions = (metadata.drop_duplicates(["float_id", "cycle_number"], keep="last")
+                     .astype({"float_id": np.int64, "cycle_number": np.int64})
+                     .set_index(["float_id", "cycle_number"])[["latitude", "longitude", "datetime"]])
+        aligned = positions.reindex(pd.MultiIndex.from_arrays([float_ids.astype(np.int64), cycles.astype(np.int64)]))
+        lat = aligned["latitude"].to_numpy(np.float64)
+        lon = aligned["longitude"].to_numpy(np.float64)
+        month = pd.to_datetime(aligned["datetime"]).dt.month.to_numpy(np.float64)
+        given = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(month)
+        lat = np.where(given, lat, done["lat"][pos])
+        lon = np.where(given, lon, done["lon"][pos])
+        month = np.where(given, np.nan_to_num(month), done["month"][pos]).astype(np.int64)
+        located = given | known
+
+        todo = np.flatnonzero(located & (~known | (done["entries"][pos] != entries)))
+        # Re-ingested profiles and profiles no longer stored: take out what their entry added, where it was binned
+        old = np.concatenate([pos[todo[known[todo]]], np.flatnonzero(gone)])
+        old_entries = done["entries"][old]
+        if len(old_entries) and (np.any(old_entries >= len(store.records))
+                                 or np.any(profile_key(store.records["float_id"][old_entries],
+                                                       store.records["cycle_number"][old_entries]) != done["keys"][old])):
+            raise RuntimeError(f"{self.path} predates a compaction of the profile store")
+
+        self.group.attrs["updating"] = True
+        self._profiles = None
+        surface = {name: np.zeros(len(todo), dtype=dtype) for name, dtype in SURFACE_FIELDS.items()}
+        passes = [(-1, old_entries, done["lat"][old], done["lon"][old], done["month"][old]),
+                  (1, entries[todo], lat[todo], lon[todo], month[todo])]
+        for sign, batch, batch_lat, batch_lon, batch_month in passes:
+            for i in range(0, len(batch), chunk_profiles):
+                part = slice(i, i + chunk_profiles)
+                values, qc, offsets = store.gather(batch[part])
+                coords, stats = bin_levels(values, qc, offsets, batch_lat[part], batch_lon[part], batch_month[part],
+                                           self.resolution)
+                self._add(coords, stats, sign)
+                if sign > 0:
+                    for name, added in surface_levels(values, qc, offsets).items():
+                        surface[name][part] = added
+
+        # Record what is binned now; profiles still without a position are binned by a later update
+        recorded = {"keys": keys, "entries": entries, "lat": lat, "lon": lon, "month": month}
+        for name in SURFACE_FIELDS:
+            recorded[name] = done[name][pos].copy()
+            recorded[name][todo] = surface[name]
+        for name, dtype in PROFILE_FIELDS.items():
+            values = np.asarray(recorded[name][located], dtype=dtype)
+            self.group.create_array(f"profile_{name}", shape=values.shape, dtype=dtype, fill_value=0,
+                                    overwrite=True)[:] = values
+        self.group.attrs["updating"] = False
+        return len(todo)
+
+    def unbinned_floats(self, store, metadata):
+        """Float IDs with stored profiles that are neither binned nor covered by `metadata`."""
+        float_ids, cycles = store.keys()
+        covered = np.isin(profile_key(float_ids, cycles), self.group["profile_keys"][:])
+        if len(metadata):
+            given = metadata.dropna(subset=["latitude", "longitude", "datetime"])
+            f, c = given["float_id"].to_numpy(np.float64), given["cycle_number"].to_numpy(np.float64)
+            keyed = valid_key(f, c)
+            covered |= np.isin(profile_key(float_ids, cycles), profile_key(f[keyed], c[keyed]))
+        return np.unique(float_ids[~covered]).tolist()
+
+    def lookup(self, latitudes, longitudes, months, depth=None):
+        """Cell statistics for each (lat, lon, month 1-12), all depths or one depth bin.
+
+        Returns {"count_t", "mean_t", "std_t", "count_s", "mean_s", "std_s", "profiles"},
+        each [n, depths] (or [n] for one depth); NaN where a cell has no data,
+        and std NaN where it has fewer than MIN_PROFILES profiles.
+        """
+        lat_i, lon_i = cell_index(latitudes, longitudes, self.resolution)
+        month = np.asarray(months, np.int64) - 1
+        depths = np.arange(len(DEPTH_EDGES) - 1) if depth is None else np.array([depth])
+        n = len(lat_i)
+        coords = (np.repeat(month, len(depths)), np.tile(depths, n), np.repeat(lat_i, len(depths)),
+                  np.repeat(lon_i, len(depths)))
+        shape = (n, len(depths)) if depth is None else (n,)
+        profiles = self.group["profiles"].vindex[coords]
+        out = {"profiles": profiles.reshape(shape).astype(np.int64)}
+        for suffix in VARIABLES:
+            count = self.group[f"count_{suffix}"].vindex[coords].astype(np.float64)
+            total = self.group[f"sum_{suffix}"].vindex[coords]
+            squares = self.group[f"sumsq_{suffix}"].vindex[coords]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(count > 0, total / count, np.nan)
+                var = np.where((count > 1) & (profiles >= MIN_PROFILES),
+                               np.maximum(squares / count - mean ** 2, 0.0) * count / (count - 1), np.nan)
+            out[f"count_{suffix}"] = count.reshape(shape).astype(np.int64)
+            out[f"mean_{suffix}"] = mean.reshape(shape)
+            out[f"std_{suffix}"] = np.sqrt(var).reshape(shape)
+        return out
+
+    def _own_surface(self, rows, lat_i, lon_i, months):
+        """What each row's profile added to the surface cell it falls in ({SURFACE_FIELDS}, "profiles")."""
+        binned = self._binned()
+        here = np.zeros(len(rows), dtype=bool)
+        pos = np.zeros(len(rows), dtype=np.int64)
+        if len(binned["keys"]) and "cycle_number" in rows:
+            float_ids = rows["float_id"].to_numpy(np.float64)
+            cycles = rows["cycle_number"].to_numpy(np.float64)
+            keyed = valid_key(float_ids, cycles)
+            keys = np.full(len(rows), -1, dtype=np.int64)
+            keys[keyed] = profile_key(float_ids[keyed], cycles[keyed])
+            pos = np.minimum(np.searchsorted(binned["keys"], keys), len(binned["keys"]) - 1)
+            binned_lat, binned_lon = cell_index(binned["lat"][pos], binned["lon"][pos], self.resolution)
+            here = (keyed & (binned["keys"][pos] == keys) & (binned_lat == lat_i) & (binned_lon == lon_i)
+                    & (binned["month"][pos] == months))
+        own = {name: np.where(here, binned[name][pos] if len(binned["keys"]) else 0, 0) for name in SURFACE_FIELDS}
+        own["profiles"] = (own["surface_count_t"] > 0) | (own["surface_count_s"] > 0)
+        return own
+
+    def anomalies(self, rows):
+        """Surface temperature / salinity of each row minus its cell's surface climatology without that profile.
+
+        `rows` needs float_id, cycle_number, latitude, longitude, datetime and
+        the profile summaries (surface_temperature, surface_salinity); returns
+        a DataFrame with clim_t, clim_s, anomaly_t, anomaly_s and n (the other
+        profiles in the cell). Cells with fewer than MIN_PROFILES other
+        profiles give NaN, as do rows without a position or date.
+        """
+        months = pd.to_datetime(rows["datetime"]).dt.month.to_numpy(np.float64)
+        located = rows["latitude"].notna().to_numpy() & rows["longitude"].notna().to_numpy() & ~np.isnan(months)
+        if not located.all():
+            return self.anomalies(rows[located]).reindex(rows.index)
+        months = months.astype(np.int64)
+        lat_i, lon_i = cell_index(rows["latitude"].to_numpy(), rows["longitude"].to_numpy(), self.resolution)
+        coords = (months - 1, np.zeros(len(rows), dtype=np.int64), lat_i, lon_i)
+        own = self._own_surface(rows, lat_i, lon_i, months)
+        others = self.group["profiles"].vindex[coords].astype(np.int64) - own["profiles"]
+        out = pd.DataFrame({"n": others}, index=rows.index)
+        for suffix, column in (("t", "surface_temperature"), ("s", "surface_salinity")):
+            count = self.group[f"count_{suffix}"].vindex[coords] - own[f"surface_count_{suffix}"]
+            total = self.group[f"sum_{suffix}"].vindex[coords] - own[f"surface_sum_{suffix}"]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                clim = np.where((count > 0) & (others >= MIN_PROFILES), total / count, np.nan)
+            observed = rows[column].astype("float64").to_numpy() if column in rows else np.full(len(rows), np.nan)
+            out[f"clim_{suffix}"] = clim
+            out[f"anomaly_{suffix}"] = observed - clim
+        return out[["clim_t", "clim_s", "anomaly_t", "anomaly_s", "n"]]
+
+
+def open_climatology(path=CLIMATOLOGY_PATH):
+    """The climatology if it has been built (with the current layout), else None."""
+    if not Path(path).exists():
+        return None
+    climatology = Climatology(path)
+    if climatology.outdated:
+        print(f"⚠ {path} was written with an older layout; rebuild it with: python climatology.py --full")
+        return None
+    return climatology
+
+
+def build(path=CLIMATOLOGY_PATH, full=False, resolution=RESOLUTION_DEG, store=None, metadata=None,
+          metadata_root=None):
+    """Bring the cube up to date with the profile store; returns (climatology, profiles binned).
+
+    `metadata` only needs the rows of the profiles ingested since the last
+    update (read_multiple.py passes the batches it wrote). Positions of any
+    other profile still to be binned, all of them for a new cube, are read
+    for their floats from `metadata_root`.
+    """
+    from columnar_store import METADATA_DATASET, load_metadata
+
+    store = store or ProfileStore()
+    metadata = metadata if metadata is not None else pd.DataFrame(columns=POSITION_COLUMNS)
+
+    def update(climatology):
+        missing = climatology.unbinned_floats(store, metadata)
+        if missing:
+            loaded = load_metadata(metadata_root or METADATA_DATASET, columns=POSITION_COLUMNS, float_ids=missing)
+            frames = [loaded[POSITION_COLUMNS]] + ([metadata[POSITION_COLUMNS]] if len(metadata) else [])
+            return climatology.update(store, pd.concat(frames, ignore_index=True))
+        return climatology.update(store, metadata)
+
+    if not full and Path(path).exists():
+        climatology = Climatology(path, mode="a")
+        try:
+            return climatology, update(climatology)
+        except RuntimeError as e:
+            print(f"⚠ {e}; rebuilding it")
+    climatology = Climatology.create(path, resolution)
+    return climatology, update(climatology)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch instead of adding new profiles")
+    parser.add_argument("--resolution", type=float, default=RESOLUTION_DEG, help="grid spacing in degrees (--full)")
+    args = parser.parse_args()
+
+    climatology, binned = build(full=args.full, resolution=args.resolution)
+    cells = int((climatology.group["count_t"][:] > 0).sum())
+    print(f"✅ {binned} profiles binned; {climatology.n_profiles} in {CLIMATOLOGY_PATH}, "
+          f"{cells} month/depth/{climatology.resolution:g}° cells with temperature data")
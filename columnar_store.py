@@ -0,0 +1,229 @@
+"""Parquet datasets for float metadata and profile levels, partitioned by year/month.
+
+Layout (hive partitioning, so readers can prune directories):
+    argo_metadata.parquet/year=2013/month=10/part-....parquet
+    argo_profiles.parquet/year=2013/month=10/part-....parquet
+
+Columns are typed once at write time (int float_id, float32 coordinates,
+native timestamps), so readers never re-parse strings. Filters on time are
+resolved against the partition directories; filters on latitude/longitude
+are pushed down to Parquet row-group statistics.
+
+Convert existing CSV output with:  python columnar_store.py
+"""
+import shutil
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+METADATA_DATASET = "argo_metadata.parquet"
+PROFILES_DATASET = "argo_profiles.parquet"
+METADATA_CSV = "argo_metadata.csv"
+
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]), flavor="hive")
+
+METADATA_SCHEMA = pa.schema([
+    ("row_id", pa.int64()),
+    ("float_id", pa.int64()),
+    ("cycle_number", pa.int32()),
+    ("latitude", pa.float32()),
+    ("longitude", pa.float32()),
+    ("datetime", pa.timestamp("ns")),
+    ("year", pa.int16()),
+    ("month", pa.int8()),
+])
+
+PROFILE_SCHEMA = pa.schema([
+    ("float_id", pa.int64()),
+    ("cycle_number", pa.int32()),
+    ("pressure", pa.float32()),
+    ("temperature", pa.float32()),
+    ("salinity", pa.float32()),
+    ("pres_qc", pa.int8()),
+    ("temp_qc", pa.int8()),
+    ("sal_qc", pa.int8()),
+    ("datetime", pa.timestamp("ns")),
+    ("year", pa.int16()),
+    ("month", pa.int8()),
+])
+
+
+def qc_flags_to_int(values):
+    """Argo QC flags arrive as bytes/str ('1', b'4', ...) or numbers; store them as int8, -1 if missing."""
+    series = pd.Series(values)
+    if series.dtype == object:
+        series = series.map(lambda v: v.decode() if isinstance(v, bytes) else v)
+    return pd.to_numeric(series, errors="coerce").fillna(-1).astype("int8")
+
+
+def _with_partitions(df):
+    df = df.copy()
+    df["datetime"] = pd.to_datetime(df["datetime"]).astype("datetime64[ns]")
+    df["year"] = df["datetime"].dt.year.astype("int16")
+    df["month"] = df["datetime"].dt.month.astype("int8")
+    return df
+
+
+def to_metadata_table(df):
+    """Coerce a metadata frame to METADATA_SCHEMA; `row_id` defaults to the frame index."""
+    df = _with_partitions(df)
+    if "row_id" not in df.columns:
+        df["row_id"] = df.index.to_numpy()
+    df["float_id"] = pd.to_numeric(df["float_id"].astype(str).str.strip()).astype("int64")
+    df["cycle_number"] = pd.to_numeric(df["cycle_number"]).astype("int32")
+    df["latitude"] = df["latitude"].astype("float32")
+    df["longitude"] = df["longitude"].astype("float32")
+    return pa.Table.from_pandas(df[METADATA_SCHEMA.names], schema=METADATA_SCHEMA, preserve_index=False)
+
+
+def to_profile_table(df):
+    """Coerce a profile-level frame to PROFILE_SCHEMA."""
+    df = _with_partitions(df)
+    df["float_id"] = pd.to_numeric(df["float_id"].astype(str).str.strip()).astype("int64")
+    df["cycle_number"] = pd.to_numeric(df["cycle_number"]).astype("int32")
+    for col in ["pressure", "temperature", "salinity"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+    for col in ["pres_qc", "temp_qc", "sal_qc"]:
+        df[col] = qc_flags_to_int(df[col]).to_numpy() if col in df.columns else -1
+    return pa.Table.from_pandas(df[PROFILE_SCHEMA.names], schema=PROFILE_SCHEMA, preserve_index=False)
+
+
+def write_dataset(table, root, replace=False, batch_id=None):
+    """Append `table` to a partitioned dataset (or replace the partitions it touches).
+
+    Files are named after `batch_id`, so one ingestion batch can later be
+    found (and removed) by name.
+    """
+    batch_id = batch_id or uuid.uuid4().hex[:12]
+    ds.write_dataset(
+        table, root, format="parquet", partitioning=PARTITIONING,
+        basename_template=f"part-{batch_id}-{{i}}.parquet",
+        existing_data_behavior="delete_matching" if replace else "overwrite_or_ignore",
+        max_rows_per_group=256 * 1024,
+    )
+    return batch_id
+
+
+def delete_batches(root, batch_ids):
+    """Remove the part files written by the given batches; returns how many were removed."""
+    removed = 0
+    root = Path(root)
+    if not root.exists():
+        return 0
+    for batch_id in batch_ids:
+        for part in root.rglob(f"part-{batch_id}-*.parquet"):
+            part.unlink()
+            removed += 1
+    return removed
+
+
+def read_batches(root, batch_ids, columns=None):
+    """Rows of the part files written by the given batches (e.g. before deleting them)."""
+    parts = [str(part) for batch_id in batch_ids for part in Path(root).rglob(f"part-{batch_id}-*.parquet")]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return ds.dataset(parts, format="parquet").to_table(columns=columns).to_pandas()
+
+
+def write_metadata(df, root=METADATA_DATASET, replace=False, batch_id=None):
+    return write_dataset(to_metadata_table(df), root, replace=replace, batch_id=batch_id)
+
+
+def write_profiles(df, root=PROFILES_DATASET, replace=False, batch_id=None):
+    return write_dataset(to_profile_table(df), root, replace=replace, batch_id=batch_id)
+
+
+def _time_filter(start=None, end=None):
+    """Partition (year/month) predicate plus an exact timestamp predicate."""
+    year, month, when = ds.field("year"), ds.field("month"), ds.field("datetime")
+    parts = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        parts.append((year > start.year) | ((year == start.year) & (month >= start.month)))
+        parts.append(when >= pa.scalar(start.value, pa.timestamp("ns")))
+    if end is not None:
+        end = pd.Timestamp(end)
+        parts.append((year < end.year) | ((year == end.year) & (month <= end.month)))
+        parts.append(when <= pa.scalar(end.value, pa.timestamp("ns")))
+    return _and_all(parts)
+
+
+def _and_all(parts):
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    expr = parts[0]
+    for part in parts[1:]:
+        expr = expr & part
+    return expr
+
+
+def metadata_filter(start=None, end=None, lat_range=None, lon_range=None, float_ids=None):
+    """Build a pushdown filter. A lon_range with min > max wraps across the antimeridian."""
+    parts = [_time_filter(start, end)]
+    if lat_range is not None:
+        parts.append((ds.field("latitude") >= lat_range[0]) & (ds.field("latitude") <= lat_range[1]))
+    if lon_range is not None:
+        lo, hi = lon_range
+        lon = ds.field("longitude")
+        parts.append(((lon >= lo) & (lon <= hi)) if lo <= hi else ((lon >= lo) | (lon <= hi)))
+    if float_ids is not None:
+        parts.append(ds.field("float_id").isin(pa.array(list(float_ids), pa.int64())))
+    return _and_all(parts)
+
+
+def open_dataset(root):
+    return ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+
+
+def read_metadata(root=METADATA_DATASET, columns=None, start=None, end=None,
+                  lat_range=None, lon_range=None, float_ids=None):
+    """Read metadata rows, indexed by row_id, reading only matching partitions/row groups."""
+    dataset = open_dataset(root)
+    if columns is not None and "row_id" not in columns:
+        columns = ["row_id"] + list(columns)
+    table = dataset.to_table(columns=columns, filter=metadata_filter(start, end, lat_range, lon_range, float_ids))
+    df = table.to_pandas()
+    return df.set_index("row_id").sort_index()
+
+
+def read_profiles(root=PROFILES_DATASET, columns=None, start=None, end=None, float_ids=None, cycles=None):
+    """Read profile levels, optionally for given floats (and cycles) inside a time window."""
+    dataset = open_dataset(root)
+    parts = [_time_filter(start, end)]
+    if float_ids is not None:
+        parts.append(ds.field("float_id").isin(pa.array(list(float_ids), pa.int64())))
+    if cycles is not None:
+        parts.append(ds.field("cycle_number").isin(pa.array(list(cycles), pa.int32())))
+    return dataset.to_table(columns=columns, filter=_and_all(parts)).to_pandas()
+
+
+def load_metadata(root=METADATA_DATASET, csv_path=METADATA_CSV, **filters):
+    """Metadata frame indexed by row ID: Parquet when available, else the legacy CSV."""
+    if Path(root).exists():
+        return read_metadata(root, **filters)
+    df = pd.read_csv(csv_path)
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    if "row_id" in df.columns:
+        df = df.set_index("row_id")
+    return df
+
+
+if __name__ == "__main__":
+    shutil.rmtree(METADATA_DATASET, ignore_errors=True)
+    meta = pd.read_csv(METADATA_CSV)
+    write_metadata(meta)
+    print(f"✅ {len(meta)} metadata rows → {METADATA_DATASET}")
+    if Path("argo_profiles.csv").exists():
+        shutil.rmtree(PROFILES_DATASET, ignore_errors=True)
+        rows = 0
+        for chunk in pd.read_csv("argo_profiles.csv", chunksize=1_000_000):
+            if "cycle_number" not in chunk.columns or "datetime" not in chunk.columns:
+                print("⚠ argo_profiles.csv predates cycle_number/datetime columns; re-run read_multiple.py instead")
+                break
+            write_profiles(chunk)
+            rows += len(chunk)
+        print(f"✅ {rows} profile levels → {PROFILES_DATASET}")
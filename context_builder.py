@@ -0,0 +1,256 @@
+"""Compact, token-budgeted prompt context from retrieved metadata rows.
+
+Rows are deduplicated and grouped by float. A float with one retrieved
+profile gets one line, as before:
+
+    Float 1900270 was at -15.145°N, 43.820°E on 2013-10-04 14:15: surface 26.1°C, ...
+
+A float with several gets one trajectory line (profile count, date range,
+bounding box, start and end position, ranges of its profile summaries),
+followed by its best-ranked profiles as short detail lines:
+
+    Float 2900012: 14 profiles from 2013-03-02 to 2013-07-30, -16.20 to -12.10°N, 60.10 to 64.00°E,
+        drifting from (-12.100, 60.100) to (-16.200, 64.000); surface 24.1–27.3°C, mixed layer 20–60 dbar.
+      - 2013-05-11 03:20 at -14.020°N, 62.310°E: surface 25.9°C, ...
+
+With a climatology (climatology.py), the cells holding the best-ranked
+profiles also get a line of regional context ahead of the floats:
+
+    Climatology of the 1° cell at -15.5°N, 43.5°E in October: surface 26.3±0.8°C, 35.10±0.12 PSU;
+        100 dbar 22.1±1.0°C, 35.02±0.08 PSU; ...; retrieved profiles here: +0.4°C, -0.03 PSU at the surface.
+
+Lines are packed into `max_tokens` in order of relevance (retrieval rank):
+every float's headline first, then climatology lines, then detail lines.
+Whatever does not fit is left out, and a last line says how many floats
+were omitted. Everything is formatted column-wise over all retrievals at
+once.
+"""
+import numpy as np
+import pandas as pd
+
+from climatology import MONTH_NAMES, cell_centre, cell_index, depth_bin
+from profile_summaries import summary_texts
+from tracing import span
+
+CONTEXT_KEY = ['float_id', 'latitude', 'longitude', 'datetime']
+CONTEXT_TOKENS = 1024  # leaves room for the template, question and answer in llama3.2's 2048-token default
+DETAIL_ROWS = 3  # profiles listed under a trajectory line, at most
+CHARS_PER_TOKEN = 3.0  # conservative for number-heavy text with Llama 3 tokenizers
+NOTE_TOKENS = 16  # reserved for the "omitted" line
+CLIMATOLOGY_CELLS = 2  # climatology lines per retrieval, at most
+CLIMATOLOGY_DEPTHS = (0, 100, 500, 1000)  # dbar; quoted from the climatology where it has data
+RANGE_COLUMNS = [  # (column, format of one end of the range, unit) summarized per trajectory
+    ("surface_temperature", "{:.1f}", "°C", "surface "),
+    ("surface_salinity", "{:.2f}", " PSU", ""),
+    ("mixed_layer_depth", "{:.0f}", " dbar", "mixed layer "),
+]
+
+
+def estimate_tokens(texts):
+    """Approximate prompt tokens of each text (a Series)."""
+    return np.ceil(texts.str.len().to_numpy() / CHARS_PER_TOKEN).astype(np.int64) + 1  # +1 for the newline
+
+
+def _fmt(values, fmt):
+    return values.astype("float64").map(fmt.format, na_action="ignore")
+
+
+def _known(values, fmt):
+    """_fmt() with "?" for missing values (e.g. a profile without a position fix)."""
+    return _fmt(values, fmt).astype(object).fillna("?")
+
+
+def _when(values, fmt='%Y-%m-%d %H:%M'):
+    """Formatted timestamps, "?" where missing."""
+    return pd.to_datetime(values).dt.strftime(fmt).astype(object).fillna("?")
+
+
+def _suffix(summaries):
+    return np.where(summaries != "", ": " + summaries + ".", ".")
+
+
+def context_lines(rows):
+    """'Float <id> was at <lat>°N, <lon>°E on <date>[: <summary>].' per row, built column-wise."""
+    if rows.empty:
+        return pd.Series([], dtype=object)
+    when = _when(rows['datetime'])
+    lines = ("Float " + rows['float_id'].astype(str)
+             + " was at " + _known(rows['latitude'], "{:.3f}") + "°N, " + _known(rows['longitude'], "{:.3f}")
+             + "°E on " + when)
+    return lines + _suffix(summary_texts(rows))
+
+
+def detail_lines(rows):
+    """'  - <date> at <lat>°N, <lon>°E[: <summary>].': a profile listed under its float's trajectory."""
+    if rows.empty:
+        return pd.Series([], dtype=object)
+    when = _when(rows['datetime'])
+    lines = ("  - " + when + " at " + _known(rows['latitude'], "{:.3f}") + "°N, "
+             + _known(rows['longitude'], "{:.3f}") + "°E")
+    return lines + _suffix(summary_texts(rows))
+
+
+def trajectory_lines(groups):
+    """One line per float from the per-float aggregates made in build_contexts()."""
+    if groups.empty:
+        return pd.Series([], dtype=object)
+
+    def span_of(low, high, fmt, unit):
+        lo, hi = _fmt(groups[low], fmt), _fmt(groups[high], fmt)
+        return pd.Series(np.where(lo == hi, lo + unit, lo + "–" + hi + unit), index=groups.index)
+
+    lines = ("Float " + groups["float_id"].astype(str) + ": " + groups["profiles"].astype(str)
+             + " profiles from " + _when(groups["start"], '%Y-%m-%d')
+             + " to " + _when(groups["end"], '%Y-%m-%d')
+             + ", " + _known(groups["lat_min"], "{:.2f}") + " to " + _known(groups["lat_max"], "{:.2f}") + "°N, "
+             + _known(groups["lon_min"], "{:.2f}") + " to " + _known(groups["lon_max"], "{:.2f}")
+             + "°E, drifting from ("
+             + _known(groups["first_lat"], "{:.3f}") + ", " + _known(groups["first_lon"], "{:.3f}") + ") to ("
+             + _known(groups["last_lat"], "{:.3f}") + ", " + _known(groups["last_lon"], "{:.3f}") + ")")
+    ranges = pd.Series("", index=groups.index, dtype=object)
+    for column, fmt, unit, label in RANGE_COLUMNS:
+        if f"{column}_min" not in groups:
+            continue
+        present = groups[f"{column}_min"].notna().to_numpy()
+        phrase = np.where(present, label + span_of(f"{column}_min", f"{column}_max", fmt, unit).astype(object), "")
+        ranges = ranges + np.where(present & (ranges != "").to_numpy(), ", ", "") + phrase
+    return lines + np.where(ranges != "", "; " + ranges + ".", ".")
+
+
+def _text(values, fmt):
+    """_fmt() with "" for missing values, also when all of them are missing."""
+    return _fmt(values, fmt).astype(object).fillna("")
+
+
+def climatology_lines(frame, climatology):
+    """'Climatology of the <res>° cell at <lat>°N, <lon>°E in <month>: ...' for each retrieval's best cells.
+
+    `frame` holds the rows of all retrievals with their "set" and "rank".
+    Cells are ranked by their best-ranked row; cells without any data are
+    skipped. Returns (set, rank, text) with rank the cell's order in its set.
+    """
+    located = frame[frame["latitude"].notna() & frame["longitude"].notna() & frame["datetime"].notna()]
+    lat_i, lon_i = cell_index(located["latitude"], located["longitude"], climatology.resolution)
+    cells = located[["set", "rank"]].assign(
+        lat_i=lat_i, lon_i=lon_i, month=located["datetime"].dt.month.to_numpy(np.int64)
+    ).join(climatology.anomalies(located))
+    cells = (cells.groupby(["set", "month", "lat_i", "lon_i"])
+             .agg(rank=("rank", "min"), anomaly_t=("anomaly_t", "mean"), anomaly_s=("anomaly_s", "mean"))
+             .reset_index().sort_values(["set", "rank"], kind="stable"))
+    cells = cells[cells.groupby("set").cumcount() < CLIMATOLOGY_CELLS].reset_index(drop=True)
+    if cells.empty:
+        return pd.DataFrame({"set": [], "rank": [], "text": []})
+    lat, lon = cell_centre(cells["lat_i"].to_numpy(), cells["lon_i"].to_numpy(), climatology.resolution)
+    stats = climatology.lookup(lat, lon, cells["month"].to_numpy())
+
+    levels = pd.Series("", index=cells.index, dtype=object)
+    for depth, column in zip(CLIMATOLOGY_DEPTHS, depth_bin(CLIMATOLOGY_DEPTHS)):
+        parts = []
+        for suffix, fmt, unit in (("t", "{:.1f}", "°C"), ("s", "{:.2f}", " PSU")):
+            mean = pd.Series(stats[f"mean_{suffix}"][:, column], index=cells.index)
+            std = pd.Series(stats[f"std_{suffix}"][:, column], index=cells.index)
+            text = _text(mean, fmt) + np.where(std.notna(), "±" + _text(std, fmt), "") + unit
+            parts.append(text.where(mean.notna(), ""))
+        phrase = parts[0] + np.where((parts[0] != "") & (parts[1] != ""), ", ", "") + parts[1]
+        label = "surface " if depth == 0 else f"{depth} dbar "
+        present = phrase != ""
+        levels = levels + np.where(present & (levels != ""), "; ", "") + np.where(present, label + phrase, "")
+
+    anomaly = pd.Series("", index=cells.index, dtype=object)
+    for suffix, decimals, unit in (("t", 1, "°C"), ("s", 2, " PSU")):
+        # Rounded first (and -0.0 + 0.0 is 0.0), so a tiny negative anomaly reads "+0.0", not "-0.0"
+        values = cells[f"anomaly_{suffix}"].round(decimals) + 0.0
+        text = (np.where(values >= 0, "+", "") + _text(values, f"{{:.{decimals}f}}")).where(values.notna(), "")
+        present = text != ""
+        anomaly = anomaly + np.where(present & (anomaly != ""), ", ", "") + np.where(present, text + unit, "")
+
+    month = cells["month"].map(lambda m: MONTH_NAMES[int(m) - 1])
+    lines = ("Climatology of the " + f"{climatology.resolution:g}" + "° cell at " + _fmt(pd.Series(lat), "{:.1f}")
+             + "°N, " + _fmt(pd.Series(lon), "{:.1f}") + "°E in " + month + ": " + levels
+             + np.where(anomaly != "", "; retrieved profiles here: " + anomaly + " at the surface.", "."))
+    present = levels != ""
+    return pd.DataFrame({"set": cells["set"], "rank": cells.groupby("set").cumcount(), "text": lines})[present]
+
+
+def _aggregate(frame):
+    """Per (retrieval, float) aggregates; `frame` is sorted by datetime."""
+    aggregations = {
+        "profiles": ("rank", "size"), "float_rank": ("rank", "min"),
+        "start": ("datetime", "min"), "end": ("datetime", "max"),
+        "lat_min": ("latitude", "min"), "lat_max": ("latitude", "max"),
+        "lon_min": ("longitude", "min"), "lon_max": ("longitude", "max"),
+        "first_lat": ("latitude", "first"), "first_lon": ("longitude", "first"),
+        "last_lat": ("latitude", "last"), "last_lon": ("longitude", "last"),
+    }
+    for column, *_ in RANGE_COLUMNS:
+        if column in frame:
+            aggregations[f"{column}_min"] = (column, "min")
+            aggregations[f"{column}_max"] = (column, "max")
+    return frame.groupby(["set", "float_id"], sort=False).agg(**aggregations).reset_index()
+
+
+def build_contexts(row_sets, max_tokens=CONTEXT_TOKENS, detail_rows=DETAIL_ROWS, climatology=None):
+    """build_context() for many retrievals, formatted in one pass."""
+    if not row_sets:
+        return []
+    with span("context", rows=sum(len(rows) for rows in row_sets)) as s:
+        deduped = [rows.drop_duplicates(subset=CONTEXT_KEY) for rows in row_sets]
+        frame = pd.concat(deduped, ignore_index=True)
+        if frame.empty:
+            return [""] * len(row_sets)
+        frame["set"] = np.repeat(np.arange(len(deduped)), [len(rows) for rows in deduped])
+        frame["rank"] = frame.groupby("set").cumcount()
+        frame["datetime"] = pd.to_datetime(frame["datetime"])
+        frame = frame.sort_values(["set", "datetime", "rank"], kind="stable")
+
+        groups = _aggregate(frame)
+        frame = frame.merge(groups[["set", "float_id", "profiles", "float_rank"]], on=["set", "float_id"])
+        single = frame["profiles"] == 1
+        several = groups["profiles"] > 1
+        multi = frame[~single].sort_values(["set", "rank"])
+        details = multi[multi.groupby(["set", "float_id"]).cumcount() < detail_rows]
+
+        # (set, float rank, tier, rank, text); tier 0 is a float's headline, tier 2 its detail lines.
+        # Climatology lines (tier 1) pack after the headlines but are written ahead of every float.
+        regional = climatology_lines(frame, climatology) if climatology is not None else None
+        items = pd.concat([
+            pd.DataFrame({"set": frame.loc[single, "set"], "float_rank": frame.loc[single, "float_rank"],
+                          "tier": 0, "rank": frame.loc[single, "rank"], "text": context_lines(frame[single])}),
+            pd.DataFrame({"set": groups.loc[several, "set"], "float_rank": groups.loc[several, "float_rank"],
+                          "tier": 0, "rank": -1, "text": trajectory_lines(groups[several])}),
+            pd.DataFrame({"set": details["set"], "float_rank": details["float_rank"], "tier": 2,
+                          "rank": details["rank"], "text": detail_lines(details)}),
+            regional.assign(float_rank=-1, tier=1) if regional is not None else None,
+        ], ignore_index=True)
+        items["tokens"] = estimate_tokens(items["text"])
+
+        # Pack by relevance: every headline before any detail line, best-ranked floats first
+        items = items.sort_values(["set", "tier", "float_rank", "rank"], kind="stable")
+        items = items.astype({"float_rank": np.int64, "tier": np.int64, "rank": np.int64})
+        if max_tokens is not None:
+            total = items.groupby("set")["tokens"].transform("sum")
+            budget = np.where(total > max_tokens, max_tokens - NOTE_TOKENS, max_tokens)
+            used = items.groupby("set")["tokens"].cumsum()
+            first = items.groupby("set").cumcount() == 0  # the best line always goes in
+            items = items.assign(keep=(used <= budget) | first)
+        else:
+            items = items.assign(keep=True)
+        kept = items[items["keep"]].sort_values(["set", "float_rank", "tier", "rank"], kind="stable")
+        s.set(tokens=int(kept["tokens"].sum()), omitted=int((~items["keep"]).sum()))
+
+        joined = kept.groupby("set")["text"].agg("\n".join)
+        headlines = items[items["tier"] == 0]
+        omitted = headlines[~headlines["keep"]].groupby("set").size()
+        profiles = groups.merge(headlines.loc[~headlines["keep"], ["set", "float_rank"]],
+                                on=["set", "float_rank"]).groupby("set")["profiles"].sum()
+    contexts = []
+    for i in range(len(row_sets)):
+        context = joined.get(i, "")
+        if i in omitted:
+            context += f"\n(+{omitted[i]} more floats with {profiles[i]} profiles omitted for length)"
+        contexts.append(context)
+    return contexts
+
+
+def build_context(rows, max_tokens=CONTEXT_TOKENS, detail_rows=DETAIL_ROWS, climatology=None):
+    return build_contexts([rows], max_tokens, detail_rows, climatology)[0]
@@ -0,0 +1,359 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+EMBEDDINGS_PATH = "argo_embeddings.npy"
+INDEX_PATH = "argo_index.faiss"
+
+# Fixed sentence embedded by every model we fingerprint; changing it invalidates stores
+FINGERPRINT_PROBE = "Float 1900270 at -15.145, 43.82 on 2013-10-04 14:15:09"
+
+# On-disk precisions; int8 is symmetric per-dimension quantization with the scales in <stem>_scale.npy
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+
+def sidecar(path, suffix):
+    """`<stem><suffix>` next to `path`: where the store and the index keep their companion files."""
+    path = Path(path)
+    return path.with_name(path.stem + suffix)
+
+
+def model_fingerprint(model, model_name):
+    """Hash of the model name, output dimension and its embedding of a probe sentence.
+
+    An ONNX export that passed its parity check (encoder.py) reports the
+    fingerprint of the reference model it was checked against.
+    """
+    reference = getattr(model, "reference_fingerprint", None)
+    if reference:
+        return reference
+    probe = np.asarray(model.encode([FINGERPRINT_PROBE], convert_to_numpy=True), dtype=np.float32)
+    digest = hashlib.sha256()
+    digest.update(model_name.encode())
+    digest.update(str(probe.shape[1]).encode())
+    # Rounded so harmless float noise between runs/hardware does not change the hash
+    digest.update(np.round(probe, 3).astype(np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class EmbeddingStore:
+    """Row embeddings on disk, memory-mapped and keyed by metadata row ID.
+
+    Layout, next to `argo_embeddings.npy`:
+      argo_embeddings_ids.npy   int64 row IDs, one per embedding row
+      argo_embeddings_meta.json model name, fingerprint, dimension, row count, dtype
+      argo_embeddings_scale.npy per-dimension scales (int8 stores only)
+
+    `embeddings` holds the stored precision; vectors_for() and iter_chunks()
+    always return float32.
+    """
+
+    def __init__(self, embeddings, row_ids, meta, scale=None, path=None):
+        self.embeddings = embeddings
+        self.row_ids = row_ids
+        self.meta = meta
+        self.scale = scale
+        self.path = path
+        self._order = np.argsort(row_ids, kind="stable")
+        self._sorted_ids = row_ids[self._order]
+
+    @property
+    def model_name(self):
+        return self.meta["model"]
+
+    @property
+    def dimension(self):
+        return int(self.meta["dimension"])
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @classmethod
+    def open(cls, path=EMBEDDINGS_PATH):
+        embeddings = np.load(path, mmap_mode="r")
+        ids_path = sidecar(path, "_ids.npy")
+        if ids_path.exists():
+            row_ids = np.load(ids_path)
+        else:
+            # Stores written before row IDs existed are positional
+            row_ids = np.arange(len(embeddings), dtype=np.int64)
+        meta_path = sidecar(path, "_meta.json")
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        meta.setdefault("model", None)
+        meta.setdefault("fingerprint", None)
+        meta.setdefault("dimension", embeddings.shape[1])
+        meta.setdefault("dtype", str(embeddings.dtype))
+        scale = np.load(sidecar(path, "_scale.npy")) if meta["dtype"] == "int8" else None
+        return cls(embeddings, row_ids, meta, scale, path)
+
+    @staticmethod
+    def write(embeddings, row_ids, model_name, fingerprint, path=EMBEDDINGS_PATH, dtype="float32"):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if len(embeddings) != len(row_ids):
+            raise ValueError(f"{len(embeddings)} embeddings but {len(row_ids)} row IDs")
+        scale = quantization_scale(np.abs(embeddings).max(axis=0)) if dtype == "int8" else None
+        np.save(path, quantize(embeddings, dtype, scale))
+        return _write_sidecars(path, row_ids, model_name, fingerprint, embeddings.shape[1], dtype, scale)
+
+    def check_model(self, model_name, fingerprint=None):
+        """Raise if vectors were produced by a different model than the query encoder."""
+        if self.meta["model"] is not None and self.meta["model"] != model_name:
+            raise ValueError(
+                f"Embeddings were built with '{self.meta['model']}', "
+                f"but queries are encoded with '{model_name}'")
+        if fingerprint and self.meta["fingerprint"] and self.meta["fingerprint"] != fingerprint:
+            raise ValueError(
+                f"Model fingerprint mismatch for '{model_name}': store has "
+                f"{self.meta['fingerprint']}, loaded model gives {fingerprint}")
+
+    def as_float32(self, vectors):
+        """Vectors read from `embeddings` (any stored precision) as float32."""
+        return dequantize(vectors, self.scale)
+
+    def without(self, row_ids, chunk_rows=100_000):
+        """Rewrite the store without `row_ids` (e.g. rows a re-ingest dropped); returns it reopened."""
+        keep = ~np.isin(self.row_ids, np.asarray(row_ids, dtype=np.int64))
+        path = Path(self.path)
+        tmp = path.with_name(path.stem + ".tmp.npy")
+        shape = (int(keep.sum()), self.embeddings.shape[1])
+        if shape[0] == 0:
+            np.save(tmp, np.empty(shape, dtype=self.embeddings.dtype))
+        else:
+            out = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.embeddings.dtype, shape=shape)
+            written = 0
+            for start in range(0, len(self.row_ids), chunk_rows):
+                part = self.embeddings[start:start + chunk_rows][keep[start:start + chunk_rows]]
+                out[written:written + len(part)] = part
+                written += len(part)
+            out.flush()
+            del out
+        tmp.replace(path)
+        _write_sidecars(path, self.row_ids[keep], self.meta["model"], self.meta["fingerprint"], self.dimension,
+                        self.meta["dtype"], self.scale)
+        return EmbeddingStore.open(path)
+
+    def iter_chunks(self, chunk_rows=100_000):
+        """Yield (float32 vectors, row IDs) in storage order, one bounded chunk at a time."""
+        for start in range(0, len(self.row_ids), chunk_rows):
+            yield (self.as_float32(self.embeddings[start:start + chunk_rows]),
+                   self.row_ids[start:start + chunk_rows])
+
+    def contains(self, row_ids):
+        """Boolean mask: which of `row_ids` have a stored embedding."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(len(row_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, row_ids), len(self._sorted_ids) - 1)
+        return self._sorted_ids[pos] == row_ids
+
+    def search(self, query_embeddings, row_ids, k=5):
+        """Exact L2 search over the stored vectors of `row_ids` (IDs without a vector are skipped).
+
+        Same result shape as search_subset(); for small filtered candidate
+        sets this is cheaper and more accurate than probing an approximate index.
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        row_ids = row_ids[self.contains(row_ids)]
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if len(row_ids) == 0:
+            return [(np.empty(0, np.float32), np.empty(0, np.int64)) for _ in query_embeddings]
+        distances, positions = faiss.knn(query_embeddings, np.ascontiguousarray(self.vectors_for(row_ids)),
+                                         min(k, len(row_ids)))
+        return [(d[p >= 0], row_ids[p[p >= 0]]) for d, p in zip(distances, positions)]
+
+    def vectors_for(self, row_ids):
+        """Gather the stored vectors for the given row IDs (missing IDs raise KeyError)."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            if len(row_ids):
+                raise KeyError(f"{len(row_ids)} row IDs have no stored embedding")
+            return np.empty((0, self.dimension), dtype=np.float32)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, row_ids), len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == row_ids
+        if not found.all():
+            raise KeyError(f"{int((~found).sum())} row IDs have no stored embedding")
+        return self.as_float32(self.embeddings[self._order[pos]])
+
+
+def quantization_scale(max_abs):
+    """Per-dimension int8 scale from the largest magnitude seen in each dimension."""
+    return np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+
+def quantize(vectors, dtype="float32", scale=None):
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}' (expected one of {STORAGE_DTYPES})")
+    if dtype == "int8":
+        return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    return np.ascontiguousarray(vectors, dtype=dtype)
+
+
+def dequantize(vectors, scale=None):
+    vectors = np.asarray(vectors)
+    if vectors.dtype == np.int8:
+        return vectors.astype(np.float32) * scale
+    return vectors.astype(np.float32, copy=False)
+
+
+def _write_sidecars(path, row_ids, model_name, fingerprint, dimension, dtype, scale):
+    np.save(sidecar(path, "_ids.npy"), row_ids)
+    if scale is not None:
+        np.save(sidecar(path, "_scale.npy"), scale)
+    meta = {
+        "model": model_name,
+        "fingerprint": fingerprint,
+        "dimension": int(dimension),
+        "rows": int(len(row_ids)),
+        "dtype": dtype,
+    }
+    sidecar(path, "_meta.json").write_text(json.dumps(meta, indent=2))
+    return meta
+
+
+class EmbeddingCheckpoint:
+    """Completed chunks of an embedding build, so an interrupted build resumes where it stopped.
+
+    Chunks live in `<stem>_chunks/` as float32 .npy files. The checkpoint is
+    discarded when the model, fingerprint, chunk size or input rows change.
+    finalize() streams the chunks into the store without loading them all.
+    """
+
+    def __init__(self, path, model_name, fingerprint, row_ids, chunk_rows):
+        self.path = Path(path)
+        self.dir = sidecar(path, "_chunks")
+        self.row_ids = np.asarray(row_ids, dtype=np.int64)
+        self.chunk_rows = chunk_rows
+        self.model_name = model_name
+        self.fingerprint = fingerprint
+        key = {
+            "model": model_name,
+            "fingerprint": fingerprint,
+            "chunk_rows": chunk_rows,
+            "rows": int(len(self.row_ids)),
+            "ids_sha1": hashlib.sha1(self.row_ids.tobytes()).hexdigest(),
+        }
+        key_path = self.dir / "checkpoint.json"
+        if key_path.exists() and json.loads(key_path.read_text()) != key:
+            shutil.rmtree(self.dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        key_path.write_text(json.dumps(key, indent=2))
+
+    def __len__(self):
+        return -(-len(self.row_ids) // self.chunk_rows)
+
+    def _chunk_path(self, i):
+        return self.dir / f"chunk-{i:06d}.npy"
+
+    def bounds(self, i):
+        return i * self.chunk_rows, min((i + 1) * self.chunk_rows, len(self.row_ids))
+
+    def done(self, i):
+        return self._chunk_path(i).exists()
+
+    def pending(self):
+        return [i for i in range(len(self)) if not self.done(i)]
+
+    def save(self, i, embeddings):
+        start, end = self.bounds(i)
+        if len(embeddings) != end - start:
+            raise ValueError(f"Chunk {i} should have {end - start} rows, got {len(embeddings)}")
+        # Written under a temporary name and renamed, so a crash never leaves a truncated chunk
+        tmp = self.dir / f"chunk-{i:06d}.tmp.npy"
+        np.save(tmp, np.asarray(embeddings, dtype=np.float32))
+        tmp.replace(self._chunk_path(i))
+
+    def _chunks(self):
+        for i in range(len(self)):
+            yield np.load(self._chunk_path(i), mmap_mode="r")
+
+    def finalize(self, dtype="float32", base=None):
+        """Write the completed store, remove the checkpoint and return the opened store.
+
+        With `base` (an open EmbeddingStore), the chunks are appended after its
+        rows, keeping its precision. An int8 base keeps its scales unless the
+        new rows exceed them; those dimensions are widened and the base rows
+        requantized, so no new vector is clipped.
+        """
+        missing = self.pending()
+        if missing:
+            raise RuntimeError(f"{len(missing)} chunks are not encoded yet")
+        dimension = next(self._chunks()).shape[1] if len(self) else base.dimension
+        scale = base_scale = None
+        n_base = len(base) if base is not None else 0
+        if base is not None:
+            dtype, scale = base.meta["dtype"], base.scale
+        if dtype == "int8":
+            max_abs = np.zeros(dimension, dtype=np.float32)
+            for chunk in self._chunks():
+                np.maximum(max_abs, np.abs(chunk).max(axis=0), out=max_abs)
+            if base is None:
+                scale = quantization_scale(max_abs)
+            elif np.any(quantization_scale(max_abs) > scale):
+                base_scale, scale = scale, np.maximum(scale, quantization_scale(max_abs))
+        # Built beside the live store and swapped in, so readers never see a half-written file
+        tmp = self.path.with_name(self.path.stem + ".tmp.npy")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.dtype(dtype),
+                                        shape=(n_base + len(self.row_ids), dimension))
+        for start in range(0, n_base, self.chunk_rows):
+            part = base.embeddings[start:start + self.chunk_rows]
+            out[start:start + len(part)] = part if base_scale is None else quantize(
+                dequantize(part, base_scale), dtype, scale)
+        for i, chunk in enumerate(self._chunks()):
+            start, end = self.bounds(i)
+            out[n_base + start:n_base + end] = quantize(chunk, dtype, scale)
+        out.flush()
+        del out
+        row_ids = self.row_ids if base is None else np.concatenate([base.row_ids, self.row_ids])
+        tmp.replace(self.path)
+        _write_sidecars(self.path, row_ids, self.model_name, self.fingerprint, dimension, dtype, scale)
+        shutil.rmtree(self.dir)
+        return EmbeddingStore.open(self.path)
+
+
+def build_id_index(embeddings, row_ids):
+    """Exact L2 index whose search results are metadata row IDs."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+    index.add_with_ids(embeddings, np.asarray(row_ids, dtype=np.int64))
+    return index
+
+
+def base_index(index):
+    """The concrete index inside an ID map."""
+    return faiss.downcast_index(index.index) if hasattr(index, "id_map") else faiss.downcast_index(index)
+
+
+def search_parameters(index, selector):
+    """SearchParameters carrying `selector` plus the index's own nprobe/efSearch.
+
+    Plain SearchParameters would search IVF/HNSW indexes at their default effort.
+    """
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_subset(index, query_embeddings, row_ids, k=5):
+    """Search the global index restricted to `row_ids` (e.g. from a structured filter).
+
+    Returns (distances, row_ids) for each query, dropping the -1 padding FAISS
+    uses when fewer than `k` rows are allowed.
+    """
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    params = None
+    if row_ids is not None:
+        params = search_parameters(index, faiss.IDSelectorBatch(np.asarray(row_ids, dtype=np.int64)))
+    distances, ids = index.search(query_embeddings, k, params=params)
+    results = []
+    for dist_row, id_row in zip(distances, ids):
+        keep = id_row >= 0
+        results.append((dist_row[keep], id_row[keep]))
+    return results
@@ -0,0 +1,357 @@
+"""Sentence encoders: the reference PyTorch model, or an ONNX export of it.
+
+Backends:
+    torch       SentenceTransformer(model_name), as before
+    onnx        the transformer exported to ONNX, run by onnxruntime
+    onnx-int8   the same export with dynamically quantized int8 weights
+
+The ONNX backends need only onnxruntime and tokenizers at run time (no
+PyTorch import), tokenize each batch to its own longest sentence, and
+encode sentences sorted by length so batches carry little padding. Pooling
+and normalization follow the reference model's modules.
+
+An export lives in onnx_models/<model_name>/ and records a parity check
+against the reference model: cosine similarity of the embeddings and
+recall@10 of their nearest neighbours on a sample. An export that failed
+its check, or was never checked, is refused (the parity check itself
+loads it with allow_unchecked). One that passed stands in for the reference model:
+it reports the reference fingerprint, so stores and indexes built with
+either backend are interchangeable.
+
+Configured from the environment (or per call):
+    FLOATCHAT_ENCODER          torch (default), onnx or onnx-int8
+    FLOATCHAT_ENCODER_THREADS  intra-op threads (default: the runtime's choice)
+
+Export with:  python encoder.py export all-MiniLM-L6-v2 --int8
+Re-check:     python encoder.py parity all-MiniLM-L6-v2 --backend onnx-int8
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+ONNX_DIR = Path("onnx_models")
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+CONFIG_NAME = "encoder.json"
+
+# Parity thresholds an export must meet against the reference model
+MIN_MEAN_COSINE = 0.99
+MIN_COSINE = 0.95
+MIN_RECALL = 0.9
+
+
+def default_backend():
+    return os.environ.get("FLOATCHAT_ENCODER") or "torch"
+
+
+def default_threads():
+    threads = os.environ.get("FLOATCHAT_ENCODER_THREADS")
+    return int(threads) if threads else None
+
+
+def export_dir(model_name, root=ONNX_DIR):
+    return Path(root) / model_name.replace("/", "__")
+
+
+def _read_config(directory):
+    path = Path(directory) / CONFIG_NAME
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def _write_config(directory, config):
+    path = Path(directory) / CONFIG_NAME
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(config, indent=2))
+    os.replace(tmp, path)
+
+
+class OnnxEncoder:
+    """encode()-compatible wrapper around an exported model in an onnxruntime session."""
+
+    def __init__(self, directory, backend="onnx", threads=None, allow_unchecked=False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.directory = Path(directory)
+        self.backend = backend
+        self.config = _read_config(self.directory)
+        if self.config is None:
+            raise FileNotFoundError(f"No ONNX export in {self.directory}; run `python encoder.py export`")
+        parity = self.config.get("parity", {}).get(backend)
+        if parity is None and not allow_unchecked:
+            raise ValueError(f"{backend} export of {self.config['model']} has no parity check; run "
+                             f"`python encoder.py parity {self.config['model']} --backend {backend}`")
+        if parity is not None and not parity["passed"]:
+            raise ValueError(f"{backend} export of {self.config['model']} failed its parity check: {parity}")
+        # Only a checked export may claim the reference model's fingerprint
+        self.reference_fingerprint = self.config["fingerprint"] if parity is not None else None
+        self.max_seq_length = self.config["max_seq_length"]
+
+        self.tokenizer = Tokenizer.from_file(str(self.directory / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(self.directory / ONNX_FILES[backend]), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def _encode_batch(self, sentences):
+        encodings = self.tokenizer.encode_batch(sentences)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64), "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **_):
+        """(n, dimension) float32 embeddings, in input order."""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        out = np.empty((len(sentences), self.config["dimension"]), dtype=np.float32)
+        # Similar lengths together, so each batch is padded only to its own longest sentence
+        order = np.argsort([len(s) for s in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            positions = order[start:start + batch_size]
+            out[positions] = self._encode_batch([sentences[i] for i in positions])
+        return out[0] if single else out
+
+
+class BatchingEncoder:
+    """Coalesces concurrent encode() calls from many threads into one batched call.
+
+    A caller waits at most `max_wait` seconds for others to join its batch.
+    Everything else is delegated to the wrapped encoder.
+    """
+
+    def __init__(self, encoder, max_batch=64, max_wait=0.002):
+        self.encoder = encoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True, name="encoder-batcher").start()
+
+    def __getattr__(self, name):
+        return getattr(self.encoder, name)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        if isinstance(sentences, str) or len(sentences) >= self.max_batch:
+            return self.encoder.encode(sentences, batch_size=batch_size, convert_to_numpy=True, **kwargs)
+        future = Future()
+        self._queue.put((list(sentences), future))
+        return future.result()
+
+    def _worker(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    pending.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+                size += len(pending[-1][0])
+            try:
+                embeddings = self.encoder.encode([s for texts, _ in pending for s in texts],
+                                                 batch_size=self.max_batch, convert_to_numpy=True)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for texts, future in pending:
+                future.set_result(np.asarray(embeddings[offset:offset + len(texts)]))
+                offset += len(texts)
+
+
+def load_encoder(model_name, backend=None, threads=None, onnx_dir=ONNX_DIR):
+    """The encoder for `model_name` on `backend` (default $FLOATCHAT_ENCODER, else torch)."""
+    backend = backend or default_backend()
+    threads = threads or default_threads()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {BACKENDS}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    return OnnxEncoder(export_dir(model_name, onnx_dir), backend, threads)
+
+
+def export(model_name, onnx_dir=ONNX_DIR, int8=True, opset=17):
+    """Export the reference model's transformer to ONNX (and int8); returns the export directory."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    from embedding_store import model_fingerprint
+
+    directory = export_dir(model_name, onnx_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next((m for m in model if isinstance(m, Pooling)), None)
+    if pooling is not None and not (pooling.pooling_mode_mean_tokens or pooling.pooling_mode_cls_token):
+        raise ValueError(f"{model_name}: only mean and CLS pooling are supported")
+
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(directory)
+    sample = tokenizer(["Float 1900270 at -15.145, 43.82"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class Wrapped(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(names, inputs))).last_hidden_state
+
+    fp32 = directory / ONNX_FILES["onnx"]
+    with torch.no_grad():
+        torch.onnx.export(Wrapped(transformer.auto_model.eval()), tuple(sample[n] for n in names), str(fp32),
+                          input_names=names, output_names=["last_hidden_state"], dynamic_axes=axes,
+                          opset_version=opset)
+    if int8:
+        quantize_dynamic(str(fp32), str(directory / ONNX_FILES["onnx-int8"]), weight_type=QuantType.QInt8,
+                         per_channel=True)
+
+    _write_config(directory, {
+        "model": model_name,
+        "fingerprint": model_fingerprint(model, model_name),
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(isinstance(m, Normalize) for m in model),
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "parity": {},
+    })
+    return directory
+
+
+def parity_sentences(n=2000, seed=0):
+    """Row texts sampled from the metadata, plus free-text questions like users ask."""
+    from columnar_store import load_metadata
+    from vect_db import row_texts
+
+    df = load_metadata()
+    rows = df.sample(min(n, len(df)), random_state=seed) if len(df) else df
+    return row_texts(rows).tolist() + [
+        "What ARGO floats were near -41N, 96E in 2013 and what patterns do they show?",
+        "Where do floats show warm fresh surface water?",
+        "Is there a deep mixed layer in the southern Indian Ocean in winter?",
+        "Which floats measured salinity above 35.5 near the equator?",
+        "Find floats at 10N, 60E on 2013",
+    ]
+
+
+def _timed_encode(encoder, sentences, batch_size):
+    encoder.encode(sentences[:batch_size], batch_size=batch_size, convert_to_numpy=True)  # warm-up
+    started = time.perf_counter()
+    embeddings = encoder.encode(sentences, batch_size=batch_size, convert_to_numpy=True)
+    return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - started
+
+
+def check_parity(model_name, backend="onnx-int8", sentences=None, threads=None, batch_size=64, k=10,
+                 onnx_dir=ONNX_DIR, reference=None):
+    """Compare an export against the reference model and record the result in its config.
+
+    Returns {"passed", "mean_cosine", "min_cosine", "recall_at_k", "speedup", ...}.
+    """
+    from embedding_store import model_fingerprint
+
+    directory = export_dir(model_name, onnx_dir)
+    config = _read_config(directory)
+    if config is None:
+        raise FileNotFoundError(f"No ONNX export in {directory}; run `python encoder.py export`")
+    sentences = sentences if sentences is not None else parity_sentences()
+    reference = reference or load_encoder(model_name, "torch", threads)
+    if model_fingerprint(reference, model_name) != config["fingerprint"]:
+        raise ValueError(f"{directory} was exported from a different {model_name}; export it again")
+    config["parity"].pop(backend, None)  # checked from scratch, not trusted from the last run
+    _write_config(directory, config)
+    candidate = OnnxEncoder(directory, backend, threads, allow_unchecked=True)
+
+    expected, reference_s = _timed_encode(reference, sentences, batch_size)
+    actual, candidate_s = _timed_encode(candidate, sentences, batch_size)
+    unit = lambda x: x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+    expected, actual = unit(expected), unit(actual)
+    cosine = (expected * actual).sum(axis=1)
+    # Do the same sentences come out as each other's nearest neighbours?
+    k = min(k, len(sentences) - 1)
+    neighbours = lambda x: np.argsort(-(x @ x.T), axis=1)[:, 1:k + 1]
+    expected_nn, actual_nn = neighbours(expected), neighbours(actual)
+    recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(expected_nn, actual_nn)]) if k else 1.0
+
+    result = {"sentences": len(sentences), "mean_cosine": round(float(cosine.mean()), 5),
+              "min_cosine": round(float(cosine.min()), 5), f"recall_at_{k}": round(float(recall), 4),
+              "reference_s": round(reference_s, 3), "backend_s": round(candidate_s, 3),
+              "speedup": round(reference_s / candidate_s, 2), "threads": threads,
+              "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+    result["passed"] = bool(cosine.mean() >= MIN_MEAN_COSINE and cosine.min() >= MIN_COSINE and recall >= MIN_RECALL)
+    config["parity"][backend] = result
+    _write_config(directory, config)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = commands.add_parser("export", help="export a model to ONNX and check its parity")
+    export_cmd.add_argument("model", nargs="?", default="all-MiniLM-L6-v2")
+    export_cmd.add_argument("--int8", action="store_true", help="also write a dynamically quantized int8 model")
+    parity_cmd = commands.add_parser("parity", help="re-run the parity check of an export")
+    parity_cmd.add_argument("model", nargs="?", default="all-MiniLM-L6-v2")
+    parity_cmd.add_argument("--backend", choices=BACKENDS[1:], default="onnx-int8")
+    for command in (export_cmd, parity_cmd):
+        command.add_argument("--onnx-dir", type=Path, default=ONNX_DIR)
+        command.add_argument("--threads", type=int, default=None, help="intra-op threads for both models")
+        command.add_argument("--sentences", type=int, default=2000, help="metadata rows sampled for the check")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        directory = export(args.model, args.onnx_dir, args.int8)
+        print(f"✅ Exported {args.model} to {directory}")
+        backends = ["onnx", "onnx-int8"] if args.int8 else ["onnx"]
+    else:
+        backends = [args.backend]
+    sentences = parity_sentences(args.sentences)
+    reference = load_encoder(args.model, "torch", args.threads)
+    failed = False
+    for backend in backends:
+        result = check_parity(args.model, backend, sentences, args.threads, onnx_dir=args.onnx_dir,
+                              reference=reference)
+        failed |= not result["passed"]
+        print(f"{'✅' if result['passed'] else '❌'} {backend}: {json.dumps(result)}")
+    raise SystemExit(1 if failed else 0)
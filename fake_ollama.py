@@ -0,0 +1,115 @@
+"""Local stand-in for `ollama serve`, for tests and benchmarks without a real model.
+
+Implements POST /api/generate in both streaming (NDJSON) and non-streaming
+form, with a configurable per-token delay and optional injected failures
+(503s for the first requests, a connection cut after some tokens, or a
+stream that ends cleanly, or on a half-written line, before its "done" chunk).
+
+Run with:  python fake_ollama.py --port 11435 --token-delay 0.02 --fail-first 2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+DEFAULT_ANSWER = ("The floats in the provided data drifted within the region over the period, "
+                  "with positions consistent with the prevailing circulation.")
+
+
+class FakeOllama:
+    def __init__(self, answer=DEFAULT_ANSWER, token_delay=0.01, first_token_delay=0.0, fail_first=0,
+                 cut_after=None, end_after=None, end_streams=None, garbage=False):
+        self.answer = answer
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.fail_first = fail_first
+        self.cut_after = cut_after  # drop the connection after this many streamed tokens
+        self.end_after = end_after  # end the body after this many tokens, without the "done" chunk
+        self.end_streams = end_streams  # ...for this many streams only (None: all of them)
+        self.garbage = garbage  # ...after writing half a chunk
+        self.streams = 0
+        self.requests = 0
+        self.cancelled = 0
+
+    def tokens(self, payload):
+        limit = payload.get("options", {}).get("num_predict")
+        words = self.answer.split(" ")
+        tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+        return tokens[:limit] if limit else tokens
+
+    async def handle_generate(self, request):
+        self.requests += 1
+        if self.requests <= self.fail_first:
+            return web.json_response({"error": "model is loading"}, status=503)
+        payload = await request.json()
+        tokens = self.tokens(payload)
+        started = time.perf_counter()
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(self.first_token_delay + self.token_delay * len(tokens))
+            return web.json_response({"model": payload.get("model"), "response": "".join(tokens), "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        self.streams += 1
+        end_after = self.end_after if self.end_streams is None or self.streams <= self.end_streams else None
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for i, token in enumerate(tokens):
+                if i == self.cut_after:
+                    # Mid-stream failure: the chunked body ends without its terminating chunk
+                    request.transport.close()
+                    return response
+                if i == end_after:
+                    if self.garbage:
+                        await response.write(b'{"model": "fake", "respo\n')
+                    await response.write_eof()
+                    return response
+                await asyncio.sleep(self.token_delay)
+                chunk = {"model": payload.get("model"), "response": token, "done": False}
+                await response.write(json.dumps(chunk).encode() + b"\n")
+            final = {"model": payload.get("model"), "response": "", "done": True,
+                     "eval_count": len(tokens), "total_duration": int((time.perf_counter() - started) * 1e9)}
+            await response.write(json.dumps(final).encode() + b"\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client cancelled mid-stream; a real server stops generating here too
+            self.cancelled += 1
+        return response
+
+
+def make_app(fake):
+    app = web.Application()
+    app.router.add_post("/api/generate", fake.handle_generate)
+    return app
+
+
+async def start_fake_ollama(port=0, fake=None, **kwargs):
+    """Start in the running loop; returns (runner, base_url). Call `await runner.cleanup()` to stop.
+
+    Pass `fake` to keep a handle on the server's counters; otherwise one is made from `kwargs`.
+    """
+    runner = web.AppRunner(make_app(fake or FakeOllama(**kwargs)))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/api/generate"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="simulated prefill time")
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with 503")
+    parser.add_argument("--cut-after", type=int, default=None, help="drop each stream after N tokens")
+    parser.add_argument("--end-after", type=int, default=None,
+                        help="end each stream after N tokens without the done chunk")
+    args = parser.parse_args()
+
+    fake = FakeOllama(token_delay=args.token_delay, first_token_delay=args.first_token_delay,
+                      fail_first=args.fail_first, cut_after=args.cut_after, end_after=args.end_after)
+    web.run_app(make_app(fake), host="127.0.0.1", port=args.port)
@@ -0,0 +1,130 @@
+"""Local stand-in for the NCEI THREDDS server, for exercising harvester.py offline.
+
+Serves a directory laid out as <root>/<year>/<month>/*.nc with:
+    GET /catalog/<archive>/<year>/<month>/catalog.xml   THREDDS catalog (with ETag)
+    GET /fileServer/<archive>/<year>/<month>/<file>     the file, honouring Range,
+                                                        If-Range, If-None-Match and
+                                                        If-Modified-Since
+and can cut the first N transfers of each file short to test resumption.
+
+Run with:  python fake_thredds.py --root argo_data_src --port 8765 --break-first 1
+Then:      python harvester.py --base-url http://127.0.0.1:8765 --years 2013
+"""
+import argparse
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from aiohttp import web
+
+from harvester import ARCHIVE_PATH
+
+CATALOG_HEAD = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">\n'
+                '  <service name="all" serviceType="Compound" base=""/>\n'
+                '  <dataset name="{year}/{month}">\n')
+CATALOG_ENTRY = ('    <dataset name="{name}" ID="{path}" urlPath="{path}">\n'
+                 '      <dataSize units="bytes">{size}</dataSize>\n'
+                 '      <date type="modified">{modified}</date>\n'
+                 '    </dataset>\n')
+CATALOG_TAIL = '  </dataset>\n</catalog>\n'
+
+
+def _etag(stat):
+    return '"' + hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+
+
+class FakeThredds:
+    def __init__(self, root, break_first=0):
+        self.root = Path(root)
+        self.break_first = break_first
+        self.requests = {"catalog": 0, "file": 0, "not_modified": 0, "partial": 0, "broken": 0}
+        self._transfers = {}
+
+    async def handle_catalog(self, request):
+        self.requests["catalog"] += 1
+        year, month = request.match_info["year"], request.match_info["month"]
+        month_dir = self.root / year / month
+        if not month_dir.is_dir():
+            raise web.HTTPNotFound()
+        body = [CATALOG_HEAD.format(year=year, month=month)]
+        for nc in sorted(month_dir.glob("*.nc")):
+            stat = nc.stat()
+            body.append(CATALOG_ENTRY.format(
+                name=nc.name, path=f"{ARCHIVE_PATH}/{year}/{month}/{nc.name}", size=stat.st_size,
+                modified=formatdate(stat.st_mtime, usegmt=True)))
+        body.append(CATALOG_TAIL)
+        text = "".join(body)
+        etag = '"' + hashlib.md5(text.encode()).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.requests["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=text, content_type="application/xml", headers={"ETag": etag})
+
+    async def handle_file(self, request):
+        self.requests["file"] += 1
+        info = request.match_info
+        path = self.root / info["year"] / info["month"] / info["name"]
+        if not path.is_file():
+            raise web.HTTPNotFound()
+        stat = path.stat()
+        etag, last_modified = _etag(stat), formatdate(stat.st_mtime, usegmt=True)
+        headers = {"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+
+        if request.headers.get("If-None-Match") == etag:
+            self.requests["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        since = request.headers.get("If-Modified-Since")
+        if since and "If-None-Match" not in request.headers and int(stat.st_mtime) <= parsedate_to_datetime(since).timestamp():
+            self.requests["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+
+        data = path.read_bytes()
+        start, status = 0, 200
+        range_header = request.headers.get("Range", "")
+        if_range = request.headers.get("If-Range")
+        if range_header.startswith("bytes=") and (if_range is None or if_range in (etag, last_modified)):
+            start = int(range_header[6:].split("-")[0])
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+            self.requests["partial"] += 1
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(data) - start
+        await response.prepare(request)
+        count = self._transfers[path] = self._transfers.get(path, 0) + 1
+        if count <= self.break_first:
+            # Send half of the body, then drop the connection
+            await response.write(data[start:start + (len(data) - start) // 2])
+            self.requests["broken"] += 1
+            request.transport.close()
+            return response
+        await response.write(data[start:])
+        await response.write_eof()
+        return response
+
+
+def make_app(fake):
+    app = web.Application()
+    prefix = f"/{ARCHIVE_PATH}/{{year}}/{{month}}"
+    app.router.add_get(f"/catalog{prefix}/catalog.xml", fake.handle_catalog)
+    app.router.add_get(f"/fileServer{prefix}/{{name}}", fake.handle_file)
+    return app
+
+
+async def start_fake_thredds(root, port=0, **kwargs):
+    """Start in the running loop; returns (runner, fake, base_url)."""
+    fake = FakeThredds(root, **kwargs)
+    runner = web.AppRunner(make_app(fake))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, fake, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", required=True, help="directory laid out as <year>/<month>/*.nc")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--break-first", type=int, default=0, help="cut the first N transfers of each file short")
+    args = parser.parse_args()
+    web.run_app(make_app(FakeThredds(args.root, args.break_first)), host="127.0.0.1", port=args.port)
@@ -0,0 +1,330 @@
+"""Float-level index: one entry per float and calendar month, for coarse-to-fine queries.
+
+Each entry holds the float's bounding box, time span, profile count and a
+simplified trajectory polyline for that month, plus the row IDs (and
+positions) of its cycles. A query first prunes entries by month, float and
+a lower bound of the great-circle distance to their bounding box. Only the
+surviving entries are then expanded to their cycles, which are checked
+exactly. There are ~3 cycles per float-month, so the entries are a small
+fraction of the cycle table, and region/time queries touch only the floats
+that could match.
+
+Tracks are simplified with Douglas-Peucker (tolerance in degrees, with
+longitude scaled by cos(latitude)), run for all entries at once.
+
+Saved to `argo_float_index.npz`. read_multiple.py updates it after each
+ingestion, recomputing only the floats that received new or changed rows.
+
+Build with:  python float_index.py
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FLOAT_INDEX_PATH = "argo_float_index.npz"
+EARTH_RADIUS_KM = 6371.0088
+TRACK_TOLERANCE_DEG = 0.1  # ~11 km: well below the spacing of consecutive cycles
+COLUMNS = ["float_id", "latitude", "longitude", "datetime"]
+
+_ENTRY_FIELDS = ("float_id", "month", "lat_min", "lat_max", "lon_min", "lon_max", "start", "end", "profiles",
+                 "row_offsets", "track_offsets")
+_ROW_FIELDS = ("row_ids", "row_lat", "row_lon", "row_time")
+
+
+def month_key(timestamps):
+    """Bucket timestamps by calendar month (months since 1970-01)."""
+    ts = pd.DatetimeIndex(timestamps)
+    return (ts.year - 1970) * 12 + (ts.month - 1)
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def simplify_tracks(lat, lon, offsets, tolerance=TRACK_TOLERANCE_DEG):
+    """Douglas-Peucker keep-mask for many tracks laid out as points[offsets[i]:offsets[i + 1]].
+
+    Every pass splits, in all tracks at once, each segment whose farthest
+    interior point deviates more than `tolerance` from it.
+    """
+    n = len(lat)
+    keep = np.zeros(n, dtype=bool)
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    keep[offsets[:-1][nonempty]] = True
+    keep[offsets[1:][nonempty] - 1] = True
+    scale = np.cos(np.radians(np.clip(lat, -89.0, 89.0)))
+    x, y = lon * scale, lat
+    positions = np.arange(n)
+    while True:
+        kept = np.flatnonzero(keep)
+        # Each point's segment runs from the kept point before it to the kept point after it
+        a = kept[np.searchsorted(kept, positions, side="right") - 1]
+        b = kept[np.minimum(np.searchsorted(kept, positions, side="left"), len(kept) - 1)]
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        length2 = np.maximum(dx ** 2 + dy ** 2, 1e-18)
+        t = np.clip(((x - x[a]) * dx + (y - y[a]) * dy) / length2, 0.0, 1.0)
+        deviation = np.hypot(x - (x[a] + t * dx), y - (y[a] + t * dy))
+        deviation[keep] = -1.0
+        split = deviation > tolerance
+        if not split.any():
+            return keep
+        # The farthest point of every segment that needs a split
+        candidates = np.flatnonzero(split)
+        order = np.lexsort((-deviation[candidates], a[candidates]))
+        _, first = np.unique(a[candidates][order], return_index=True)
+        keep[candidates[order][first]] = True
+
+
+class FloatIndex:
+    """Per-(float, month) bounding boxes, time spans and tracks, over the cycles they cover."""
+
+    def __init__(self, arrays):
+        self.__dict__.update(arrays)
+
+    @property
+    def size(self):
+        """Number of cycles covered."""
+        return int(len(self.row_ids))
+
+    def __len__(self):
+        return int(len(self.float_id))
+
+    # -- Building --
+    @classmethod
+    def from_dataframe(cls, df, tolerance=TRACK_TOLERANCE_DEG):
+        """Build from a metadata DataFrame (COLUMNS); row IDs are the DataFrame index."""
+        lat = df["latitude"].to_numpy(dtype=np.float64)
+        lon = df["longitude"].to_numpy(dtype=np.float64)
+        times = pd.to_datetime(df["datetime"]).to_numpy(dtype="datetime64[ns]")
+        valid = np.isfinite(lat) & np.isfinite(lon) & ~np.isnat(times)
+        row_ids = df.index.to_numpy(dtype=np.int64)[valid]
+        float_ids = df["float_id"].to_numpy(dtype=np.int64)[valid]
+        lat, lon, times = lat[valid], lon[valid], times[valid]
+        months = np.asarray(month_key(times), dtype=np.int32)
+
+        # Entries sorted by (month, float); cycles of an entry in time order
+        order = np.lexsort((times, float_ids, months))
+        float_ids, months, lat, lon, times, row_ids = (a[order] for a in (float_ids, months, lat, lon, times, row_ids))
+        change = np.flatnonzero((np.diff(months) != 0) | (np.diff(float_ids) != 0)) + 1
+        starts = np.concatenate([[0], change]).astype(np.int64) if len(order) else np.empty(0, dtype=np.int64)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+
+        def reduce(op, values):
+            return op.reduceat(values, starts) if len(starts) else values[:0]
+
+        keep = simplify_tracks(lat, lon, offsets, tolerance)
+        track_counts = reduce(np.add, keep.astype(np.int64))
+        return cls({
+            "float_id": float_ids[starts], "month": months[starts],
+            "lat_min": reduce(np.minimum, lat).astype(np.float32), "lat_max": reduce(np.maximum, lat).astype(np.float32),
+            "lon_min": reduce(np.minimum, lon).astype(np.float32), "lon_max": reduce(np.maximum, lon).astype(np.float32),
+            "start": times[starts], "end": times[offsets[1:] - 1], "profiles": np.diff(offsets).astype(np.int32),
+            "row_offsets": offsets,
+            "track_offsets": np.append(0, np.cumsum(track_counts)).astype(np.int64),
+            "track": np.column_stack([lat[keep], lon[keep]]).astype(np.float32),
+            "row_ids": row_ids, "row_lat": lat.astype(np.float32), "row_lon": lon.astype(np.float32),
+            "row_time": times,
+        })
+
+    def replace_floats(self, float_ids, df, tolerance=TRACK_TOLERANCE_DEG):
+        """A new index with every entry of `float_ids` rebuilt from `df` (all of those floats' rows)."""
+        fresh = FloatIndex.from_dataframe(df[df["float_id"].isin(float_ids)], tolerance)
+        kept = np.flatnonzero(~np.isin(self.float_id, np.asarray(list(float_ids), dtype=np.int64)))
+        return FloatIndex.concat([self._take(kept), fresh])
+
+    def _take(self, entries):
+        """Sub-index of the given entries (positions), keeping their order."""
+        def ragged(offsets, arrays):
+            lengths = offsets[entries + 1] - offsets[entries]
+            index = (np.repeat(offsets[entries] - np.cumsum(np.append(0, lengths[:-1])), lengths)
+                     + np.arange(lengths.sum()))
+            return np.append(0, np.cumsum(lengths)).astype(np.int64), [a[index] for a in arrays]
+
+        row_offsets, rows = ragged(self.row_offsets, [getattr(self, f) for f in _ROW_FIELDS])
+        track_offsets, (track,) = ragged(self.track_offsets, [self.track])
+        arrays = {f: getattr(self, f)[entries] for f in _ENTRY_FIELDS if not f.endswith("_offsets")}
+        arrays.update(dict(zip(_ROW_FIELDS, rows)), row_offsets=row_offsets, track_offsets=track_offsets,
+                      track=track)
+        return FloatIndex(arrays)
+
+    @staticmethod
+    def concat(indexes):
+        """One index from several, re-sorted by (month, float)."""
+        arrays = {}
+        for field in (*_ENTRY_FIELDS, *_ROW_FIELDS, "track"):
+            if field.endswith("_offsets"):
+                parts = [getattr(i, field) for i in indexes]
+                shifts = np.cumsum([0] + [p[-1] for p in parts[:-1]])
+                arrays[field] = np.concatenate([parts[0][:1]] + [p[1:] + s for p, s in zip(parts, shifts)])
+            else:
+                arrays[field] = np.concatenate([getattr(i, field) for i in indexes])
+        merged = FloatIndex(arrays)
+        return merged._take(np.lexsort((merged.float_id, merged.month)))
+
+    # -- Persistence --
+    def save(self, path=FLOAT_INDEX_PATH):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{f: getattr(self, f) for f in (*_ENTRY_FIELDS, *_ROW_FIELDS, "track")})
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path=FLOAT_INDEX_PATH):
+        with np.load(path) as data:
+            return FloatIndex({name: data[name] for name in data.files})
+
+    # -- Queries --
+    def entries(self, lat=None, lon=None, radius_km=None, start=None, end=None, float_ids=None):
+        """Positions of the entries that can hold a matching cycle (the coarse stage)."""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            start = pd.Timestamp(start)
+            mask &= self.month >= month_key([start])[0]
+            mask &= self.end >= start.to_datetime64()
+        if end is not None:
+            end = pd.Timestamp(end)
+            mask &= self.month <= month_key([end])[0]
+            mask &= self.start <= end.to_datetime64()
+        if float_ids:
+            mask &= np.isin(self.float_id, np.asarray(list(float_ids), dtype=np.int64))
+        if lat is not None and lon is not None:
+            mask &= self._box_distance_bound(lat, lon) <= radius_km
+        return np.flatnonzero(mask)
+
+    def _box_distance_bound(self, lat, lon):
+        """A lower bound of the great-circle distance (km) from (lat, lon) to each bounding box.
+
+        From the haversine formula: sin²(d/2) is at least sin²(Δφ/2), and at
+        least cos φ · min cos φ' · sin²(Δλ/2), with Δφ / Δλ the gaps to the
+        box's latitude / longitude interval and φ' ranging over the box.
+        """
+        lat_min, lat_max = self.lat_min.astype(np.float64), self.lat_max.astype(np.float64)
+        lon_min, lon_max = self.lon_min.astype(np.float64), self.lon_max.astype(np.float64)
+        dlat = np.radians(np.maximum(np.maximum(lat_min - lat, lat - lat_max), 0.0))
+        # Longitude gap on the circle: 0 inside the interval, else the shorter way to either edge
+        inside = ((lon - lon_min) % 360.0) <= (lon_max - lon_min)
+        gap = np.minimum((lon_min - lon) % 360.0, (lon - lon_max) % 360.0)
+        dlon = np.radians(np.where(inside, 0.0, np.minimum(gap, 180.0)))
+        cos_box = np.minimum(np.cos(np.radians(lat_min)), np.cos(np.radians(lat_max)))
+        h = np.maximum(np.sin(dlat / 2) ** 2, np.cos(np.radians(lat)) * np.maximum(cos_box, 0.0) * np.sin(dlon / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+    def _expand(self, entries):
+        """Row positions of the given entries' cycles (the fine stage)."""
+        lengths = self.row_offsets[entries + 1] - self.row_offsets[entries]
+        return (np.repeat(self.row_offsets[entries] - np.cumsum(np.append(0, lengths[:-1])), lengths)
+                + np.arange(lengths.sum()))
+
+    def _in_window(self, rows, start, end):
+        keep = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            keep &= self.row_time[rows] >= pd.Timestamp(start).to_datetime64()
+        if end is not None:
+            keep &= self.row_time[rows] <= pd.Timestamp(end).to_datetime64()
+        return rows[keep]
+
+    def query_radius(self, lat, lon, radius_km, start=None, end=None, float_ids=None, sort=True):
+        """Row IDs within `radius_km` of (lat, lon), optionally inside a time window and of given floats.
+
+        Returns (row_ids, distances_km), sorted by distance when `sort` is set.
+        """
+        rows = self._in_window(self._expand(self.entries(lat, lon, radius_km, start, end, float_ids)), start, end)
+        dist = _haversine_km(lat, lon, self.row_lat[rows].astype(np.float64), self.row_lon[rows].astype(np.float64))
+        inside = dist <= radius_km
+        rows, dist = rows[inside], dist[inside]
+        if sort:
+            order = np.argsort(dist, kind="stable")
+            rows, dist = rows[order], dist[order]
+        return self.row_ids[rows], dist
+
+    def query_time(self, start=None, end=None, float_ids=None):
+        """Row IDs observed inside the time window (and of the given floats), in time order per float-month."""
+        return self.row_ids[self._in_window(self._expand(self.entries(start=start, end=end, float_ids=float_ids)),
+                                            start, end)]
+
+    def floats(self, lat=None, lon=None, radius_km=None, start=None, end=None, float_ids=None):
+        """Float-level answer from the entries alone: one row per float with its box, span and count.
+
+        Coarse: a float is listed when its box comes within the radius, even
+        if none of its cycles does.
+        """
+        entries = self.entries(lat, lon, radius_km, start, end, float_ids)
+        frame = pd.DataFrame({"float_id": self.float_id[entries], "profiles": self.profiles[entries],
+                              "start": self.start[entries], "end": self.end[entries],
+                              "lat_min": self.lat_min[entries], "lat_max": self.lat_max[entries],
+                              "lon_min": self.lon_min[entries], "lon_max": self.lon_max[entries]})
+        return frame.groupby("float_id").agg(
+            profiles=("profiles", "sum"), start=("start", "min"), end=("end", "max"),
+            lat_min=("lat_min", "min"), lat_max=("lat_max", "max"),
+            lon_min=("lon_min", "min"), lon_max=("lon_max", "max")).reset_index()
+
+    def trajectory(self, float_id, start=None, end=None):
+        """The float's simplified trajectory as an [n, 2] array of (lat, lon), in time order."""
+        entries = self.entries(start=start, end=end, float_ids=[float_id])
+        lengths = self.track_offsets[entries + 1] - self.track_offsets[entries]
+        index = (np.repeat(self.track_offsets[entries] - np.cumsum(np.append(0, lengths[:-1])), lengths)
+                 + np.arange(lengths.sum()))
+        return self.track[index]
+
+
+def row_fingerprint(row_ids, latitudes, longitudes, times):
+    """BLAKE2b digest of the rows' IDs, positions and times in row-ID order.
+
+    Changes when a row is added, dropped or re-IDed, and when one moves or
+    is re-timed. Positions are hashed as float32, as the index stores them.
+    """
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    order = np.argsort(row_ids, kind="stable")
+    digest = hashlib.blake2b(digest_size=16)
+    for values in (row_ids, np.asarray(latitudes, dtype=np.float32), np.asarray(longitudes, dtype=np.float32),
+                   np.asarray(times, dtype="datetime64[ns]")):
+        digest.update(np.ascontiguousarray(values[order]).tobytes())
+    return digest.hexdigest()
+
+
+def load_or_build(df, path=FLOAT_INDEX_PATH):
+    """Load the persisted index, rebuilding it when it does not cover exactly the metadata's located rows."""
+    path = Path(path)
+    if path.exists():
+        index = FloatIndex.load(path)
+        times = pd.to_datetime(df["datetime"]).to_numpy(dtype="datetime64[ns]")
+        valid = (df["latitude"].notna() & df["longitude"].notna()).to_numpy() & ~np.isnat(times)
+        current = row_fingerprint(df.index.to_numpy()[valid], df["latitude"].to_numpy()[valid],
+                                  df["longitude"].to_numpy()[valid], times[valid])
+        if row_fingerprint(index.row_ids, index.row_lat, index.row_lon, index.row_time) == current:
+            return index
+    index = FloatIndex.from_dataframe(df)
+    index.save(path)
+    return index
+
+
+def update_float_index(metadata_root, float_ids, path=FLOAT_INDEX_PATH):
+    """Recompute the entries of `float_ids` from the metadata dataset (or build the index if missing)."""
+    from columnar_store import load_metadata
+
+    path = Path(path)
+    if not path.exists():
+        index = FloatIndex.from_dataframe(load_metadata(metadata_root, columns=COLUMNS))
+    elif float_ids:
+        rows = load_metadata(metadata_root, columns=COLUMNS, float_ids=sorted(float_ids))
+        index = FloatIndex.load(path).replace_floats(float_ids, rows)
+    else:
+        return FloatIndex.load(path)
+    index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    from columnar_store import load_metadata
+
+    df = load_metadata(columns=COLUMNS) if Path("argo_metadata.parquet").exists() else load_metadata()
+    index = FloatIndex.from_dataframe(df)
+    index.save(FLOAT_INDEX_PATH)
+    print(f"✅ Float index: {len(index)} float-months over {index.size} cycles "
+          f"({len(index.track)} track points) → {FLOAT_INDEX_PATH}")
@@ -0,0 +1,275 @@
+"""Async harvester for the GADR NetCDF archive on the NCEI THREDDS server.
+
+All year-month catalogs are listed concurrently and every file found is
+queued straight away, so there is no per-month barrier. One aiohttp session
+pools connections per host, a global limit bounds the number of requests in
+flight, and downloads stream to disk in chunks. Interrupted downloads resume
+with an HTTP Range request; completed files are revalidated with
+If-None-Match / If-Modified-Since and skipped on 304.
+
+With a sync manifest (the default from the command line), catalogs are also
+fetched conditionally and served from the cached listing when unchanged, and
+files the catalog lists with the same size and date as when they were last
+fetched are not requested at all. Failures are recorded there and retried on
+the next run.
+
+Run with:  python harvester.py --years 1999-2020 --out-dir argo_data
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from sync_manifest import SYNC_MANIFEST_NAME, SyncManifest
+from tracing import TRACER, span
+
+BASE_URL = "https://www.ncei.noaa.gov/thredds-ocean"
+ARCHIVE_PATH = "argo/gadr/indian"
+OUT_DIR = "argo_data"
+CHUNK_SIZE = 1 << 16
+
+
+def catalog_url(base_url, year, month):
+    return f"{base_url}/catalog/{ARCHIVE_PATH}/{year}/{month:02d}/catalog.xml"
+
+
+def file_url(base_url, year, month, filename):
+    return f"{base_url}/fileServer/{ARCHIVE_PATH}/{year}/{month:02d}/{filename}"
+
+
+def parse_catalog(content):
+    """.nc datasets in a THREDDS catalog: [{"name", "size", "modified"}, ...]."""
+    soup = BeautifulSoup(content, "xml")
+    files = []
+    for ds in soup.find_all("dataset"):
+        url_path = ds.get("urlPath", "")
+        if not url_path.endswith(".nc"):
+            continue
+        size = ds.find("dataSize")
+        modified = ds.find("date", attrs={"type": "modified"})
+        files.append({
+            "name": url_path.split("/")[-1],
+            "size": size.get_text(strip=True) if size else None,
+            "modified": modified.get_text(strip=True) if modified else None,
+        })
+    return files
+
+
+def _validators_path(dest):
+    return dest.with_name(dest.name + ".meta.json")
+
+
+class Harvester:
+    def __init__(self, out_dir=OUT_DIR, base_url=BASE_URL, concurrency=32, per_host=16,
+                 max_retries=4, retry_delay=1.0, manifest=None):
+        self.out_dir = Path(out_dir)
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.manifest = manifest
+        self.stats = {"catalogs": 0, "catalogs_cached": 0, "downloaded": 0, "resumed": 0, "not_modified": 0,
+                      "up_to_date": 0, "bytes": 0}
+        self.failed = []
+        self._limit = None
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                         ttl_dns_cache=300, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._limit = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def _retrying(self, what, func, *args):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self._limit:
+                    return await func(*args)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1) * (0.5 + random.random() / 2)
+                print(f"   {what}: {e.__class__.__name__}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _fetch_catalog(self, year, month):
+        headers = self.manifest.catalog_headers(year, month) if self.manifest else {}
+        async with self._session.get(catalog_url(self.base_url, year, month), headers=headers) as response:
+            if response.status == 404:
+                return []
+            if response.status == 304 and self.manifest:
+                self.manifest.touch_catalog(year, month)
+                self.stats["catalogs_cached"] += 1
+                return self.manifest.listing(year, month)
+            response.raise_for_status()
+            files = parse_catalog(await response.read())
+            if self.manifest:
+                self.manifest.update_catalog(year, month, files, response.headers.get("ETag"),
+                                             response.headers.get("Last-Modified"))
+            return files
+
+    async def list_month(self, year, month):
+        try:
+            with span("harvest.catalog", year=year, month=month) as s:
+                files = await self._retrying(f"catalog {year}-{month:02d}", self._fetch_catalog, year, month)
+                s.rows = len(files)
+        except Exception as e:
+            print(f"❌ Failed to list files for {year}-{month:02d}: {e}")
+            return []
+        self.stats["catalogs"] += 1
+        return files
+
+    async def _download(self, url, dest):
+        """One attempt at fetching `url` into `dest`; returns 'downloaded', 'resumed' or 'not_modified'."""
+        validators_path = _validators_path(dest)
+        part = dest.with_name(dest.name + ".part")
+        validators = json.loads(validators_path.read_text()) if validators_path.exists() else {}
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        headers = {}
+        offset = part.stat().st_size if part.exists() else 0
+
+        if dest.exists() and validators:
+            # Conditional GET: the server answers 304 if our copy is current
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        elif dest.exists():
+            # Downloaded before validators were recorded: fall back to the local mtime
+            headers["If-Modified-Since"] = formatdate(dest.stat().st_mtime, usegmt=True)
+            offset = 0
+        elif offset and (validators.get("partial_etag") or validators.get("partial_last_modified")):
+            # Resume, but only if the file has not changed since the partial download began
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validators.get("partial_etag") or validators["partial_last_modified"]
+        else:
+            offset = 0
+
+        async with self._session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return "not_modified"
+            response.raise_for_status()
+            resumed = response.status == 206
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if not resumed:
+                offset = 0
+                validators_path.write_text(json.dumps({"partial_etag": etag, "partial_last_modified": last_modified}))
+            with open(part, "ab" if resumed else "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+                    self.stats["bytes"] += len(chunk)
+
+        os.replace(part, dest)
+        validators_path.write_text(json.dumps({
+            "etag": etag or validators.get("partial_etag"),
+            "last_modified": last_modified or validators.get("partial_last_modified"),
+            "size": dest.stat().st_size,
+            "fetched_at": time.time(),
+        }))
+        return "resumed" if resumed else "downloaded"
+
+    async def fetch_file(self, year, month, filename):
+        url = file_url(self.base_url, year, month, filename)
+        dest = self.out_dir / str(year) / f"{month:02d}" / filename
+        try:
+            with span("harvest.file") as s:
+                outcome = await self._retrying(filename, self._download, url, dest)
+                s.set(outcome=outcome)
+        except Exception as e:
+            print(f"❌ Failed {filename}: {e}")
+            self.failed.append((year, month, filename, str(e)))
+            if self.manifest:
+                self.manifest.record_failure(year, month, filename, e)
+            return None
+        self.stats[outcome] += 1
+        if self.manifest:
+            self.manifest.mark_synced(year, month, filename, str(dest))
+        return outcome
+
+    def _needs_fetch(self, year, month, entry):
+        """False for files the catalog lists unchanged since they were last fetched."""
+        if self.manifest is None or self.manifest.state(year, month, entry["name"]) != "synced":
+            return True
+        if not (self.out_dir / str(year) / f"{month:02d}" / entry["name"]).exists():
+            return True
+        self.stats["up_to_date"] += 1
+        return False
+
+    async def run(self, year_months, on_listed=None):
+        """Harvest every file of every (year, month); catalog listing and downloads overlap."""
+        queue = asyncio.Queue(maxsize=4 * self.concurrency)
+
+        async def lister(year, month):
+            for entry in await self.list_month(year, month):
+                if not self._needs_fetch(year, month, entry):
+                    continue
+                if on_listed is None or on_listed(year, month, entry):
+                    await queue.put((year, month, entry["name"]))
+
+        async def worker():
+            while True:
+                year, month, filename = await queue.get()
+                try:
+                    await self.fetch_file(year, month, filename)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        await asyncio.gather(*(lister(y, m) for y, m in year_months))
+        await queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return self.stats
+
+
+def parse_years(spec):
+    first, _, last = spec.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+async def main(args):
+    year_months = [(year, month) for year in parse_years(args.years) for month in range(1, 13)]
+    Path(args.out_dir).mkdir(parents=True, exist_ok=True)
+    manifest = None if args.no_manifest else SyncManifest(Path(args.out_dir) / SYNC_MANIFEST_NAME)
+    if manifest:
+        # Files that failed last time are retried even if their month is outside the range
+        year_months += [ym for ym in manifest.failed_months() if ym not in year_months]
+    print(f"🚀 Harvesting {len(year_months)} months from {args.base_url} "
+          f"({args.concurrency} concurrent requests, {args.per_host} per host)")
+    start = time.time()
+    async with Harvester(args.out_dir, args.base_url, args.concurrency, args.per_host, manifest=manifest) as harvester:
+        stats = await harvester.run(year_months)
+    if manifest:
+        manifest.close()
+    print(f"\n📊 {stats} in {time.time() - start:.1f}s, {len(harvester.failed)} failed")
+    TRACER.print_summary()
+    TRACER.write_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", default="1999-2020", help="e.g. 2013 or 1999-2020")
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight overall")
+    parser.add_argument("--per-host", type=int, default=16, help="pooled connections per host")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help=f"skip the catalog cache and sync state in <out-dir>/{SYNC_MANIFEST_NAME}")
+    asyncio.run(main(parser.parse_args()))
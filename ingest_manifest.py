@@ -0,0 +1,164 @@
+"""SQLite manifest of NetCDF files already ingested by read_multiple.py.
+
+Each file is recorded with its size, mtime and (optionally) content hash and
+the output batch its rows were written in and the row IDs they got, so a
+rerun only processes new or changed files, and a changed file's rows can be
+taken out of its batch without touching its batch-mates. The manifest also
+hands out row IDs, which stay stable across incremental runs.
+
+A batch is registered as pending before any of its part files are written
+and marked done together with its files. Part files of batches still
+pending on the next run are leftovers of a crash and are deleted.
+"""
+import hashlib
+import sqlite3
+import time
+
+MANIFEST_PATH = "ingest_manifest.sqlite"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha1 TEXT,
+                batch_id TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                ingested_at REAL NOT NULL,
+                first_row_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS files_batch ON files(batch_id);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS pending_batches (batch_id TEXT PRIMARY KEY, started_at REAL NOT NULL);
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if "first_row_id" not in columns:
+            # Manifests from before per-file row IDs; their batches can only be re-read whole
+            with self.conn:
+                self.conn.execute("ALTER TABLE files ADD COLUMN first_row_id INTEGER")
+
+    def close(self):
+        self.conn.close()
+
+    def pending(self, paths, use_hash=False):
+        """Split `paths` into (new, changed) relative to the manifest.
+
+        A file is unchanged when size and mtime match. With `use_hash`, a file
+        whose mtime moved but whose content hash is identical is also
+        treated as unchanged (and its mtime refreshed).
+        """
+        known = {row[0]: row[1:] for row in self.conn.execute("SELECT path, size, mtime_ns, sha1 FROM files")}
+        new, changed = [], []
+        for path in paths:
+            stat = path.stat()
+            record = known.get(str(path))
+            if record is None:
+                new.append(path)
+                continue
+            size, mtime_ns, sha1 = record
+            if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                continue
+            if use_hash and sha1 and size == stat.st_size and file_hash(path) == sha1:
+                with self.conn:
+                    self.conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, str(path)))
+                continue
+            changed.append(path)
+        return new, changed
+
+    def _select_in(self, sql, values, chunk=500):
+        """Run `sql` (with one IN ({marks}) placeholder) over `values` in chunks."""
+        values = list(values)
+        out = []
+        for i in range(0, len(values), chunk):
+            part = values[i:i + chunk]
+            out.extend(r[0] for r in self.conn.execute(sql.format(marks=",".join("?" * len(part))), part))
+        return out
+
+    def files_in_batches(self, batch_ids):
+        return self._select_in("SELECT path FROM files WHERE batch_id IN ({marks})", batch_ids)
+
+    def locate(self, paths):
+        """{path: (batch_id, first_row_id or None, rows)} for the given files."""
+        paths = [str(p) for p in paths]
+        out = {}
+        for i in range(0, len(paths), 500):
+            part = paths[i:i + 500]
+            rows = self.conn.execute(f"SELECT path, batch_id, first_row_id, rows FROM files "
+                                     f"WHERE path IN ({','.join('?' * len(part))})", part)
+            out.update({path: (batch_id, first, n) for path, batch_id, first, n in rows})
+        return out
+
+    def forget_batches(self, batch_ids):
+        """Drop the files of `batch_ids` and mark the batches pending, until delete_batches() has run."""
+        batch_ids = list(batch_ids)
+        now = time.time()
+        with self.conn:
+            for i in range(0, len(batch_ids), 500):
+                part = batch_ids[i:i + 500]
+                self.conn.execute(f"DELETE FROM files WHERE batch_id IN ({','.join('?' * len(part))})", part)
+            self.conn.executemany("INSERT OR REPLACE INTO pending_batches VALUES (?, ?)",
+                                  [(batch_id, now) for batch_id in batch_ids])
+
+    def replace_batch(self, batch_id, new_batch_id, dropped_paths):
+        """Forget `dropped_paths` and move the rest of `batch_id` to `new_batch_id` (written, pending).
+
+        `new_batch_id` is marked done and `batch_id` pending, in one
+        transaction; clear_pending() it once its part files are deleted.
+        """
+        dropped_paths = [str(p) for p in dropped_paths]
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in dropped_paths])
+            if new_batch_id is not None:
+                self.conn.execute("UPDATE files SET batch_id = ? WHERE batch_id = ?", (new_batch_id, batch_id))
+                self.conn.execute("DELETE FROM pending_batches WHERE batch_id = ?", (new_batch_id,))
+            self.conn.execute("INSERT OR REPLACE INTO pending_batches VALUES (?, ?)", (batch_id, time.time()))
+
+    def begin_batch(self, batch_id):
+        """Register `batch_id` before its part files are written."""
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pending_batches VALUES (?, ?)", (batch_id, time.time()))
+
+    def pending_batches(self):
+        return [row[0] for row in self.conn.execute("SELECT batch_id FROM pending_batches")]
+
+    def clear_pending(self, batch_ids):
+        with self.conn:
+            self.conn.executemany("DELETE FROM pending_batches WHERE batch_id = ?", [(b,) for b in batch_ids])
+
+    def reserve_row_ids(self, count):
+        """Return the first of `count` consecutive, never-reused row IDs."""
+        with self.conn:
+            row = self.conn.execute("SELECT value FROM state WHERE key = 'next_row_id'").fetchone()
+            first = row[0] if row else 0
+            self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('next_row_id', ?)",
+                              (first + count,))
+        return first
+
+    def record(self, batch_id, entries):
+        """Mark files as ingested in `batch_id`, and the batch as done.
+
+        `entries` is [(path, size, mtime_ns, sha1 or None, rows, first_row_id), ...],
+        with size/mtime taken before the file was read.
+        """
+        now = time.time()
+        values = [(str(path), size, mtime_ns, sha1, batch_id, rows, now, first_row_id)
+                  for path, size, mtime_ns, sha1, rows, first_row_id in entries]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+            self.conn.execute("DELETE FROM pending_batches WHERE batch_id = ?", (batch_id,))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
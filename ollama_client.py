@@ -0,0 +1,145 @@
+"""Async streaming client for the Ollama generate endpoint.
+
+One client holds a pooled keep-alive session; reuse it for many prompts.
+Tokens are yielded as Ollama produces them, so callers can show the first
+words long before generation finishes. Cancelling the consuming task (or
+breaking out of the `async for`) closes the underlying response.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+
+import aiohttp
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = "llama3.2:1b"
+GENERATION_OPTIONS = {
+    "temperature": 0.1,
+    "num_predict": 250,
+}
+
+
+class OllamaError(Exception):
+    """Generation failed for a reason retrying will not fix, or retries ran out."""
+
+
+class TruncatedStream(Exception):
+    """The response ended before its {"done": true} chunk, or a chunk was not valid JSON."""
+
+
+# Statuses worth retrying: the model is loading or the server is overloaded
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OllamaClient:
+    def __init__(self, url=OLLAMA_URL, model=OLLAMA_MODEL, options=None, max_connections=8,
+                 connect_timeout=10, read_timeout=60, max_retries=3, retry_delay=1.0, max_retry_delay=30.0):
+        self.url = url
+        self.model = model
+        self.options = dict(GENERATION_OPTIONS if options is None else options)
+        self.max_connections = max_connections
+        # No total timeout: a long answer is fine as long as tokens keep arriving
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, attempt):
+        delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+        return delay * (0.5 + random.random() / 2)
+
+    def payload(self, prompt, stream=True, options=None):
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": dict(self.options, **(options or {})),
+        }
+
+    async def stream(self, prompt, options=None):
+        """Yield response tokens as they arrive.
+
+        Connection failures, retryable statuses and truncated streams are
+        retried with exponential backoff, but only until the first token has
+        been yielded; a stream that breaks midway raises instead of
+        replaying. A stream counts as complete only once its "done" chunk
+        arrives, so a cut-off answer is never returned as a whole one.
+        """
+        await self.open()
+        payload = self.payload(prompt, stream=True, options=options)
+        for attempt in range(1, self.max_retries + 1):
+            started = False
+            try:
+                async with self._session.post(self.url, json=payload) as response:
+                    if response.status in RETRYABLE_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status,
+                            message=await response.text())
+                    if response.status >= 400:
+                        raise OllamaError(f"HTTP {response.status}: {await response.text()}")
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        try:
+                            chunk = json.loads(line)
+                        except json.JSONDecodeError as e:
+                            raise TruncatedStream(f"invalid chunk {line[:80]!r}") from e
+                        if "error" in chunk:
+                            raise OllamaError(chunk["error"])
+                        if chunk.get("response"):
+                            started = True
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            return
+                    raise TruncatedStream("stream ended before done")
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError, TruncatedStream) as e:
+                if started:
+                    raise OllamaError(f"Stream interrupted: {e}") from e
+                if attempt == self.max_retries:
+                    raise OllamaError(f"All {self.max_retries} attempts failed: {e}") from e
+                delay = self._backoff(attempt)
+                print(f"   Ollama not ready ({e.__class__.__name__}). Retrying in {delay:.1f} seconds...",
+                      file=sys.stderr)
+                await asyncio.sleep(delay)
+
+    async def generate(self, prompt, options=None):
+        """The full answer as one string (still streamed under the hood)."""
+        return "".join([token async for token in self.stream(prompt, options=options)])
+
+
+async def stream_to_stdout(prompt, client=None):
+    """Print an answer token by token; returns the full text."""
+    own_client = client is None
+    client = client or OllamaClient()
+    tokens = []
+    try:
+        print("\n🤖 ANSWER:")
+        async for token in client.stream(prompt):
+            print(token, end="", flush=True)
+            tokens.append(token)
+        print()
+    finally:
+        if own_client:
+            await client.close()
+    return "".join(tokens)
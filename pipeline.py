@@ -1,39 +1,49 @@
-import requests
-import pandas as pd
-import faiss
+import asyncio
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import json
-import time
-from requests.exceptions import ConnectionError
+
+from climatology import open_climatology
+from columnar_store import load_metadata
+from context_builder import build_context
+from embedding_store import INDEX_PATH, model_fingerprint
+from encoder import load_encoder
+from ollama_client import OllamaError, stream_to_stdout
+from profile_summaries import attach_summaries, load_summaries
+from tracing import TRACER, span
+from vector_index import load_index, read_manifest
 
 # -- Load Assets --
-print("Loading CSV, FAISS index, and embedding model...")
-df = pd.read_csv("argo_metadata.csv")
-index = faiss.read_index("argo_index.faiss")
-embedding_model = SentenceTransformer("thenlper/gte-small")
+print("Loading metadata, FAISS index, and embedding model...")
+with span("load.metadata") as s:
+    df = attach_summaries(load_metadata(), load_summaries())
+    s.rows = len(df)
+with span("load.climatology"):
+    climatology = open_climatology()  # None until climatology.py has been run
+# Queries must be encoded with the model the index was built with; the manifest records it
+model_name = (read_manifest(INDEX_PATH) or {}).get("model") or "all-MiniLM-L6-v2"
+with span("load.model", model=model_name):
+    # PyTorch, or the ONNX export when FLOATCHAT_ENCODER says so (see encoder.py)
+    embedding_model = load_encoder(model_name)
+with span("load.faiss_index") as s:
+    index, _ = load_index(INDEX_PATH, model_name, model_fingerprint(embedding_model, model_name))
+    s.rows = index.ntotal
 print("✅ Assets loaded.\n")
 
 # -- User Query --
 query = "What ARGO floats were near -41N, 96E in 2013 and what patterns do they show?"
 
 # -- FAISS Search --
-query_embedding = embedding_model.encode([query], convert_to_numpy=True)
-distances, indices = index.search(query_embedding, 5)
-retrieved_rows = df.iloc[indices[0]]
+with span("search.encode", rows=1):
+    query_embedding = embedding_model.encode([query], convert_to_numpy=True)
+with span("search.rank", rows=index.ntotal):
+    distances, indices = index.search(query_embedding, 5)
+    retrieved_rows = df.loc[indices[0][indices[0] >= 0]]  # the index returns row IDs
 
 # ... (previous code for loading assets and search) ...
 
 # -- Prepare Context BETTER --
-# First, drop duplicate rows based on key columns to avoid redundant info
-retrieved_rows = retrieved_rows.drop_duplicates(subset=['float_id', 'latitude', 'longitude', 'datetime'])
-
-context_lines = []
-for _, row in retrieved_rows.iterrows():
-    # Format the datetime to be more readable
-    formatted_date = pd.to_datetime(row['datetime']).strftime('%Y-%m-%d %H:%M')
-    context_lines.append(f"Float {row['float_id']} was at {row['latitude']}°N, {row['longitude']}°E on {formatted_date}.")
-context = "\n".join(context_lines)
+# Deduplicated, grouped into per-float trajectories and packed into a token budget (context_builder.py),
+# with the regional climatology of the retrieved profiles' cells
+context = build_context(retrieved_rows, climatology=climatology)
 
 print(f"Retrieved Context:\n{context}\n")
 
@@ -51,43 +61,14 @@ prompt = f"""You are an expert oceanographer. Analyze the provided ARGO float da
 
 # ... (rest of your code) ...
 
-# -- Send to Ollama with Retry Logic --
-url = "http://localhost:11434/api/generate"
-payload = {
-    "model": "llama3.2:1b",
-    "prompt": prompt,
-    "stream": False,
-    "options": {
-        "temperature": 0.1,
-        "num_predict": 250
-    }
-}
-
-max_retries = 3
-retry_delay = 5  # seconds
-
-for attempt in range(1, max_retries + 1):
-    try:
-        print(f"Attempt {attempt}: Sending request to Ollama...")
-        response = requests.post(url, json=payload, timeout=60)  # 60 second timeout
-        response.raise_for_status()  # Raises an exception for 4xx/5xx status codes
-
-        # If successful, parse and print the response
-        full_response = response.json()
-        answer = full_response['response']
-        print("\n🤖 ANSWER:")
-        print(answer)
-        break  # Exit the retry loop on success
-
-    except ConnectionError:
-        print(f"   Server not ready. Retrying in {retry_delay} seconds...")
-        time.sleep(retry_delay)
-    except requests.exceptions.HTTPError as e:
-        print(f"   HTTP Error: {e}")
-        break
-    except Exception as e:
-        print(f"   An unexpected error occurred: {e}")
-        break
-else:
-    # This block runs if the loop never 'break's (i.e., all retries failed)
-    print("❌ All connection attempts failed. Please ensure 'ollama serve' is running.")
\ No newline at end of file
+# -- Stream the answer from Ollama --
+# Tokens are printed as they arrive; connection failures are retried with backoff
+try:
+    with span("generate"):
+        asyncio.run(stream_to_stdout(prompt))
+except OllamaError as e:
+    print(f"\n❌ {e}. Please ensure 'ollama serve' is running.")
+
+# -- Stage timings (also logged as JSON / written for Prometheus when configured, see tracing.py) --
+TRACER.print_summary()
+TRACER.write_metrics()
@@ -0,0 +1,277 @@
+"""Compact ragged-array store for profile levels, memory-mapped for random access.
+
+Layout of `argo_profiles.ragged/`:
+    values.f32   float32 [n_levels, 3]  pressure, temperature, salinity
+    qc.i8        int8    [n_levels, 3]  pres/temp/psal QC flags (-1 = missing)
+    profiles.bin one record per profile: float_id, cycle_number, start, n_levels
+    batches.i8   int64 per record: the ingest batch it was appended in (0 = untagged, -1 = dropped)
+    lookup.npz   cached (key, entry) pairs sorted by key
+
+Levels of one profile are contiguous and padding (missing pressure) is
+dropped, so a profile is a single slice `values[start:start + n]`. All files
+are append-only: re-ingesting a profile appends a new entry and lookups
+return the most recent one; `compact()` reclaims the space. The entries of
+a batch that is swept or rewritten are marked dropped in batches.i8, after
+which lookups skip them.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import qc_flags_to_int
+
+STORE_PATH = "argo_profiles.ragged"
+
+PROFILE_DTYPE = np.dtype([
+    ("float_id", np.int64),
+    ("cycle_number", np.int32),
+    ("n_levels", np.int32),
+    ("start", np.int64),
+])
+DROPPED = -1
+COLUMNS = ("pressure", "temperature", "salinity")
+QC_COLUMNS = ("pres_qc", "temp_qc", "sal_qc")
+
+
+CYCLE_BITS = 20
+MAX_CYCLE = 2**CYCLE_BITS - 1
+MAX_FLOAT_ID = 2**(63 - CYCLE_BITS) - 1
+CYCLE_FILL = 99999  # Argo _FillValue of CYCLE_NUMBER
+
+
+def valid_key(float_ids, cycle_numbers):
+    """Which (float_id, cycle_number) pairs fit in a profile key: whole, non-negative and in range, no fill value."""
+    f = np.atleast_1d(np.asarray(float_ids, dtype=np.float64))
+    c = np.atleast_1d(np.asarray(cycle_numbers, dtype=np.float64))
+    with np.errstate(invalid="ignore"):
+        return ((f == np.floor(f)) & (f >= 0) & (f <= MAX_FLOAT_ID)
+                & (c == np.floor(c)) & (c >= 0) & (c <= MAX_CYCLE) & (c != CYCLE_FILL))
+
+
+def _pack(float_ids, cycle_numbers):
+    return (np.asarray(float_ids, dtype=np.int64) << CYCLE_BITS) | np.asarray(cycle_numbers, dtype=np.int64)
+
+
+def profile_key(float_ids, cycle_numbers):
+    """Pack (float_id, cycle_number) into one sortable int64; raises ValueError for pairs that do not fit.
+
+    The profile direction is not part of the key: read_multiple.py does not
+    read DIRECTION, so a descending profile stored after the ascending one
+    of the same cycle replaces it.
+    """
+    ok = valid_key(float_ids, cycle_numbers)
+    if not ok.all():
+        i = int(np.flatnonzero(~ok)[0])
+        f, c = np.atleast_1d(float_ids)[i], np.atleast_1d(cycle_numbers)[i]
+        raise ValueError(f"Float {f} cycle {c} cannot be stored: cycle numbers must be 0-{MAX_CYCLE} "
+                         f"(not the fill value {CYCLE_FILL}), float IDs 0-{MAX_FLOAT_ID}")
+    return _pack(float_ids, cycle_numbers)
+
+
+def batch_tag(batch_id):
+    """batches.i8 value for a read_multiple batch ID (12 hex digits)."""
+    return 0 if batch_id is None else int(batch_id, 16)
+
+
+class ProfileStoreWriter:
+    """Appends profiles to the store; used by read_multiple.py after each batch."""
+
+    def __init__(self, root=STORE_PATH):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Drop levels written after the last complete record (an interrupted append)
+        records_path = self.root / "profiles.bin"
+        records = np.fromfile(records_path, dtype=PROFILE_DTYPE) if records_path.exists() else []
+        self._next_start = int((records["start"] + records["n_levels"]).max()) if len(records) else 0
+        for name, size in [("values.f32", self._next_start * 3 * 4), ("qc.i8", self._next_start * 3),
+                           ("batches.i8", len(records) * 8)]:  # zero-padded for stores written before tags
+            with open(self.root / name, "ab") as f:
+                f.truncate(size)
+        self._n_records = len(records)
+
+    def append_frame(self, profile_df, batch_id=None):
+        """Append a level-per-row frame (as built by read_multiple.read_nc_file), tagged with `batch_id`.
+
+        Rows must be grouped by profile; levels with missing pressure are
+        fill-value padding and are dropped.
+        """
+        if len(profile_df) == 0:
+            return 0
+        float_ids = profile_df["float_id"].astype(str).str.strip().astype(np.int64).to_numpy()
+        cycles = pd.to_numeric(profile_df["cycle_number"]).to_numpy(np.float64)
+        keys = profile_key(float_ids, cycles)
+        cycles = cycles.astype(np.int64)
+        values = np.column_stack([pd.to_numeric(profile_df[c], errors="coerce").to_numpy(np.float32)
+                                  for c in COLUMNS])
+        qc = np.column_stack([qc_flags_to_int(profile_df[c]).to_numpy() for c in QC_COLUMNS])
+        return self.append(keys, float_ids, cycles, values, qc, batch_id)
+
+    def append(self, keys, float_ids, cycles, values, qc, batch_id=None):
+        # Profile boundaries: wherever the key changes between consecutive rows
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        keep = ~np.isnan(values[:, 0])
+        counts = np.add.reduceat(keep.astype(np.int64), starts)
+
+        records = np.empty(len(starts), dtype=PROFILE_DTYPE)
+        records["float_id"] = float_ids[starts]
+        records["cycle_number"] = cycles[starts]
+        records["n_levels"] = counts
+        records["start"] = self._next_start + np.r_[0, np.cumsum(counts)[:-1]]
+
+        # Data first, records last: a crash leaves unreferenced levels, never dangling records
+        with open(self.root / "values.f32", "ab") as f:
+            f.write(np.ascontiguousarray(values[keep], dtype=np.float32).tobytes())
+        with open(self.root / "qc.i8", "ab") as f:
+            f.write(np.ascontiguousarray(qc[keep], dtype=np.int8).tobytes())
+        with open(self.root / "batches.i8", "ab") as f:
+            f.write(np.full(len(records), batch_tag(batch_id), dtype=np.int64).tobytes())
+        with open(self.root / "profiles.bin", "ab") as f:
+            f.write(records.tobytes())
+        self._next_start += int(counts.sum())
+        self._n_records += len(records)
+        return len(records)
+
+    def _retag(self, batch_id, new_tag, float_ids=None, cycle_numbers=None):
+        """Set the tag of `batch_id`'s entries (only those of the given profiles, if any); returns how many."""
+        if self._n_records == 0:
+            return 0
+        tags = np.memmap(self.root / "batches.i8", dtype=np.int64, mode="r+")
+        hit = tags == batch_tag(batch_id)
+        if float_ids is not None:
+            records = np.memmap(self.root / "profiles.bin", dtype=PROFILE_DTYPE, mode="r")
+            hit &= np.isin(_pack(records["float_id"], records["cycle_number"]), _pack(float_ids, cycle_numbers))
+        tags[hit] = new_tag
+        tags.flush()
+        del tags
+        (self.root / "lookup.npz").unlink(missing_ok=True)
+        return int(hit.sum())
+
+    def drop(self, batch_ids, float_ids=None, cycle_numbers=None):
+        """Hide the entries appended under `batch_ids` (only those of the given profiles, if any)."""
+        return sum(self._retag(batch_id, DROPPED, float_ids, cycle_numbers) for batch_id in batch_ids)
+
+    def move(self, batch_id, new_batch_id):
+        """Re-tag the remaining entries of a batch that was rewritten under a new ID."""
+        return self._retag(batch_id, batch_tag(new_batch_id))
+
+
+class ProfileStore:
+    """Read side: O(1) slice per profile once its entry is found, vectorized gathers for many."""
+
+    def __init__(self, root=STORE_PATH):
+        self.root = Path(root)
+        self.records = self._memmap("profiles.bin", PROFILE_DTYPE)
+        self.values = self._memmap("values.f32", np.float32).reshape(-1, 3)
+        self.qc = self._memmap("qc.i8", np.int8).reshape(-1, 3)
+        self.batches = self._memmap("batches.i8", np.int64)
+        self._keys, self._entries = self._load_lookup()
+
+    def _memmap(self, name, dtype):
+        path = self.root / name
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _load_lookup(self):
+        """Sorted unique keys → latest entry, cached on disk until new profiles are appended."""
+        cache = self.root / "lookup.npz"
+        if cache.exists():
+            with np.load(cache) as cached:
+                if int(cached["n_records"]) == len(self.records):
+                    return cached["keys"], cached["entries"]
+        live = np.flatnonzero(self.tags() != DROPPED)
+        keys = _pack(self.records["float_id"][live], self.records["cycle_number"][live])
+        # Reverse so that, among duplicates, np.unique keeps the most recent entry
+        uniq, first_rev = np.unique(keys[::-1], return_index=True)
+        entries = live[len(keys) - 1 - first_rev].astype(np.int64)
+        tmp = self.root / "lookup.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, keys=uniq, entries=entries, n_records=len(self.records))
+        os.replace(tmp, cache)
+        return uniq, entries
+
+    def __len__(self):
+        return len(self._keys)
+
+    def tags(self):
+        """Batch tag of every record (see batches.i8); 0 for records older than the tags file."""
+        tags = np.zeros(len(self.records), dtype=np.int64)
+        n = min(len(tags), len(self.batches))
+        tags[:n] = self.batches[:n]
+        return tags
+
+    def keys(self):
+        """(float_id, cycle_number) of every live profile, in key order."""
+        rec = self.records[self._entries]
+        return np.asarray(rec["float_id"]), np.asarray(rec["cycle_number"])
+
+    def find(self, float_ids, cycle_numbers):
+        """Entry index of each requested profile, or -1 where it is not stored (or cannot be)."""
+        ok = valid_key(float_ids, cycle_numbers)
+        wanted = np.where(ok, _pack(np.where(ok, float_ids, 0), np.where(ok, cycle_numbers, 0)), -1)
+        if len(self._keys) == 0:
+            return np.full(len(wanted), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._keys, wanted), len(self._keys) - 1)
+        return np.where(ok & (self._keys[pos] == wanted), self._entries[pos], -1)
+
+    def get(self, float_id, cycle_number, with_qc=False):
+        """Levels of one profile as a float32 [n, 3] view (pressure, temperature, salinity)."""
+        entry = int(self.find(float_id, cycle_number)[0])
+        if entry < 0:
+            raise KeyError(f"No profile for float {float_id} cycle {cycle_number}")
+        rec = self.records[entry]
+        sl = slice(int(rec["start"]), int(rec["start"]) + int(rec["n_levels"]))
+        return (self.values[sl], self.qc[sl]) if with_qc else self.values[sl]
+
+    def gather(self, entries=None):
+        """Levels of many profiles at once.
+
+        Returns (values [total, 3], qc [total, 3], offsets [len(entries) + 1]) so
+        profile i is values[offsets[i]:offsets[i + 1]]. Defaults to every live
+        profile, in key order.
+        """
+        entries = self._entries if entries is None else np.asarray(entries, dtype=np.int64)
+        rec = self.records[entries]
+        starts = np.asarray(rec["start"], dtype=np.int64)
+        counts = np.asarray(rec["n_levels"], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(counts)]
+        # Row index of every level of every requested profile, built without a Python loop
+        level_idx = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        return np.asarray(self.values[level_idx]), np.asarray(self.qc[level_idx]), offsets
+
+    def compact(self):
+        """Rewrite the store keeping only the latest entry of each profile."""
+        values, qc, offsets = self.gather()
+        rec = self.records[self._entries]
+        records = np.empty(len(rec), dtype=PROFILE_DTYPE)
+        records["float_id"] = rec["float_id"]
+        records["cycle_number"] = rec["cycle_number"]
+        records["n_levels"] = np.diff(offsets)
+        records["start"] = offsets[:-1]
+        tags = self.tags()[self._entries]
+        self.records = self.values = self.qc = self.batches = None  # release the memory maps before replacing files
+        for name, data in [("values.f32", values), ("qc.i8", qc), ("batches.i8", tags), ("profiles.bin", records)]:
+            tmp = self.root / (name + ".tmp")
+            data.tofile(tmp)
+            os.replace(tmp, self.root / name)
+        (self.root / "lookup.npz").unlink(missing_ok=True)
+        self.__init__(self.root)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or compact the ragged profile store.")
+    parser.add_argument("float_id", type=int, nargs="?")
+    parser.add_argument("cycle_number", type=int, nargs="?")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args()
+
+    store = ProfileStore()
+    if args.compact:
+        store.compact()
+    print(f"📦 {len(store)} profiles, {len(store.values)} levels in {STORE_PATH}")
+    if args.float_id is not None:
+        print(store.get(args.float_id, args.cycle_number))
@@ -0,0 +1,239 @@
+"""Batch QC filtering and per-profile oceanographic summaries.
+
+Reads every profile from the ragged store, keeps QC-passed levels and
+computes, with array operations over all profiles at once:
+
+    surface_temperature / surface_salinity  shallowest good level (≤ 10 dbar)
+    surface_sigma_t                         EOS-80 density anomaly at the surface, kg/m³
+    mixed_layer_depth                       density threshold (0.03 kg/m³ vs 10 dbar)
+    thermocline_depth                       depth of the strongest temperature decrease
+    max_depth                               deepest good pressure
+    n_good_levels
+
+The result is one row per profile, saved to `argo_profile_summaries.parquet`
+and joined to the metadata on (float_id, cycle_number). Each row keeps the
+store entry it was computed from, so `update_summaries()` (run at the end of
+every ingest) only recomputes profiles whose entry changed.
+
+Build with:  python profile_summaries.py
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from profile_store import ProfileStore, profile_key
+
+SUMMARIES_PATH = "argo_profile_summaries.parquet"
+
+GOOD_QC = (1, 2, 5, 8)  # good, probably good, changed, estimated
+SURFACE_MAX_PRES = 10.0
+MLD_REF_PRES = 10.0
+MLD_SIGMA_THRESHOLD = 0.03
+SUMMARY_COLUMNS = ["surface_temperature", "surface_salinity", "surface_sigma_t",
+                   "mixed_layer_depth", "thermocline_depth", "max_depth", "n_good_levels"]
+
+
+def sigma_t(temperature, salinity):
+    """Density anomaly (rho - 1000) at atmospheric pressure, EOS-80 (UNESCO 1981)."""
+    t, s = np.asarray(temperature, np.float64), np.asarray(salinity, np.float64)
+    rho_w = (999.842594 + 6.793952e-2 * t - 9.095290e-3 * t**2 + 1.001685e-4 * t**3
+             - 1.120083e-6 * t**4 + 6.536332e-9 * t**5)
+    a = 8.24493e-1 - 4.0899e-3 * t + 7.6438e-5 * t**2 - 8.2467e-7 * t**3 + 5.3875e-9 * t**4
+    b = -5.72466e-3 + 1.0227e-4 * t - 1.6546e-6 * t**2
+    c = 4.8314e-4
+    return rho_w + a * s + b * np.abs(s) ** 1.5 + c * s**2 - 1000.0
+
+
+def qc_mask(values, qc, accept_missing=True):
+    """Per-level validity of pressure, temperature and salinity ([n, 3] bool)."""
+    good = np.isin(qc, GOOD_QC)
+    if accept_missing:
+        good |= qc < 0  # files without QC variables
+    good &= np.isfinite(values)
+    good[:, 1:] &= good[:, :1]  # a level with bad pressure is unusable for T and S too
+    return good
+
+
+def _first_index(mask, pid, n_profiles):
+    """Index (into the level arrays) of the first True level per profile, or -1."""
+    idx = np.flatnonzero(mask)
+    first = np.full(n_profiles, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, pid[idx], idx)
+    first[first == np.iinfo(np.int64).max] = -1
+    return first
+
+
+def _take(values, index):
+    """values[index] with NaN where index is -1."""
+    out = np.full(len(index), np.nan, dtype=np.float64)
+    ok = index >= 0
+    out[ok] = values[index[ok]]
+    return out
+
+
+def summarize(values, qc, offsets, accept_missing=True):
+    """Summaries for profiles laid out as values[offsets[i]:offsets[i + 1]].
+
+    Returns a DataFrame with one row per profile (SUMMARY_COLUMNS).
+    """
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    pid = np.repeat(np.arange(n), counts)
+    good = qc_mask(values, qc, accept_missing)
+
+    # Order levels by pressure within each profile (bad pressures sort last)
+    pres_key = np.where(good[:, 0], values[:, 0], np.inf)
+    order = np.lexsort((pres_key, pid))
+    values, good, pid = values[order].astype(np.float64), good[order], pid[order]
+    pres, temp, sal = values[:, 0], values[:, 1], values[:, 2]
+    good_t, good_s = good[:, 1], good[:, 2]
+    good_ts = good_t & good_s
+
+    out = pd.DataFrame(index=np.arange(n))
+    out["n_good_levels"] = np.bincount(pid[good[:, 0]], minlength=n)
+
+    max_depth = np.full(n, -np.inf)
+    np.maximum.at(max_depth, pid[good[:, 0]], pres[good[:, 0]])
+    out["max_depth"] = np.where(np.isfinite(max_depth), max_depth, np.nan)
+
+    # Surface values: shallowest good level, if it is near enough the surface
+    first_t = _first_index(good_t, pid, n)
+    first_s = _first_index(good_s, pid, n)
+    out["surface_temperature"] = np.where(_take(pres, first_t) <= SURFACE_MAX_PRES, _take(temp, first_t), np.nan)
+    out["surface_salinity"] = np.where(_take(pres, first_s) <= SURFACE_MAX_PRES, _take(sal, first_s), np.nan)
+    out["surface_sigma_t"] = sigma_t(out["surface_temperature"], out["surface_salinity"])
+
+    # Mixed layer: first level below the 10 dbar reference whose density exceeds it by the threshold
+    sigma = np.where(good_ts, sigma_t(temp, sal), np.nan)
+    ref = _first_index(good_ts & (pres >= MLD_REF_PRES), pid, n)
+    ref_sigma = _take(sigma, ref)
+    ref_pres = _take(pres, ref)
+    below = good_ts & (pres > ref_pres[pid]) & (sigma > ref_sigma[pid] + MLD_SIGMA_THRESHOLD)
+    out["mixed_layer_depth"] = _take(pres, _first_index(below, pid, n))
+
+    # Thermocline: mid-depth of the steepest temperature drop between consecutive good levels
+    t_idx = np.flatnonzero(good_t)
+    upper, lower = t_idx[:-1], t_idx[1:]
+    same = pid[upper] == pid[lower]
+    upper, lower = upper[same], lower[same]
+    dp = pres[lower] - pres[upper]
+    ok = (dp > 0) & (pres[upper] >= SURFACE_MAX_PRES)
+    upper, lower, dp = upper[ok], lower[ok], dp[ok]
+    gradient = (temp[upper] - temp[lower]) / dp
+    best = np.full(n, -np.inf)
+    np.maximum.at(best, pid[upper], gradient)
+    is_best = (gradient == best[pid[upper]]) & (gradient > 0)
+    pair = np.full(n, len(upper), dtype=np.int64)
+    np.minimum.at(pair, pid[upper][is_best], np.flatnonzero(is_best))
+    found = pair < len(upper)
+    thermocline = np.full(n, np.nan)
+    thermocline[found] = (pres[upper[pair[found]]] + pres[lower[pair[found]]]) / 2
+    out["thermocline_depth"] = thermocline
+
+    return out[SUMMARY_COLUMNS]
+
+
+def _summarize_entries(store, float_ids, cycles, entries, chunk_profiles, accept_missing):
+    frames = []
+    for i in range(0, max(len(entries), 1), chunk_profiles):
+        part = slice(i, i + chunk_profiles)
+        values, qc, offsets = store.gather(entries[part])
+        frame = summarize(values, qc, offsets, accept_missing)
+        frame.insert(0, "entry", entries[part].astype(np.int64))
+        frame.insert(0, "cycle_number", cycles[part].astype(np.int32))
+        frame.insert(0, "float_id", float_ids[part].astype(np.int64))
+        frames.append(frame)
+    summaries = pd.concat(frames, ignore_index=True)
+    float_cols = [c for c in SUMMARY_COLUMNS if c != "n_good_levels"]
+    summaries[float_cols] = summaries[float_cols].astype(np.float32)
+    summaries["n_good_levels"] = summaries["n_good_levels"].astype(np.int32)
+    return summaries
+
+
+def build_summaries(store=None, chunk_profiles=200_000, accept_missing=True):
+    """Summaries for every profile in the store, processed in bounded chunks."""
+    store = store or ProfileStore()
+    float_ids, cycles = store.keys()
+    return _summarize_entries(store, float_ids, cycles, store.find(float_ids, cycles), chunk_profiles,
+                              accept_missing)
+
+
+def update_summaries(store=None, path=SUMMARIES_PATH, chunk_profiles=200_000, accept_missing=True):
+    """Bring the saved summaries in line with the store; returns how many profiles were summarized.
+
+    Profiles whose store entry differs from the one they were summarized
+    from (new, re-ingested, or back on an older entry after their batch
+    was dropped) are recomputed; profiles no longer stored are removed.
+    """
+    store = store or ProfileStore()
+    float_ids, cycles = store.keys()
+    entries = store.find(float_ids, cycles)
+    keys = profile_key(float_ids, cycles)  # sorted: keys() is in key order
+    fresh = np.ones(len(keys), dtype=bool)
+    kept = []
+    old = load_summaries(path)
+    if old is not None and "entry" in old and len(keys):
+        old_keys = profile_key(old["float_id"].to_numpy(), old["cycle_number"].to_numpy())
+        pos = np.minimum(np.searchsorted(keys, old_keys), len(keys) - 1)
+        current = (keys[pos] == old_keys) & (entries[pos] == old["entry"].to_numpy())
+        fresh[pos[current]] = False
+        kept = [old[current]]
+    summarized = _summarize_entries(store, float_ids[fresh], cycles[fresh], entries[fresh], chunk_profiles,
+                                    accept_missing)
+    summaries = (pd.concat(kept + [summarized], ignore_index=True) if kept and len(kept[0]) else summarized)
+    save_summaries(summaries.sort_values(["float_id", "cycle_number"], ignore_index=True), path)
+    return int(fresh.sum())
+
+
+def save_summaries(summaries, path=SUMMARIES_PATH):
+    """Write the summaries Parquet file atomically (readers never see a partial file)."""
+    tmp = Path(str(path) + ".tmp")
+    summaries.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def load_summaries(path=SUMMARIES_PATH):
+    return pd.read_parquet(path) if Path(path).exists() else None
+
+
+def attach_summaries(metadata_df, summaries):
+    """Left-join summaries onto metadata by (float_id, cycle_number), keeping the row-ID index."""
+    if summaries is None:
+        return metadata_df
+    keys = metadata_df[["float_id", "cycle_number"]].astype({"float_id": np.int64, "cycle_number": np.int32})
+    joined = keys.merge(summaries, on=["float_id", "cycle_number"], how="left")
+    joined.index = metadata_df.index
+    return pd.concat([metadata_df, joined[SUMMARY_COLUMNS]], axis=1)
+
+
+SUMMARY_PHRASES = [  # (column, format), in the order they are listed
+    ("surface_temperature", "surface {:.1f}°C"),
+    ("surface_salinity", "{:.2f} PSU"),
+    ("surface_sigma_t", "σt {:.2f}"),
+    ("mixed_layer_depth", "mixed layer {:.0f} dbar"),
+    ("thermocline_depth", "thermocline {:.0f} dbar"),
+    ("max_depth", "profiled to {:.0f} dbar"),
+]
+
+
+def summary_texts(df):
+    """Short human-readable description of each row's profile summary ('' if it has none), built column-wise."""
+    texts = pd.Series("", index=df.index, dtype=object)
+    for column, fmt in SUMMARY_PHRASES:
+        if column not in df:
+            continue
+        values = df[column].astype("float64")
+        present = values.notna().to_numpy()
+        phrase = np.where(present, values.map(fmt.format, na_action="ignore").astype(object), "")
+        sep = np.where(present & (texts != "").to_numpy(), ", ", "")
+        texts = texts + sep + phrase
+    return texts
+
+
+if __name__ == "__main__":
+    summaries = build_summaries()
+    save_summaries(summaries)
+    print(f"✅ {len(summaries)} profile summaries → {SUMMARIES_PATH}")
+    print(summaries[SUMMARY_COLUMNS].describe().T[["count", "mean", "min", "max"]])
@@ -0,0 +1,196 @@
+"""Rule-based query understanding: pull the structured facts out of a question.
+
+    "What ARGO floats were near -41N, 96E in 2013 and what patterns do they show?"
+    → lat -41, lon 96, 2013-01-01..2013-12-31, free text ""
+
+Recognised: coordinates (with N/S/E/W hemispheres, "lat/lon" labels or a
+bare "near <lat>, <lon>" pair), radii ("within 500 km", miles, nautical
+miles, degrees), dates (ISO days, "2013-10", "October 2013", years) and
+ranges between them ("from ... to ...", "between ... and ...", "2012-2014"),
+and 7-digit WMO float IDs. What remains after removing those spans and
+filler words is the free-text intent. A question with a filter and no
+remaining intent is structured: it can be answered from the metadata
+indexes alone, without the embedding model.
+"""
+import calendar
+import re
+
+import pandas as pd
+
+KM_PER_UNIT = {"km": 1.0, "kilometer": 1.0, "kilometre": 1.0, "mi": 1.609344, "mile": 1.609344,
+               "nm": 1.852, "nautical mile": 1.852, "deg": 111.195, "degree": 111.195, "°": 111.195}
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+
+_NUM = r"[-+]?\d+(?:\.\d+)?"
+_MONTH = r"(?:" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+
+
+def _date(p):
+    """One date expression; group names carry the prefix `p` so two can share a pattern."""
+    return (rf"(?:(?P<{p}day>\d{{4}}-\d{{1,2}}-\d{{1,2}})"
+            rf"|(?P<{p}ym>\d{{4}}-\d{{1,2}})(?!\d)"
+            rf"|(?P<{p}mname>{_MONTH})\s+(?P<{p}myear>(?:19|20)\d{{2}})"
+            rf"|(?P<{p}year>(?:19|20)\d{{2}}))")
+
+
+COORD_HEMISPHERE = re.compile(
+    rf"(?P<lat>{_NUM})\s*°?\s*(?P<ns>[NSns])\b\s*,?\s*(?P<lon>{_NUM})\s*°?\s*(?P<ew>[EWew])\b")
+COORD_LABELLED = re.compile(
+    rf"\blat(?:itude)?\s*[=:]?\s*(?P<lat>{_NUM})\s*,?\s*(?:and\s+)?lon(?:gitude)?\s*[=:]?\s*(?P<lon>{_NUM})", re.I)
+COORD_PAIR = re.compile(rf"(?:\b(?:near|at|around|of)\s+|\()\s*(?P<lat>{_NUM})\s*,\s*(?P<lon>{_NUM})\)?", re.I)
+RADIUS = re.compile(
+    rf"(?:\bwithin\s+|\bradius\s+(?:of\s+)?)(?P<value>{_NUM})\s*(?P<unit>km|kilomet(?:er|re)s?|mi(?:les?)?|nm|"
+    rf"nautical\s+miles?|deg(?:rees?)?|°)"
+    rf"|(?P<value2>{_NUM})\s*(?P<unit2>km|kilomet(?:er|re)s?|mi(?:les?)?|nm|nautical\s+miles?)\s+radius", re.I)
+# "and" separates a range only after "between": "in 2012 and 2014" names two periods
+DATE_RANGE = re.compile(
+    rf"(?:(?P<between>\bbetween\s+)|\bfrom\s+)?{_date('a_')}\s*(?:-|–|to|until|through|(?(between)and|(?!)))\s*"
+    rf"{_date('b_')}", re.I)
+DATE_ONLY = re.compile(rf"\s*{_date('')}\s*", re.I)
+DATE_SINGLE = re.compile(rf"(?:\b(?:in|on|during|since|after|before|until|from)\s+)?\b{_date('')}\b", re.I)
+FLOAT_ID = re.compile(r"\b(?:(?:float|wmo|platform)s?\s*(?:id|#|no\.?|number)?\s*[:#]?\s*)?(?P<id>[1-7]\d{6})\b", re.I)
+
+# Words that carry no retrieval intent of their own. Variables and analysis words are kept out of
+# the embedding too: the row embeddings only describe float, place and time, so they cannot rank
+# on them. They still reach the LLM through the full question.
+FILLER_WORDS = set("""
+a an the and or of in on at to for from with within near around by during between over across
+what which where when who how is are was were be been do does did can could would should will show
+shows tell me us give list find any all some there their they them it its this that these those
+argo float floats profile profiles data measurement measurements observation observations record records
+pattern patterns trend trends summary summarize summarise describe explain analysis analyze analyse
+temperature temperatures salinity salinities pressure depth depths density mixed layer thermocline
+ocean oceanographic water surface region area location locations nearby about please
+""".split())
+
+
+class ParsedQuery:
+    """The structured part of a question plus whatever free text is left."""
+
+    def __init__(self, question, lat=None, lon=None, radius_km=None, start=None, end=None,
+                 float_ids=None, text=""):
+        self.question = question
+        self.lat = lat
+        self.lon = lon
+        self.radius_km = radius_km
+        self.start = start
+        self.end = end
+        self.float_ids = float_ids or []
+        self.text = text
+
+    @property
+    def has_filter(self):
+        return (self.lat is not None and self.lon is not None) or self.start is not None \
+            or self.end is not None or bool(self.float_ids)
+
+    @property
+    def is_structured(self):
+        """True when the filters say everything: no embedding needed to rank."""
+        return self.has_filter and not self.text
+
+    def as_dict(self):
+        return {"lat": self.lat, "lon": self.lon, "radius_km": self.radius_km, "start": self.start,
+                "end": self.end, "float_ids": self.float_ids, "text": self.text}
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.as_dict().items() if v not in (None, [], ""))
+        return f"ParsedQuery({fields})"
+
+
+def _signed(value, hemisphere):
+    """S/W make a coordinate negative; N/E keep the sign as written ("-41N" stays -41)."""
+    value = float(value)
+    return -abs(value) if hemisphere.upper() in "SW" else value
+
+
+def _valid(lat, lon):
+    return -90 <= lat <= 90 and -180 <= lon <= 360
+
+
+def _span(match, prefix=""):
+    """(start, end) ISO dates covered by one date expression."""
+    g = lambda name: match.group(prefix + name)
+    if g("day"):
+        day = pd.Timestamp(g("day"))
+        return day, day
+    if g("ym"):
+        first = pd.Timestamp(g("ym") + "-01")
+        return first, first + pd.offsets.MonthEnd(0)
+    if g("mname"):
+        first = pd.Timestamp(year=int(g("myear")), month=MONTHS[g("mname").lower().rstrip(".")], day=1)
+        return first, first + pd.offsets.MonthEnd(0)
+    year = int(g("year"))
+    return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=12, day=31)
+
+
+def date_span(text):
+    """(first, last day) named by a bare date string ("2013", "2013-10", "October 2013", "2013-10-04"), or None."""
+    match = DATE_ONLY.fullmatch(text)
+    return _span(match) if match else None
+
+
+def _blank(text, match):
+    return text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+
+def parse_query(question):
+    """Extract coordinates, radius, time window and float IDs from `question`."""
+    parsed = ParsedQuery(question)
+    text = question
+
+    for pattern in (COORD_HEMISPHERE, COORD_LABELLED, COORD_PAIR):
+        match = pattern.search(text)
+        if not match:
+            continue
+        if pattern is COORD_HEMISPHERE:
+            lat, lon = _signed(match["lat"], match["ns"]), _signed(match["lon"], match["ew"])
+        else:
+            lat, lon = float(match["lat"]), float(match["lon"])
+        if _valid(lat, lon):
+            parsed.lat, parsed.lon = lat, lon
+            text = _blank(text, match)
+            break
+
+    match = RADIUS.search(text)
+    if match:
+        value, unit = (match["value"], match["unit"]) if match["value"] else (match["value2"], match["unit2"])
+        unit = re.sub(r"\s+", " ", unit.lower()).rstrip("s")
+        unit = next(u for u in sorted(KM_PER_UNIT, key=len, reverse=True) if unit.startswith(u))
+        parsed.radius_km = float(value) * KM_PER_UNIT[unit]
+        text = _blank(text, match)
+
+    # Float IDs before dates, so a 7-digit ID is never read as a year
+    for match in list(FLOAT_ID.finditer(text)):
+        parsed.float_ids.append(int(match["id"]))
+    text = FLOAT_ID.sub(lambda m: " " * len(m.group(0)), text)
+
+    spans = []
+    for match in list(DATE_RANGE.finditer(text)):
+        spans.append((_span(match, "a_")[0], _span(match, "b_")[1]))
+    text = DATE_RANGE.sub(lambda m: " " * len(m.group(0)), text)
+    for match in list(DATE_SINGLE.finditer(text)):
+        start, end = _span(match)
+        keyword = match.group(0).split()[0].lower()
+        # "since"/"until" include the named period, "after"/"before" exclude it
+        if keyword == "since":
+            end = None
+        elif keyword == "after":
+            start, end = end + pd.Timedelta(days=1), None
+        elif keyword == "until":
+            start = None
+        elif keyword == "before":
+            start, end = None, start - pd.Timedelta(days=1)
+        spans.append((start, end))
+    text = DATE_SINGLE.sub(lambda m: " " * len(m.group(0)), text)
+    if spans:
+        starts = [s for s, _ in spans if s is not None]
+        ends = [e for _, e in spans if e is not None]
+        parsed.start = min(starts).strftime("%Y-%m-%d") if starts else None
+        parsed.end = max(ends).strftime("%Y-%m-%d") if ends else None
+
+    words = re.findall(r"[A-Za-z][A-Za-z'-]*", text)
+    parsed.text = " ".join(w for w in words if w.lower() not in FILLER_WORDS and len(w) > 1)
+    return parsed
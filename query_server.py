@@ -0,0 +1,318 @@
+"""Resident query service: loads the model, indexes and metadata once, serves many questions.
+
+Run with:  python query_server.py --port 8080
+Ask with:  curl -X POST localhost:8080/query -d '{"question": "Floats near -41N, 96E in 2013?"}'
+
+Coordinates, radius, dates and float IDs are parsed from the question;
+explicit "lat", "lon", "radius_km", "start", "end" and "float_ids" fields
+override them; a malformed body or field is answered with 400. Purely
+structured questions skip the embedding model;
+concurrent free-text ones are encoded together in one batch (--encoder
+picks the PyTorch model or its ONNX / int8 export, see encoder.py).
+Answers are cached on disk (answer_cache.py); "cached" in the response
+tells whether one was reused. The context is packed into a token budget
+(--context-tokens, or "context_tokens" per request; see context_builder.py). GET /metrics serves per-stage timings, row
+counts and memory (tracing.py) in the Prometheus text format.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from aiohttp import web
+
+from answer_cache import ANSWER_CACHE_PATH, AnswerCache, cached_generate, cached_stream
+from climatology import CLIMATOLOGY_PATH
+from embedding_store import EMBEDDINGS_PATH, INDEX_PATH, EmbeddingStore
+from encoder import BACKENDS
+from ollama_client import OllamaClient, OllamaError
+from columnar_store import METADATA_DATASET
+from context_builder import CONTEXT_TOKENS, build_context
+from rag import DEFAULT_MODEL, load_assets, search
+from tracing import TRACER, span
+from vector_index import describe, manifest_path
+
+
+NUMBER_FIELDS = {"k": int, "context_tokens": int, "lat": float, "lon": float, "radius_km": float}
+POSITIVE_FIELDS = ("k", "context_tokens", "radius_km")
+
+
+def validate_body(body):
+    """Check and convert the request fields in place; raises HTTPBadRequest naming the first bad one."""
+    if not isinstance(body, dict) or not isinstance(body.get("question"), str) or not body["question"].strip():
+        raise web.HTTPBadRequest(text="'question' is required")
+    for name, kind in NUMBER_FIELDS.items():
+        value = body.get(name)
+        if value is None:
+            continue
+        try:
+            if isinstance(value, bool):
+                raise TypeError(value)
+            body[name] = kind(value)
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text=f"'{name}' must be {'an integer' if kind is int else 'a number'}, "
+                                          f"got {value!r}")
+        if name in POSITIVE_FIELDS and body[name] <= 0:
+            raise web.HTTPBadRequest(text=f"'{name}' must be positive, got {value!r}")
+    for name in ("start", "end"):
+        value = body.get(name)
+        if value is None:
+            continue
+        try:
+            if not isinstance(value, str):
+                raise TypeError(value)
+            pd.Timestamp(value)
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text=f"'{name}' must be a date such as \"2013-10-04\", got {value!r}")
+    float_ids = body.get("float_ids")
+    if float_ids is not None:
+        if not isinstance(float_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool)
+                                                      for i in float_ids):
+            raise web.HTTPBadRequest(text=f"'float_ids' must be a list of integers, got {float_ids!r}")
+    return body
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of query text → query embedding."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, model, text):
+        with self._lock:
+            if text in self._items:
+                self._items.move_to_end(text)
+                self.hits += 1
+                return self._items[text]
+            self.misses += 1
+        vector = model.encode([text], convert_to_numpy=True)[0]
+        with self._lock:
+            self._items[text] = vector
+            self._items.move_to_end(text)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class QueryService:
+    """Holds the resident assets and swaps them atomically when a new index is written."""
+
+    def __init__(self, metadata_path=METADATA_DATASET, index_path=INDEX_PATH,
+                 embeddings_path=EMBEDDINGS_PATH, cache_size=4096, workers=4, reload_interval=10.0,
+                 answer_cache=None, encoder_options=None, context_tokens=CONTEXT_TOKENS,
+                 climatology_path=CLIMATOLOGY_PATH):
+        self.paths = {"metadata_path": metadata_path, "index_path": index_path,
+                      "embeddings_path": embeddings_path, "climatology_path": climatology_path}
+        self.cache = EmbeddingCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.reload_interval = reload_interval
+        self.assets = None
+        self._signature = None
+        self.ollama = OllamaClient(max_connections=32)
+        self.answers = answer_cache
+        self.encoder_options = encoder_options or {}
+        self.context_tokens = context_tokens
+
+    def _files_signature(self):
+        """(mtime, size) of every file the assets come from; changes trigger a reload."""
+        signature = []
+        # Every climatology update rewrites its group metadata, so that one file stands for the cube
+        watched = {**self.paths, "climatology_path": os.path.join(self.paths["climatology_path"], "zarr.json")}
+        for path in [*watched.values(), manifest_path(self.paths["index_path"])]:
+            if os.path.isdir(path):
+                # Partitioned dataset: new part files land in subdirectories
+                stats = [os.stat(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files]
+                signature.append((len(stats), max((st.st_mtime_ns for st in stats), default=0)))
+                continue
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load(self):
+        signature = self._files_signature()
+        previous = self.assets
+        model = None
+        if previous is not None:
+            model_name = EmbeddingStore.open(self.paths["embeddings_path"]).model_name or DEFAULT_MODEL
+            if model_name == previous.model_name:
+                # Same encoder: keep the resident model and the embedding cache warm
+                model = previous.loaded_model
+        assets = load_assets(**self.paths, embedding_model=model, **self.encoder_options)
+        if previous is not None and model_name != previous.model_name:
+            self.cache.clear()
+        return assets, signature
+
+    async def start(self, app):
+        loop = asyncio.get_running_loop()
+        print("Loading metadata and FAISS index...")
+        self.assets, self._signature = await loop.run_in_executor(self.executor, self._load)
+        print("✅ Assets loaded.")
+        await self.ollama.open()
+        app["reloader"] = asyncio.create_task(self._watch())
+
+    async def stop(self, app):
+        app["reloader"].cancel()
+        await self.ollama.close()
+        self.executor.shutdown(wait=False)
+        if self.answers is not None:
+            self.answers.close()
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self._files_signature() == self._signature:
+                continue
+            try:
+                assets, signature = await loop.run_in_executor(self.executor, self._load)
+            except Exception as e:
+                # Typically a half-written index; try again on the next tick
+                print(f"⚠ Reload failed, keeping current assets: {e}")
+                continue
+            self.assets, self._signature = assets, signature
+            print(f"🔄 Reloaded assets ({len(assets.df)} rows, index {describe(assets.index_manifest)})")
+
+    def _retrieve(self, assets, body):
+        overrides = {name: body[name] for name in ("lat", "lon", "radius_km", "start", "end", "float_ids")
+                     if body.get(name) is not None}
+        rows, _ = search(assets, body["question"], k=body.get("k", 5),
+                         encode=lambda text: self.cache.get_or_encode(assets.embedding_model, text), **overrides)
+        return rows
+
+    def _answer_inputs(self, assets, body):
+        """The blocking part of a request: retrieval, the context and, for near-duplicate answer reuse, the
+        question's embedding (only when the encoder is already resident)."""
+        rows = self._retrieve(assets, body)
+        context = build_context(rows, body.get("context_tokens", self.context_tokens), climatology=assets.climatology)
+        vector = None
+        if self.answers is not None and self.answers.similarity is not None and assets.loaded_model is not None:
+            vector = self.cache.get_or_encode(assets.embedding_model, body["question"])
+        return rows, context, vector
+
+    async def _prepare(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError as e:
+            raise web.HTTPBadRequest(text=f"Request body is not valid JSON: {e}")
+        validate_body(body)
+        # Pin the assets for this request so a concurrent reload cannot mix versions
+        assets = self.assets
+        loop = asyncio.get_running_loop()
+        rows, context, vector = await loop.run_in_executor(self.executor, self._answer_inputs, assets, body)
+        # The answer cache only embeds this question: hand it the vector computed off the event loop
+        encode = None if vector is None else (lambda text: vector)
+        return body, rows, context, encode
+
+    async def handle_query(self, request):
+        with span("request", endpoint="query") as s:
+            body, rows, context, encode = await self._prepare(request)
+            s.rows = len(rows)
+            result = {"row_ids": rows.index.tolist(), "context": context}
+            if body.get("generate", True) and len(rows):
+                try:
+                    result["answer"], result["cached"] = await cached_generate(
+                        self.ollama, self.answers, context, rows.index, body["question"], encode)
+                except OllamaError as e:
+                    result["error"] = f"Generation failed: {e}"
+        return web.json_response(result)
+
+    async def handle_query_stream(self, request):
+        """Same as /query, but as NDJSON: the context first, then one line per token."""
+        body, rows, context, encode = await self._prepare(request)
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+
+        async def send(obj):
+            await response.write(json.dumps(obj).encode() + b"\n")
+
+        await send({"row_ids": rows.index.tolist(), "context": context})
+        if len(rows):
+            try:
+                # If the caller disconnects, the write fails and leaving the loop closes the Ollama stream
+                async for token in cached_stream(self.ollama, self.answers, context, rows.index, body["question"],
+                                                 encode):
+                    await send({"token": token})
+            except OllamaError as e:
+                await send({"error": f"Generation failed: {e}"})
+        await send({"done": True})
+        await response.write_eof()
+        return response
+
+    async def handle_metrics(self, request):
+        assets = self.assets
+        gauges = {"metadata_rows": len(assets.df), "index_rows": assets.index.ntotal,
+                  "embedding_cache_hits": self.cache.hits, "embedding_cache_misses": self.cache.misses}
+        if self.answers is not None:
+            gauges.update({f"answer_cache_{name}": value for name, value in self.answers.stats().items()})
+        return web.Response(body=TRACER.prometheus_text(gauges).encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def handle_health(self, request):
+        assets = self.assets
+        return web.json_response({
+            "rows": len(assets.df),
+            "model": assets.model_name,
+            "index": describe(assets.index_manifest),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "answer_cache": self.answers.stats() if self.answers is not None else None,
+        })
+
+
+def make_app(service):
+    app = web.Application()
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.router.add_post("/query", service.handle_query)
+    app.router.add_post("/query/stream", service.handle_query_stream)
+    app.router.add_get("/health", service.handle_health)
+    app.router.add_get("/metrics", service.handle_metrics)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=4096, help="query embeddings kept in the LRU")
+    parser.add_argument("--workers", type=int, default=4, help="threads for encoding and search")
+    parser.add_argument("--reload-interval", type=float, default=10.0, help="seconds between index checks")
+    parser.add_argument("--encoder", choices=BACKENDS, default=None,
+                        help="query encoder backend (default $FLOATCHAT_ENCODER, else torch)")
+    parser.add_argument("--threads", type=int, default=None, help="encoder threads (default: all cores)")
+    parser.add_argument("--batch-window", type=float, default=0.002,
+                        help="seconds concurrent queries wait to be encoded together (0 to disable)")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS,
+                        help="approximate token budget of a question's context")
+    parser.add_argument("--answer-cache", default=ANSWER_CACHE_PATH, help="SQLite answer cache ('' to disable)")
+    parser.add_argument("--answer-ttl", type=float, default=30.0, help="days a cached answer stays valid")
+    parser.add_argument("--answer-cache-entries", type=int, default=10_000, help="answers kept at most")
+    parser.add_argument("--similarity", type=float, default=None,
+                        help="reuse answers of near-duplicate questions at this cosine similarity (e.g. 0.95)")
+    args = parser.parse_args()
+
+    answers = None
+    if args.answer_cache:
+        answers = AnswerCache(args.answer_cache, max_entries=args.answer_cache_entries,
+                              ttl=args.answer_ttl * 24 * 3600, similarity=args.similarity)
+    service = QueryService(cache_size=args.cache_size, workers=args.workers,
+                           reload_interval=args.reload_interval, answer_cache=answers,
+                           encoder_options={"backend": args.encoder, "threads": args.threads,
+                                            "batch_window": args.batch_window},
+                           context_tokens=args.context_tokens)
+    web.run_app(make_app(service), host=args.host, port=args.port)
@@ -0,0 +1,246 @@
+"""Shared retrieval and prompting steps used by the pipelines and the query server."""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from climatology import CLIMATOLOGY_PATH, open_climatology
+from columnar_store import METADATA_DATASET, load_metadata
+from embedding_store import EMBEDDINGS_PATH, INDEX_PATH, EmbeddingStore, model_fingerprint, search_subset
+from encoder import BatchingEncoder, load_encoder
+from float_index import load_or_build
+from profile_summaries import attach_summaries, load_summaries
+from query_parser import date_span, parse_query
+from tracing import span
+from vector_index import load_index
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"  # what vect_db.py used before the store recorded its model
+EXACT_SEARCH_MAX_ROWS = 50_000  # filtered candidate sets up to this size are searched exactly
+
+# Bump whenever PROMPT_TEMPLATE or the context format changes: cached answers are keyed on it
+PROMPT_TEMPLATE_VERSION = 3
+PROMPT_TEMPLATE = """You are an expert oceanographer. Analyze the provided ARGO float data and answer the question based solely on it. If the data does not contain enough information to answer the question, simply state that.
+
+**Context Data:**
+{context}
+
+**Question:**
+{query}
+
+**Answer:** (be concise, one paragraph)
+"""
+
+
+class Assets:
+    """Everything a query needs, loaded once: metadata, indexes, climatology and the query encoder.
+
+    The encoder is loaded on first use, so structured questions (answered
+    from the metadata indexes alone) never pay for it.
+    """
+
+    def __init__(self, df, float_index, embedding_store, index, embedding_model, model_name, index_manifest=None,
+                 encoder_options=None, climatology=None):
+        self.df = df
+        self.float_index = float_index
+        self.climatology = climatology
+        self.embedding_store = embedding_store
+        self.index = index
+        self.index_manifest = index_manifest or {}
+        self.model_name = model_name
+        self.encoder_options = encoder_options or {}
+        self._embedding_model = embedding_model
+        self._model_lock = threading.Lock()
+
+    @property
+    def loaded_model(self):
+        """The encoder if it has been loaded, else None."""
+        return self._embedding_model
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    self._embedding_model = _load_model(self.model_name, self.embedding_store, self.index_manifest,
+                                                         **self.encoder_options)
+        return self._embedding_model
+
+
+def _load_model(model_name, embedding_store, index_manifest, model=None, backend=None, threads=None,
+                batch_window=None):
+    """Load (or take) the query encoder and check its fingerprint against the store and index.
+
+    `backend` and `threads` select the encoder (see encoder.py). With
+    `batch_window` (seconds), concurrent encode calls are coalesced.
+    """
+    with span("load.model", model=model_name) as s:
+        if model is None:
+            model = load_encoder(model_name, backend, threads)
+            if batch_window:
+                model = BatchingEncoder(model, max_wait=batch_window)
+        s.set(backend=getattr(model, "backend", "torch"))
+        fingerprint = model_fingerprint(model, model_name)
+    embedding_store.check_model(model_name, fingerprint)
+    expected = index_manifest.get("fingerprint")
+    if expected and expected != fingerprint:
+        raise ValueError(f"Model fingerprint {fingerprint} differs from the index's {expected}")
+    return model
+
+
+def load_assets(metadata_path=METADATA_DATASET, index_path=INDEX_PATH,
+                embeddings_path=EMBEDDINGS_PATH, embedding_model=None, climatology_path=CLIMATOLOGY_PATH,
+                **encoder_options):
+    """Load metadata, float index, embedding store, FAISS index and (if built) the climatology.
+
+    The encoder is loaded lazily (see Assets). Pass an already-loaded
+    `embedding_model` to reuse it (e.g. on an index hot-reload where the
+    model did not change); it is checked right away. `encoder_options`
+    (backend, threads, batch_window) go to _load_model().
+    """
+    with span("load.metadata") as s:
+        # Precomputed per-profile summaries (profile_summaries.py), when they have been built
+        df = attach_summaries(load_metadata(metadata_path), load_summaries())
+        s.rows = len(df)
+    with span("load.float_index", rows=len(df)) as s:
+        # Per float-month boxes over the cycles; kept current by read_multiple.py
+        float_index = load_or_build(df)
+        s.set(entries=len(float_index))
+    with span("load.climatology") as s:
+        # Regional context for the prompt (climatology.py); None until it has been built
+        climatology = open_climatology(climatology_path)
+        s.rows = climatology.n_profiles if climatology is not None else 0
+    with span("load.embeddings") as s:
+        embedding_store = EmbeddingStore.open(embeddings_path)
+        s.rows = len(embedding_store)
+    model_name = embedding_store.model_name or DEFAULT_MODEL
+    embedding_store.check_model(model_name)
+    with span("load.faiss_index") as s:
+        # Raises if the index was built with another model or does not match the store
+        index, index_manifest = load_index(index_path, model_name, None, embedding_store)
+        s.rows = index.ntotal
+    if embedding_model is not None:
+        embedding_model = _load_model(model_name, embedding_store, index_manifest, embedding_model)
+    return Assets(df, float_index, embedding_store, index, embedding_model, model_name, index_manifest,
+                  encoder_options, climatology)
+
+
+def _inclusive_end(end):
+    """A date-only end bound covers the whole year, month or day it names ("2013", "2013-12", "2013-12-31")."""
+    days = date_span(end) if isinstance(end, str) else None
+    if days is not None:
+        return days[1] + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    return end
+
+
+def filter_candidates(assets, lat=None, lon=None, radius_km=1500, start=None, end=None, float_ids=None):
+    """Row IDs passing the structured filter, or None when there is no filter at all.
+
+    Coarse to fine: the float index prunes float-months by time, float and
+    bounding box, and only their cycles are checked exactly. Row IDs come
+    nearest first for a place, else in time order within each float-month.
+    """
+    end = _inclusive_end(end) if end is not None else None
+    if lat is not None and lon is not None:
+        row_ids, _ = assets.float_index.query_radius(lat, lon, radius_km, start, end, float_ids)
+        return row_ids
+    if start is not None or end is not None or float_ids:
+        return assets.float_index.query_time(start, end, float_ids)
+    return None
+
+
+def _rank(assets, query_embeddings, candidate_ids, k):
+    """(distances, row_ids) per query embedding, restricted to `candidate_ids`."""
+    if candidate_ids is not None and len(candidate_ids) <= EXACT_SEARCH_MAX_ROWS:
+        # A small filtered set: exact distances over its stored vectors, no approximate probing
+        return assets.embedding_store.search(query_embeddings, candidate_ids, k=k)
+    return search_subset(assets.index, query_embeddings, candidate_ids, k=k)
+
+
+def retrieve(assets, query_embedding, candidate_ids=None, k=5):
+    """Top-k metadata rows for one query embedding, restricted to `candidate_ids`."""
+    _, row_ids = _rank(assets, query_embedding.reshape(1, -1), candidate_ids, k)[0]
+    return assets.df.loc[row_ids]
+
+
+def search(assets, question, k=5, radius_km=1500, encode=None, **overrides):
+    """Parse `question`, filter, and rank; returns (rows, parsed query).
+
+    Explicit `overrides` (lat, lon, radius_km, start, end, float_ids) win over
+    what the parser found. A structured question (filters and nothing else)
+    takes the first k filtered rows, nearest first, without touching the
+    encoder. Otherwise the leftover free text is embedded - or the whole
+    question when the parser found no filter - and ranked within the filter.
+    """
+    encode_batch = None if encode is None else (lambda texts: np.stack([encode(text) for text in texts]))
+    return search_many(assets, [question], k, radius_km, [overrides], encode_batch)[0]
+
+
+def search_many(assets, questions, k=5, radius_km=1500, overrides=None, encode_batch=None, batch_size=256):
+    """search() for many questions at once; returns [(rows, parsed), ...] in input order.
+
+    `k` is one value or one per question. Every free-text query is embedded
+    in a single batched encode call. Questions are grouped by their filter,
+    so all questions with the same place, time and floats share one
+    candidate set and one batched search (unfiltered ones share one
+    index.search over the whole index).
+    """
+    with span("search", rows=len(questions)):
+        return _search_many(assets, questions, k, radius_km, overrides, encode_batch, batch_size)
+
+
+def _search_many(assets, questions, k, radius_km, overrides, encode_batch, batch_size):
+    overrides = overrides or [{}] * len(questions)
+    ks = [k] * len(questions) if np.isscalar(k) else list(k)
+    with span("search.parse", rows=len(questions)):
+        parsed = [parse_query(question) for question in questions]
+        for query, fields in zip(parsed, overrides):
+            for name, value in fields.items():
+                if value is not None:
+                    setattr(query, name, value)
+
+    groups = {}
+    for i, query in enumerate(parsed):
+        key = (query.lat, query.lon, query.radius_km or radius_km, query.start, query.end, tuple(query.float_ids))
+        groups.setdefault(key, []).append(i)
+
+    results = [None] * len(questions)
+    to_rank = []  # (candidate_ids, positions) of groups that need the encoder
+    with span("search.filter", groups=len(groups)) as s:
+        s.rows = 0
+        for key, positions in groups.items():
+            candidate_ids = filter_candidates(assets, *key[:5], list(key[5]))
+            s.rows += len(candidate_ids) if candidate_ids is not None else 0
+            free_text = []
+            for i in positions:
+                if candidate_ids is not None and len(candidate_ids) == 0:
+                    results[i] = (assets.df.iloc[:0], parsed[i])
+                elif parsed[i].is_structured:
+                    results[i] = (assets.df.loc[candidate_ids[:ks[i]]], parsed[i])
+                else:
+                    free_text.append(i)
+            if free_text:
+                to_rank.append((candidate_ids, free_text))
+    if not to_rank:
+        return results
+
+    order = [i for _, positions in to_rank for i in positions]
+    texts = [parsed[i].text if parsed[i].has_filter else questions[i] for i in order]
+    with span("search.encode", rows=len(texts)):
+        if encode_batch is None:
+            embeddings = assets.embedding_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        else:
+            embeddings = encode_batch(texts)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    with span("search.rank", rows=len(texts), groups=len(to_rank)):
+        offset = 0
+        for candidate_ids, positions in to_rank:
+            hits = _rank(assets, embeddings[offset:offset + len(positions)], candidate_ids,
+                         max(ks[i] for i in positions))
+            offset += len(positions)
+            for i, (_, row_ids) in zip(positions, hits):
+                results[i] = (assets.df.loc[row_ids[:ks[i]]], parsed[i])
+    return results
+
+
+def build_prompt(context, query):
+    return PROMPT_TEMPLATE.format(context=context, query=query)
@@ -1,79 +1,314 @@
+import argparse
+import os
+import shutil
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
 import xarray as xr
 import pandas as pd
-from pathlib import Path
 
-metadata_list = []
-profile_list = []
-
-data_dir = Path(r"C:\Users\alexe\Desktop\argo-floatchat\argo_data")
-
-for nc_file in data_dir.glob("*.nc"):
-    ds = xr.open_dataset(nc_file)
-    print(f"Processing {nc_file.name} with shape {ds.dims}")
-
-    # Handle case-insensitive variable names
-    var_names = {name.lower(): name for name in ds.variables.keys()}
-    
-    # Get platform_number variable name
-    platform_var = var_names.get("platform_number")
-    cycle_var = var_names.get("cycle_number")
-    lat_var = var_names.get("latitude")
-    lon_var = var_names.get("longitude")
-    juld_var = var_names.get("juld")
-
-    # Metadata
-    metadata_df = pd.DataFrame({
-        "float_id": ds.variables[platform_var][:].astype(str),
-        "cycle_number": ds.variables[cycle_var][:],
-        "latitude": ds.variables[lat_var][:],
-        "longitude": ds.variables[lon_var][:],
-        "datetime": pd.to_datetime(ds[juld_var].values)  # Already datetime64
-    })
+from climatology import CLIMATOLOGY_PATH, POSITION_COLUMNS, build as build_climatology
+from columnar_store import (METADATA_DATASET, PROFILES_DATASET, delete_batches, read_batches, write_metadata,
+                            write_profiles)
+from float_index import FLOAT_INDEX_PATH, update_float_index
+from ingest_manifest import MANIFEST_PATH, IngestManifest, file_hash
+from profile_store import STORE_PATH, ProfileStore, ProfileStoreWriter, profile_key
+from profile_summaries import SUMMARIES_PATH, update_summaries
+from tracing import TRACER, span
+
+DATA_DIR = Path(r"C:\Users\alexe\Desktop\argo-floatchat\argo_data")
+
 
+def read_nc_file(nc_file):
+    """Read one GADR NetCDF file into (metadata_df, profile_df); the file is closed on return."""
+    with xr.open_dataset(nc_file) as ds:
         # Handle case-insensitive variable names
-    var_names = {name.lower(): name for name in ds.variables.keys()}
-    
-    # Get platform_number variable name
-    platform_var = var_names.get("platform_number")
-    cycle_var = var_names.get("cycle_number")
-    lat_var = var_names.get("latitude")
-    lon_var = var_names.get("longitude")
-    juld_var = var_names.get("juld")
-
-
-    # -------------------------------
-    # PROFILE DATA (case-insensitive)
-    # -------------------------------
-    pres_var = var_names.get("pres") or var_names.get("pressure")
-    temp_var = var_names.get("temp") or var_names.get("temperature")
-    psal_var = var_names.get("psal") or var_names.get("salinity")
-
-    pres_qc_var = var_names.get("pres_qc")
-    temp_qc_var = var_names.get("temp_qc")
-    psal_qc_var = var_names.get("psal_qc")
-
-    profile_df = pd.DataFrame({
-        "pressure": ds[pres_var].values.flatten() if pres_var else None,
-        "temperature": ds[temp_var].values.flatten() if temp_var else None,
-        "salinity": ds[psal_var].values.flatten() if psal_var else None,
-        "pres_qc": ds[pres_qc_var].values.flatten() if pres_qc_var else None,
-        "temp_qc": ds[temp_qc_var].values.flatten() if temp_qc_var else None,
-        "sal_qc": ds[psal_qc_var].values.flatten() if psal_qc_var else None,
-        "float_id": metadata_df["float_id"].repeat(ds[pres_var].shape[1]).values if pres_var else None
-    })
-    
-    # Append to lists
-    metadata_list.append(metadata_df)
-    profile_list.append(profile_df)
-
-# Combine all files into single DataFrames
-metadata_df = pd.concat(metadata_list, ignore_index=True)
-profile_df = pd.concat(profile_list, ignore_index=True)
-
-print("Metadata shape:", metadata_df.shape)
-print("Profile shape:", profile_df.shape)
-
-# Save to CSV
-metadata_df.to_csv("argo_metadata.csv", index=False)
-profile_df.to_csv("argo_profiles.csv", index=False)
-print("✅ Data saved to argo_metadata.csv and argo_profiles.csv")
\ No newline at end of file
+        var_names = {name.lower(): name for name in ds.variables.keys()}
+
+        # Get platform_number variable name
+        platform_var = var_names.get("platform_number")
+        cycle_var = var_names.get("cycle_number")
+        lat_var = var_names.get("latitude")
+        lon_var = var_names.get("longitude")
+        juld_var = var_names.get("juld")
+
+        # Metadata
+        metadata_df = pd.DataFrame({
+            "float_id": ds.variables[platform_var][:].astype(str),
+            "cycle_number": ds.variables[cycle_var][:],
+            "latitude": ds.variables[lat_var][:],
+            "longitude": ds.variables[lon_var][:],
+            "datetime": pd.to_datetime(ds[juld_var].values)  # Already datetime64
+        })
+
+        # -------------------------------
+        # PROFILE DATA (case-insensitive)
+        # -------------------------------
+        pres_var = var_names.get("pres") or var_names.get("pressure")
+        temp_var = var_names.get("temp") or var_names.get("temperature")
+        psal_var = var_names.get("psal") or var_names.get("salinity")
+
+        pres_qc_var = var_names.get("pres_qc")
+        temp_qc_var = var_names.get("temp_qc")
+        psal_qc_var = var_names.get("psal_qc")
+
+        if not pres_var:
+            return metadata_df, pd.DataFrame()
+
+        n_levels = ds[pres_var].shape[1]
+        profile_df = pd.DataFrame({
+            "pressure": ds[pres_var].values.flatten(),
+            "temperature": ds[temp_var].values.flatten() if temp_var else None,
+            "salinity": ds[psal_var].values.flatten() if psal_var else None,
+            "pres_qc": ds[pres_qc_var].values.flatten() if pres_qc_var else None,
+            "temp_qc": ds[temp_qc_var].values.flatten() if temp_qc_var else None,
+            "sal_qc": ds[psal_qc_var].values.flatten() if psal_qc_var else None,
+            "float_id": metadata_df["float_id"].repeat(n_levels).values,
+            "cycle_number": metadata_df["cycle_number"].repeat(n_levels).values,
+            "datetime": metadata_df["datetime"].repeat(n_levels).values,
+        })
+    return metadata_df, profile_df
+
+
+def _ingest_one(nc_file, use_hash=False):
+    """Worker: stat (and optionally hash) the file, then read it."""
+    stat = nc_file.stat()
+    sha1 = file_hash(nc_file) if use_hash else None
+    metadata_df, profile_df = read_nc_file(nc_file)
+    # Fail the file here, not its whole batch in the profile store, if a cycle cannot be keyed
+    profile_key(metadata_df["float_id"].str.strip().astype(np.int64), metadata_df["cycle_number"])
+    return (nc_file, stat.st_size, stat.st_mtime_ns, sha1), metadata_df, profile_df
+
+
+class BatchWriter:
+    """Accumulates per-file results and flushes them to the Parquet datasets in bounded batches."""
+
+    def __init__(self, manifest, batch_files=200, metadata_root=METADATA_DATASET, profiles_root=PROFILES_DATASET,
+                 profile_store=STORE_PATH, profiles_parquet=False):
+        self.manifest = manifest
+        self.batch_files = batch_files
+        self.metadata_root = metadata_root
+        self.profiles_root = profiles_root
+        self.profile_writer = ProfileStoreWriter(profile_store)
+        self.profiles_parquet = profiles_parquet
+        self._entries, self._metadata, self._profiles = [], [], []
+        self.rows_written = 0
+        self.float_ids = set()  # floats with new rows, for the float index
+        self.batch_ids = []  # batches written, for the climatology
+
+    def add(self, entry, metadata_df, profile_df):
+        self._entries.append(entry + (len(metadata_df),))
+        self._metadata.append(metadata_df)
+        if len(profile_df):
+            self._profiles.append(profile_df)
+        if len(self._entries) >= self.batch_files:
+            self.flush()
+
+    def flush(self):
+        if not self._entries:
+            return
+        batch_id = uuid.uuid4().hex[:12]
+        with span("ingest.flush", files=len(self._entries)) as s:
+            metadata_df = pd.concat(self._metadata, ignore_index=True)
+            s.rows = len(metadata_df)
+            first = self.manifest.reserve_row_ids(len(metadata_df))
+            metadata_df["row_id"] = np.arange(first, first + len(metadata_df), dtype=np.int64)
+            # Each file's rows are consecutive row IDs, so a changed file can later be cut out of the batch
+            counts = [entry[-1] for entry in self._entries]
+            starts = first + np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+            entries = [entry + (int(start),) for entry, start in zip(self._entries, starts)]
+            # Pending until recorded: part files of a batch that never got recorded are swept on the next run
+            self.manifest.begin_batch(batch_id)
+            write_metadata(metadata_df, self.metadata_root, batch_id=batch_id)
+            if self._profiles:
+                profile_df = pd.concat(self._profiles, ignore_index=True)
+                self.profile_writer.append_frame(profile_df, batch_id)
+                if self.profiles_parquet:
+                    write_profiles(profile_df, self.profiles_root, batch_id=batch_id)
+            # Recorded only after the data is on disk; a crash before this re-ingests the batch's files
+            self.manifest.record(batch_id, entries)
+        self.rows_written += len(metadata_df)
+        self.batch_ids.append(batch_id)
+        self.float_ids.update(metadata_df["float_id"].astype(np.int64).unique().tolist())
+        print(f"💾 Batch {batch_id}: {len(self._entries)} files, {len(metadata_df)} profiles")
+        self._entries, self._metadata, self._profiles = [], [], []
+
+
+def sweep_pending(manifest, metadata_root=METADATA_DATASET, profiles_root=PROFILES_DATASET,
+                  profile_store=STORE_PATH):
+    """Delete the part files and store entries of batches a crashed run left pending; returns their float IDs."""
+    pending = manifest.pending_batches()
+    if not pending:
+        return set()
+    float_ids = set(read_batches(metadata_root, pending, ["float_id"])["float_id"].astype("int64").tolist())
+    removed = delete_batches(metadata_root, pending) + delete_batches(profiles_root, pending)
+    ProfileStoreWriter(profile_store).drop(pending)
+    manifest.clear_pending(pending)
+    print(f"🧹 {len(pending)} unfinished batches from an earlier run: {removed} part files removed")
+    return float_ids
+
+
+def drop_files(manifest, paths, metadata_root=METADATA_DATASET, profiles_root=PROFILES_DATASET,
+               profile_store=STORE_PATH):
+    """Take the rows of `paths` out of their batches; every other file keeps its rows and row IDs.
+
+    Each touched batch is rewritten without those rows under a new batch
+    ID, and the dropped profiles are hidden in the profile store. Batches
+    recorded before per-file row IDs cannot be split, so all of their
+    files are dropped. Returns (float IDs of the dropped rows, files to
+    read again).
+    """
+    store = ProfileStoreWriter(profile_store)
+    by_batch = {}
+    for path, (batch_id, first, rows) in manifest.locate(paths).items():
+        by_batch.setdefault(batch_id, []).append((path, first, rows))
+    affected, reread = set(), set()
+    for batch_id, files in by_batch.items():
+        metadata_df = read_batches(metadata_root, [batch_id])
+        if any(first is None for _, first, _ in files):
+            affected.update(metadata_df.get("float_id", pd.Series(dtype="int64")).astype("int64").tolist())
+            reread.update(Path(p) for p in manifest.files_in_batches([batch_id]))
+            manifest.forget_batches([batch_id])
+            store.drop([batch_id])
+        else:
+            drop = np.zeros(len(metadata_df), dtype=bool)
+            if len(metadata_df):
+                row_ids = metadata_df["row_id"].to_numpy()
+                for _, first, rows in files:
+                    drop |= (row_ids >= first) & (row_ids < first + rows)
+            dropped, kept = metadata_df[drop], metadata_df[~drop]
+            affected.update(dropped["float_id"].astype("int64").tolist() if len(dropped) else [])
+            reread.update(Path(p) for p, _, _ in files)
+            new_batch_id = None
+            if len(kept):
+                new_batch_id = uuid.uuid4().hex[:12]
+                manifest.begin_batch(new_batch_id)
+                write_metadata(kept, metadata_root, batch_id=new_batch_id)
+                profile_df = read_batches(profiles_root, [batch_id])
+                if len(profile_df):
+                    gone = pd.MultiIndex.from_frame(dropped[["float_id", "cycle_number"]].astype("int64"))
+                    keys = pd.MultiIndex.from_frame(profile_df[["float_id", "cycle_number"]].astype("int64"))
+                    write_profiles(profile_df[~keys.isin(gone)], profiles_root, batch_id=new_batch_id)
+            manifest.replace_batch(batch_id, new_batch_id, [p for p, _, _ in files])
+            # The kept profiles' store entries follow their rows to the new batch ID
+            if new_batch_id is None:
+                store.drop([batch_id])
+            else:
+                store.drop([batch_id], dropped["float_id"].astype("int64").to_numpy(),
+                           dropped["cycle_number"].astype("int64").to_numpy())
+                store.move(batch_id, new_batch_id)
+        delete_batches(metadata_root, [batch_id])
+        delete_batches(profiles_root, [batch_id])
+        manifest.clear_pending([batch_id])
+    return affected, reread
+
+
+def ingest(data_dir=DATA_DIR, workers=None, batch_files=200, use_hash=False, full=False,
+           manifest_path=MANIFEST_PATH, metadata_root=METADATA_DATASET, profiles_root=PROFILES_DATASET,
+           profile_store=STORE_PATH, profiles_parquet=False, float_index_path=FLOAT_INDEX_PATH,
+           climatology_path=CLIMATOLOGY_PATH, summaries_path=SUMMARIES_PATH):
+    """Ingest new/changed NetCDF files from `data_dir` in parallel; returns the number of files read.
+
+    Afterwards the float index, the climatology cube and the profile
+    summaries are brought up to date.
+    """
+    if full:
+        shutil.rmtree(metadata_root, ignore_errors=True)
+        shutil.rmtree(profiles_root, ignore_errors=True)
+        shutil.rmtree(profile_store, ignore_errors=True)
+        Path(manifest_path).unlink(missing_ok=True)
+        Path(float_index_path).unlink(missing_ok=True)
+        shutil.rmtree(climatology_path, ignore_errors=True)
+        Path(summaries_path).unlink(missing_ok=True)
+
+    manifest = IngestManifest(manifest_path)
+    affected = sweep_pending(manifest, metadata_root, profiles_root, profile_store)  # floats whose float-index entries change
+    with span("ingest.scan") as s:
+        nc_files = sorted(Path(data_dir).rglob("*.nc"))  # flat, or <year>/<month>/ as harvested
+        new, changed = manifest.pending(nc_files, use_hash=use_hash)
+        s.rows = len(nc_files)
+
+    if changed:
+        # A changed file's rows are cut out of its batch and the file is read again under new row IDs
+        removed, reread = drop_files(manifest, changed, metadata_root, profiles_root, profile_store)
+        affected |= removed
+        new = sorted(set(new) | set(changed) | {p for p in reread if p.exists()})
+
+    print(f"📂 {len(nc_files)} files in {data_dir}: {len(new)} to ingest "
+          f"({len(changed)} changed), {len(nc_files) - len(new)} up to date")
+    if not new:
+        manifest.close()
+        if Path(metadata_root).exists():
+            # Swept batches change float-index entries too (and a missing index is built)
+            update_float_index(metadata_root, affected, float_index_path)
+        return 0
+
+    writer = BatchWriter(manifest, batch_files, metadata_root, profiles_root, profile_store, profiles_parquet)
+    failed = []
+    workers = workers or os.cpu_count()
+    with span("ingest.read", rows=len(new), workers=workers), ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded number of files in flight so results never pile up in memory
+        pending_files = iter(new)
+        futures = {}
+
+        def submit_next():
+            nc_file = next(pending_files, None)
+            if nc_file is not None:
+                futures[executor.submit(_ingest_one, nc_file, use_hash)] = nc_file
+
+        for _ in range(4 * workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                nc_file = futures.pop(future)
+                submit_next()
+                try:
+                    entry, metadata_df, profile_df = future.result()
+                except Exception as e:
+                    failed.append(nc_file)
+                    print(f"❌ Failed {nc_file.name}: {e}")
+                    continue
+                print(f"Processing {nc_file.name}: {len(metadata_df)} profiles")
+                writer.add(entry, metadata_df, profile_df)
+    writer.flush()
+    manifest.close()
+    if Path(metadata_root).exists():
+        with span("ingest.float_index", floats=len(affected | writer.float_ids)) as s:
+            index = update_float_index(metadata_root, affected | writer.float_ids, float_index_path)
+            s.rows = index.size
+        print(f"🗺️  Float index: {len(index)} float-months over {index.size} cycles "
+              f"({len(affected | writer.float_ids)} floats updated)")
+        with span("ingest.climatology") as s:
+            # Positions of the rows just written; profiles of swept or dropped batches are subtracted by key
+            metadata = read_batches(metadata_root, writer.batch_ids, POSITION_COLUMNS)
+            climatology, binned = build_climatology(climatology_path, store=ProfileStore(profile_store),
+                                                    metadata=metadata, metadata_root=metadata_root)
+            s.rows = binned
+        print(f"🌡️  Climatology: {binned} profiles binned ({climatology.n_profiles} in {climatology_path})")
+        with span("ingest.summaries") as s:
+            s.rows = update_summaries(ProfileStore(profile_store), summaries_path)
+        print(f"📊 Profile summaries: {s.rows} profiles summarized into {summaries_path}")
+
+    print(f"✅ {len(new) - len(failed)} files → {writer.rows_written} rows in {metadata_root} "
+          f"and {profile_store}; {len(failed)} failed (retried on the next run)")
+    TRACER.print_summary()
+    TRACER.write_metrics()
+    return len(new) - len(failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest GADR NetCDF files into the Parquet datasets.")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--batch-files", type=int, default=200, help="files per output batch")
+    parser.add_argument("--hash", action="store_true", help="compare content hashes, not just size/mtime")
+    parser.add_argument("--full", action="store_true", help="discard the manifest and outputs, re-ingest everything")
+    parser.add_argument("--profiles-parquet", action="store_true",
+                        help="also write the level-per-row profile table (the ragged store is always written)")
+    args = parser.parse_args()
+
+    ingest(args.data_dir, workers=args.workers, batch_files=args.batch_files,
+           use_hash=args.hash, full=args.full, profiles_parquet=args.profiles_parquet)
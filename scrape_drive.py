@@ -1,13 +1,20 @@
 import os
+import uuid
+import numpy as np
 import requests
 import pandas as pd
 import xarray as xr
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 import concurrent.futures
 from threading import Lock
 import time
 
+from columnar_store import METADATA_DATASET, PROFILES_DATASET, delete_batches, write_metadata, write_profiles
+from harvester import parse_catalog
+from ingest_manifest import MANIFEST_PATH, IngestManifest
+from sync_manifest import SYNC_MANIFEST_NAME, SyncManifest
+from tracing import TRACER, span
+
 # Google Drive output folder - FIXED PATH (use actual path, not URL)
 CSV_ROOT = "https://drive.google.com/drive/folders/1GQe63N3loqQbsi3G6cvQwPpG5MqnT7oA?usp=drive_linka"  # Change this to your actual Google Drive path
 os.makedirs(CSV_ROOT, exist_ok=True)
@@ -15,46 +22,217 @@ os.makedirs(CSV_ROOT, exist_ok=True)
 # THREDDS XML catalog template
 CATALOG_TEMPLATE = "https://www.ncei.noaa.gov/thredds-ocean/catalog/argo/gadr/indian//{year}/{month:02d}/catalog.xml"
 
+OPENDAP_TEMPLATE = "https://www.ncei.noaa.gov/thredds-ocean/dodsC/argo/gadr/indian/{year}/{month:02d}/{filename}"
+
+# Catalog cache, conversion state and failed files, kept next to the output
+SYNC_MANIFEST = os.path.join(CSV_ROOT, SYNC_MANIFEST_NAME)
+
+# "parquet": subset each file on the server and append to partitioned Parquet datasets
+# "csv":     the original full download, one CSV per file
+OUTPUT_FORMAT = "parquet"
+PARQUET_ROOT = os.path.join(CSV_ROOT, "parquet")
+PRES_RANGE = (0.0, 2000.0)  # dbar; levels outside are neither requested nor stored
+FLUSH_ROWS = 1_000_000       # profile levels buffered before a Parquet write
+
 # Thread safety
 print_lock = Lock()
-error_lock = Lock()
-failed_downloads = []
 
 def safe_print(message):
     """Thread-safe printing"""
     with print_lock:
         print(message)
 
-def list_nc_files(year, month):
-    """Scrape THREDDS XML catalog and return .nc file names."""
+def list_nc_files(year, month, manifest=None):
+    """Return the .nc file names in a month's THREDDS catalog.
+
+    With a manifest the catalog is requested conditionally; when it is
+    unchanged (304) the cached listing is returned without re-parsing.
+    """
     url = CATALOG_TEMPLATE.format(year=year, month=month)
+    headers = manifest.catalog_headers(year, month) if manifest else {}
     try:
-        r = requests.get(url, timeout=30)
+        with span("scrape.catalog", year=year, month=month):
+            r = requests.get(url, headers=headers, timeout=30)
+        if r.status_code == 304 and manifest:
+            manifest.touch_catalog(year, month)
+            return [entry["name"] for entry in manifest.listing(year, month)]
         if r.status_code != 200:
             return []
-        soup = BeautifulSoup(r.content, "xml")
-        files = [ds["urlPath"].split("/")[-1] for ds in soup.find_all("dataset") 
-                if ds.get("urlPath", "").endswith(".nc")]
-        return files
+        entries = parse_catalog(r.content)
+        if manifest:
+            manifest.update_catalog(year, month, entries, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return [entry["name"] for entry in entries]
     except Exception as e:
         safe_print(f"❌ Failed to list files for {year}-{month:02d}: {e}")
         return []
 
-def process_nc_file(year, month, filename, max_retries=3):
-    """Open remote NetCDF via OPeNDAP and save as CSV in Drive."""
-    url = f"https://www.ncei.noaa.gov/thredds-ocean/dodsC/argo/gadr/indian/{year}/{month:02d}/{filename}"
+def decode_juld(var):
+    """JULD (days since the reference date in its units) → datetime64, NaT for fill values."""
+    units = var.attrs.get("units", "days since 1950-01-01 00:00:00 UTC")
+    origin = pd.Timestamp(units.split("since", 1)[1].replace("UTC", "").strip())
+    return origin + pd.to_timedelta(np.asarray(var.values, dtype="float64"), unit="D")
+
+def subset_nc_file(url, pres_range=PRES_RANGE):
+    """Fetch only the needed variables and levels of a remote GADR file.
+
+    Pressure is requested first; the other level variables are then requested
+    only for the level window where some profile lies inside `pres_range`, so
+    deep levels and trailing fill-value padding never cross the network.
+    Returns (metadata_df, profile_df) shaped like read_multiple.read_nc_file,
+    with padding, out-of-range levels and undated profiles dropped.
+    """
+    with xr.open_dataset(url, decode_times=False) as ds:
+        var_names = {name.lower(): name for name in ds.variables}
+
+        def var(*names):
+            return next((var_names[n] for n in names if n in var_names), None)
+
+        metadata_df = pd.DataFrame({
+            "float_id": ds[var("platform_number")].values.astype(str),
+            "cycle_number": ds[var("cycle_number")].values,
+            "latitude": ds[var("latitude")].values,
+            "longitude": ds[var("longitude")].values,
+            "datetime": decode_juld(ds[var("juld")]),
+        })
+
+        pres_var = var("pres", "pressure")
+        if not pres_var:
+            return metadata_df, pd.DataFrame()
+        pres = ds[pres_var].values
+        with np.errstate(invalid="ignore"):
+            in_range = (pres >= pres_range[0]) & (pres <= pres_range[1])  # False for fill values
+        levels = np.flatnonzero(in_range.any(axis=0))
+        if not len(levels):
+            return metadata_df, pd.DataFrame()
+        window = slice(levels[0], levels[-1] + 1)
+        keep = in_range[:, window]
+        mask = keep.ravel()
+
+        columns = {"pressure": pres[:, window].ravel()[mask]}
+        for column, names in [("temperature", ("temp", "temperature")), ("salinity", ("psal", "salinity")),
+                              ("pres_qc", ("pres_qc",)), ("temp_qc", ("temp_qc",)), ("sal_qc", ("psal_qc",))]:
+            name = var(*names)
+            # isel on the lazily opened dataset becomes an OPeNDAP hyperslab request
+            columns[column] = ds[name].isel({ds[name].dims[1]: window}).values.ravel()[mask] if name else None
+
+        n_levels = keep.sum(axis=1)
+        for column in ["float_id", "cycle_number", "datetime"]:
+            columns[column] = np.repeat(metadata_df[column].to_numpy(), n_levels)
+    profile_df = pd.DataFrame(columns)
+    # Profiles without a valid JULD cannot be placed in a year/month partition
+    return metadata_df[metadata_df["datetime"].notna()], profile_df[profile_df["datetime"].notna()]
+
+class ParquetSink:
+    """Buffers converted files and appends them to the Parquet datasets in large batches.
+
+    Worker threads only call add(); writes happen in the calling (main)
+    thread through flush(). Files are marked synced with their batch ID once
+    the batch is on disk, so an updated file can have its old batch removed.
+    A batch is registered as pending (in the row-ID manifest) until then;
+    batches a crash left pending are removed on start and their files
+    converted again.
+    """
+
+    def __init__(self, manifest, root=PARQUET_ROOT, flush_rows=FLUSH_ROWS):
+        self.manifest = manifest
+        self.metadata_root = os.path.join(root, METADATA_DATASET)
+        self.profiles_root = os.path.join(root, PROFILES_DATASET)
+        os.makedirs(root, exist_ok=True)
+        self.row_ids = IngestManifest(os.path.join(root, MANIFEST_PATH))  # stable row IDs across runs
+        self.flush_rows = flush_rows
+        self._lock = Lock()
+        self._files, self._metadata, self._profiles = [], [], []
+        self._levels = 0
+        self.sweep()
+
+    def sweep(self):
+        """Remove the part files of batches left pending by a crash; their files become pending again."""
+        pending = self.row_ids.pending_batches()
+        if not pending:
+            return
+        removed = delete_batches(self.metadata_root, pending) + delete_batches(self.profiles_root, pending)
+        for batch_id in pending:
+            self.manifest.forget_output(batch_id)
+        self.row_ids.clear_pending(pending)
+        safe_print(f"🧹 {len(pending)} unfinished batches from an earlier run: {removed} part files removed")
+
+    def add(self, year, month, filename, metadata_df, profile_df):
+        with self._lock:
+            self._files.append((year, month, filename))
+            self._metadata.append(metadata_df)
+            if len(profile_df):
+                self._profiles.append(profile_df)
+            self._levels += len(profile_df)
+
+    def full(self):
+        return self._levels >= self.flush_rows
+
+    def flush(self):
+        with self._lock:
+            files, metadata, profiles = self._files, self._metadata, self._profiles
+            self._files, self._metadata, self._profiles = [], [], []
+            self._levels = 0
+        if not files:
+            return
+        batch_id = uuid.uuid4().hex[:12]
+        with span("scrape.flush", files=len(files)) as s:
+            metadata_df = pd.concat(metadata, ignore_index=True)
+            s.rows = len(metadata_df)
+            first = self.row_ids.reserve_row_ids(len(metadata_df))
+            metadata_df["row_id"] = np.arange(first, first + len(metadata_df), dtype=np.int64)
+            self.row_ids.begin_batch(batch_id)
+            write_metadata(metadata_df, self.metadata_root, batch_id=batch_id)
+            if profiles:
+                write_profiles(pd.concat(profiles, ignore_index=True), self.profiles_root, batch_id=batch_id)
+            for year, month, filename in files:
+                self.manifest.mark_synced(year, month, filename, batch_id)
+            self.row_ids.clear_pending([batch_id])
+        safe_print(f"💾 Batch {batch_id}: {len(files)} files, {len(metadata_df)} profiles")
+
+    def discard(self, year, month, filename):
+        """Drop the batch holding an outdated version of `filename`; its batch-mates become pending."""
+        batch_id = self.manifest.output_of(year, month, filename)
+        if batch_id:
+            # Pending until it is gone, so sweep() finishes the job if we crash midway
+            self.row_ids.begin_batch(batch_id)
+            delete_batches(self.metadata_root, [batch_id])
+            delete_batches(self.profiles_root, [batch_id])
+            self.manifest.forget_output(batch_id)
+            self.row_ids.clear_pending([batch_id])
+
+    def close(self):
+        self.flush()
+        self.row_ids.close()
+
+def process_nc_file(year, month, filename, max_retries=3, manifest=None, sink=None):
+    """Open remote NetCDF via OPeNDAP and save as CSV in Drive, or subset it into `sink`."""
+    url = OPENDAP_TEMPLATE.format(year=year, month=month, filename=filename)
 
     # Output folder structure: /CSV_Output/year/month/
     out_dir = os.path.join(CSV_ROOT, str(year), f"{month:02d}")
     os.makedirs(out_dir, exist_ok=True)
     csv_file = os.path.join(out_dir, filename.replace(".nc", ".csv"))
 
-    if os.path.exists(csv_file):
-        safe_print(f"⏩ Skipping {csv_file} (already exists)")
-        return True
+    if sink is None and os.path.exists(csv_file):
+        state = manifest.state(year, month, filename) if manifest else "synced"
+        if state is None:
+            # Converted before the manifest existed: adopt it as the current version
+            manifest.mark_synced(year, month, filename, csv_file)
+            state = "synced"
+        if state == "synced":
+            safe_print(f"⏩ Skipping {csv_file} (up to date)")
+            return True
 
     for attempt in range(max_retries):
         try:
+            if sink is not None:
+                with span("scrape.subset") as s:
+                    metadata_df, profile_df = subset_nc_file(url)
+                    s.rows = len(profile_df)
+                sink.add(year, month, filename, metadata_df, profile_df)
+                safe_print(f"✅ Subset {filename} ({len(metadata_df)} profiles, {len(profile_df)} levels)")
+                return True
+
             # Open the remote dataset with timeout
             ds = xr.open_dataset(url, decode_times=False)
             
@@ -79,6 +257,8 @@ def process_nc_file(year, month, filename, max_retries=3):
 
             # Save to CSV
             df.to_csv(csv_file, index=False)
+            if manifest:
+                manifest.mark_synced(year, month, filename, csv_file)
             safe_print(f"✅ Saved {csv_file} ({len(df)} rows)")
             return True
 
@@ -86,39 +266,57 @@ def process_nc_file(year, month, filename, max_retries=3):
             if attempt == max_retries - 1:
                 error_msg = f"❌ Failed {filename} after {max_retries} attempts: {e}"
                 safe_print(error_msg)
-                with error_lock:
-                    failed_downloads.append((year, month, filename, str(e)))
+                if manifest:
+                    manifest.record_failure(year, month, filename, e)
                 return False
             time.sleep(2 ** attempt)  # Exponential backoff
 
-def process_year_month(year_month):
-    """Process all files for a specific year-month combination"""
+def process_year_month(year_month, manifest=None, sink=None):
+    """Process the new or updated files of a year-month; returns (listed, successful)"""
     year, month = year_month
-    nc_files = list_nc_files(year, month)
-    
+    nc_files = list_nc_files(year, month, manifest)
+
     if not nc_files:
         safe_print(f"⚠ No files for {year}-{month:02d}")
-        return 0
-    
-    safe_print(f"\n📂 Processing {year}-{month:02d} ({len(nc_files)} files)")
-    
-    successful = 0
+        return 0, 0
+
+    if manifest:
+        if sink is not None:
+            # Updated upstream: remove the old rows first (batch-mates are converted again too)
+            for entry in manifest.pending(year, month):
+                if manifest.state(year, month, entry["name"]) == "changed":
+                    sink.discard(year, month, entry["name"])
+        pending = [entry["name"] for entry in manifest.pending(year, month)]
+        if not pending:
+            safe_print(f"⏩ {year}-{month:02d} up to date ({len(nc_files)} files)")
+            return len(nc_files), len(nc_files)
+    else:
+        pending = nc_files
+
+    safe_print(f"\n📂 Processing {year}-{month:02d} ({len(pending)} of {len(nc_files)} files)")
+
+    successful = len(nc_files) - len(pending)
     # Process files in parallel for this month
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+    with span("scrape.month", rows=len(pending), year=year, month=month), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
         # Create futures for all files in this month
         futures = {
-            executor.submit(process_nc_file, year, month, f): f 
-            for f in nc_files
+            executor.submit(process_nc_file, year, month, f, manifest=manifest, sink=sink): f
+            for f in pending
         }
-        
+
         # Monitor progress with tqdm
-        for future in tqdm(concurrent.futures.as_completed(futures), 
-                          total=len(nc_files), 
+        for future in tqdm(concurrent.futures.as_completed(futures),
+                          total=len(pending),
                           desc=f"{year}-{month:02d}"):
             if future.result():
                 successful += 1
-    
-    return successful
+            if sink is not None and sink.full():
+                sink.flush()
+
+    if sink is not None:
+        sink.flush()  # batches never span months, so a changed file invalidates little
+    return len(nc_files), successful
 
 def main():
     """Main function with parallel execution"""
@@ -126,24 +324,34 @@ def main():
     years = range(1999, 2021)   # 1999–2020
     months = range(1, 13)
     year_months = [(year, month) for year in years for month in months]
-    
+
+    manifest = SyncManifest(SYNC_MANIFEST)
+    sink = ParquetSink(manifest) if OUTPUT_FORMAT == "parquet" else None
+    # Months with files that failed last time are synced again even outside the range
+    retry_months = [ym for ym in manifest.failed_months() if ym not in year_months]
+    if manifest.failures():
+        print(f"🔁 Retrying {len(manifest.failures())} files that failed on the last run")
+
     total_files_processed = 0
     total_files_successful = 0
     
     print(f"🚀 Starting parallel download of ARGO data (1999-2020)")
-    print(f"📁 Output directory: {CSV_ROOT}")
+    print(f"📁 Output directory: {PARQUET_ROOT if sink else CSV_ROOT}")
     print(f"🧵 Using 8 parallel workers per month")
     
     start_time = time.time()
     
     # Process each year-month in sequence, but files within each month in parallel
-    for year_month in year_months:
-        year, month = year_month
-        successful = process_year_month(year_month)
+    for year_month in retry_months + year_months:
+        listed, successful = process_year_month(year_month, manifest, sink)
         total_files_successful += successful
-        total_files_processed += len(list_nc_files(year, month)) or 0
+        total_files_processed += listed
     
+    if sink is not None:
+        sink.close()
     end_time = time.time()
+    failures = manifest.failures()
+    manifest.close()
     
     # Print summary
     print(f"\n{'='*50}")
@@ -152,20 +360,17 @@ def main():
     print(f"Total time: {end_time - start_time:.2f} seconds")
     print(f"Total files processed: {total_files_processed}")
     print(f"Successfully downloaded: {total_files_successful}")
-    print(f"Failed downloads: {len(failed_downloads)}")
+    print(f"Failed downloads: {len(failures)}")
     
-    if failed_downloads:
-        print(f"\n❌ Failed downloads (saved for retry):")
-        for year, month, filename, error in failed_downloads[:5]:  # Show first 5
-            print(f"  {year}-{month:02d}/{filename}: {error}")
-        if len(failed_downloads) > 5:
-            print(f"  ... and {len(failed_downloads) - 5} more")
-        
-        # Save failed downloads to file for retry
-        failed_df = pd.DataFrame(failed_downloads, 
-                               columns=['year', 'month', 'filename', 'error'])
-        failed_df.to_csv(os.path.join(CSV_ROOT, 'failed_downloads.csv'), index=False)
-        print(f"💾 Failed downloads saved to: {os.path.join(CSV_ROOT, 'failed_downloads.csv')}")
+    if failures:
+        print(f"\n❌ Failed downloads (retried automatically on the next run):")
+        for year, month, filename, error, attempts in failures[:5]:  # Show first 5
+            print(f"  {year}-{month:02d}/{filename} ({attempts} attempts): {error}")
+        if len(failures) > 5:
+            print(f"  ... and {len(failures) - 5} more")
+        print(f"💾 Failures recorded in: {SYNC_MANIFEST}")
+    TRACER.print_summary()
+    TRACER.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
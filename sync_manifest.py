@@ -0,0 +1,163 @@
+"""SQLite catalog cache and sync manifest for the THREDDS scrapers.
+
+For every year-month it keeps the catalog's ETag / Last-Modified and its
+parsed listing, so an unchanged catalog costs one conditional request (304)
+and is never re-parsed. For every listed file it records the size and
+modification time advertised by the catalog and the ones at the time the
+file was last synced (downloaded or converted), so an incremental run only
+touches new or updated files. Failed files are kept with their error and
+attempt count; they stay pending and are retried on the next run.
+"""
+import sqlite3
+import threading
+import time
+
+SYNC_MANIFEST_NAME = "sync_manifest.sqlite"
+
+
+class SyncManifest:
+    def __init__(self, path=SYNC_MANIFEST_NAME):
+        self.path = str(path)
+        # Shared by scrape_drive's worker threads; every access goes through the lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS catalogs (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (year, month)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                size TEXT,
+                modified TEXT,
+                listed_at REAL NOT NULL,
+                synced_size TEXT,
+                synced_modified TEXT,
+                synced_at REAL,
+                output TEXT,
+                PRIMARY KEY (year, month, name)
+            );
+            CREATE TABLE IF NOT EXISTS failures (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                last_attempt REAL NOT NULL,
+                PRIMARY KEY (year, month, name)
+            );
+        """)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def catalog_headers(self, year, month):
+        """Conditional-request headers for a month's catalog ({} if it was never fetched)."""
+        with self._lock:
+            row = self.conn.execute("SELECT etag, last_modified FROM catalogs WHERE year = ? AND month = ?",
+                                    (year, month)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def listing(self, year, month):
+        """Cached catalog listing: [{"name", "size", "modified"}, ...]."""
+        with self._lock:
+            rows = self.conn.execute("SELECT name, size, modified FROM files WHERE year = ? AND month = ? "
+                                     "ORDER BY name", (year, month)).fetchall()
+        return [{"name": name, "size": size, "modified": modified} for name, size, modified in rows]
+
+    def update_catalog(self, year, month, entries, etag=None, last_modified=None):
+        """Store a freshly fetched listing; files no longer in the catalog are dropped."""
+        now = time.time()
+        values = [(year, month, e["name"], e.get("size"), e.get("modified"), now) for e in entries]
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?, ?, ?)",
+                              (year, month, etag, last_modified, now))
+            self.conn.executemany("""
+                INSERT INTO files (year, month, name, size, modified, listed_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (year, month, name) DO UPDATE SET
+                    size = excluded.size, modified = excluded.modified, listed_at = excluded.listed_at
+            """, values)
+            self.conn.execute("DELETE FROM files WHERE year = ? AND month = ? AND listed_at < ?", (year, month, now))
+            self.conn.execute("""
+                DELETE FROM failures WHERE year = ? AND month = ?
+                  AND name NOT IN (SELECT name FROM files WHERE year = ? AND month = ?)
+            """, (year, month, year, month))
+
+    def touch_catalog(self, year, month):
+        """Record that the catalog was revalidated (304) without changes."""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE catalogs SET fetched_at = ? WHERE year = ? AND month = ?",
+                              (time.time(), year, month))
+
+    def pending(self, year, month):
+        """Listed files that were never synced, or whose size/modified changed since."""
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT name, size, modified FROM files
+                WHERE year = ? AND month = ?
+                  AND (synced_at IS NULL OR synced_size IS NOT size OR synced_modified IS NOT modified)
+                ORDER BY name
+            """, (year, month)).fetchall()
+        return [{"name": name, "size": size, "modified": modified} for name, size, modified in rows]
+
+    def state(self, year, month, name):
+        """'synced', 'changed' (synced, but the catalog now lists a different version) or None."""
+        with self._lock:
+            row = self.conn.execute("""
+                SELECT synced_at IS NOT NULL, synced_size IS size AND synced_modified IS modified
+                FROM files WHERE year = ? AND month = ? AND name = ?
+            """, (year, month, name)).fetchone()
+        if row is None or not row[0]:
+            return None
+        return "synced" if row[1] else "changed"
+
+    def mark_synced(self, year, month, name, output=None):
+        """Record that `name` is up to date locally (as advertised by the current listing)."""
+        with self._lock, self.conn:
+            self.conn.execute("""
+                UPDATE files SET synced_size = size, synced_modified = modified, synced_at = ?, output = ?
+                WHERE year = ? AND month = ? AND name = ?
+            """, (time.time(), output, year, month, name))
+            self.conn.execute("DELETE FROM failures WHERE year = ? AND month = ? AND name = ?", (year, month, name))
+
+    def output_of(self, year, month, name):
+        with self._lock:
+            row = self.conn.execute("SELECT output FROM files WHERE year = ? AND month = ? AND name = ?",
+                                    (year, month, name)).fetchone()
+        return row[0] if row else None
+
+    def forget_output(self, output):
+        """Mark every file synced into `output` as pending again (e.g. after its batch was deleted)."""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE files SET synced_at = NULL, output = NULL WHERE output = ?", (output,))
+
+    def record_failure(self, year, month, name, error):
+        with self._lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO failures VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (year, month, name) DO UPDATE SET
+                    error = excluded.error, attempts = attempts + 1, last_attempt = excluded.last_attempt
+            """, (year, month, name, str(error), time.time()))
+
+    def failures(self):
+        """[(year, month, name, error, attempts), ...] of files still failing."""
+        with self._lock:
+            return self.conn.execute("SELECT year, month, name, error, attempts FROM failures "
+                                     "ORDER BY year, month, name").fetchall()
+
+    def failed_months(self):
+        with self._lock:
+            return [tuple(r) for r in self.conn.execute("SELECT DISTINCT year, month FROM failures ORDER BY 1, 2")]
+
@@ -0,0 +1,138 @@
+"""Synthetic GADR-style NetCDF files for benchmarks and offline testing.
+
+Writes one file per profile, named and laid out like the harvested archive:
+
+    <out>/<year>/<month>/nodc_D<float_id>_<cycle>.nc
+
+Each file has the variables read_multiple.py and scrape_drive.py read
+(platform_number, cycle_number, juld, latitude, longitude, pres/temp/psal
+and their QC flags), with the GADR fill values. Floats drift through the
+Indian Ocean in a random walk and report every ~10 days. Profiles have a
+warm mixed layer over a thermocline, with temperature depending on
+latitude and season. Levels thin out with depth, and shorter profiles are
+padded with fill values. Everything is derived from `seed`, so the same
+arguments always give the same files.
+
+Run with:  python synth_data.py --out synth_argo --floats 200 --cycles 150 --levels 100
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+FILL_VALUE = 99999.0
+JULD_FILL = 999999.0
+JULD_UNITS = "days since 1950-01-01 00:00:00 UTC"
+REFERENCE_DATE = pd.Timestamp("1950-01-01")
+CYCLE_DAYS = 10.0
+LAT_RANGE = (-45.0, 25.0)  # Indian Ocean basin, as in the archive the scrapers pull
+LON_RANGE = (30.0, 120.0)
+
+
+def pressure_levels(n_levels, max_pres=2000.0):
+    """Level pressures from ~5 dbar to `max_pres`, spaced more widely with depth."""
+    return (5.0 + (max_pres - 5.0) * np.linspace(0.0, 1.0, n_levels) ** 1.8).astype(np.float32)
+
+
+def float_track(rng, n_cycles, start):
+    """(latitude, longitude, dates) of one float's surfacings: a bounded random walk."""
+    lat0 = rng.uniform(*LAT_RANGE)
+    lon0 = rng.uniform(*LON_RANGE)
+    # ~0.1° a day of drift, slightly eastward as in the Southern Ocean
+    steps = rng.normal(0.0, 0.5, size=(n_cycles, 2)) + [0.0, 0.1]
+    steps[0] = 0.0
+    lat = np.clip(lat0 + np.cumsum(steps[:, 0]), *LAT_RANGE)
+    lon = np.clip(lon0 + np.cumsum(steps[:, 1]), *LON_RANGE)
+    days = np.arange(n_cycles) * CYCLE_DAYS + rng.uniform(0.0, 1.0, n_cycles)
+    return lat, lon, (start + pd.to_timedelta(days, unit="D")).round("s")
+
+
+def profile_values(rng, lat, date, pres):
+    """(temperature, salinity) at `pres` for one profile."""
+    season = np.cos(2 * np.pi * (date.dayofyear - 15) / 365.25) * np.sign(lat or 1.0)
+    surface = 28.0 - 0.012 * lat ** 2 + 2.0 * season + rng.normal(0.0, 0.5)
+    mld = max(10.0, 60.0 - 30.0 * season + rng.normal(0.0, 10.0))
+    # Mixed layer, then an exponential decay to ~2°C at depth
+    depth = np.maximum(pres - mld, 0.0)
+    temperature = 2.0 + (surface - 2.0) * np.exp(-depth / 400.0)
+    salinity = 34.7 + 0.6 * np.exp(-depth / 300.0) * np.cos(np.radians(lat)) - 0.002 * lat
+    temperature += rng.normal(0.0, 0.05, len(pres))
+    salinity += rng.normal(0.0, 0.01, len(pres))
+    return temperature.astype(np.float32), salinity.astype(np.float32)
+
+
+def profile_dataset(float_id, cycle, lat, lon, date, pres, temperature, salinity, n_levels):
+    """One-profile GADR dataset padded to `n_levels` with fill values."""
+    def padded(values, fill=FILL_VALUE):
+        out = np.full((1, n_levels), fill, dtype=np.float32)
+        out[0, :len(values)] = values
+        return out
+
+    def qc(values):
+        flags = np.full((1, n_levels), b" ", dtype="S1")
+        flags[0, :len(values)] = b"1"
+        return flags
+
+    juld = (date - REFERENCE_DATE) / pd.Timedelta(days=1)
+    level_dims = ("n_prof", "n_levels")
+    return xr.Dataset({
+        "platform_number": ("n_prof", np.array([str(float_id).encode()], dtype="S8")),
+        "cycle_number": ("n_prof", np.array([cycle], dtype=np.int32)),
+        "juld": ("n_prof", np.array([juld]), {"units": JULD_UNITS, "_FillValue": JULD_FILL}),
+        "latitude": ("n_prof", np.array([lat]), {"_FillValue": FILL_VALUE}),
+        "longitude": ("n_prof", np.array([lon]), {"_FillValue": FILL_VALUE}),
+        "pres": (level_dims, padded(pres), {"_FillValue": np.float32(FILL_VALUE)}),
+        "temp": (level_dims, padded(temperature), {"_FillValue": np.float32(FILL_VALUE)}),
+        "psal": (level_dims, padded(salinity), {"_FillValue": np.float32(FILL_VALUE)}),
+        "pres_qc": (level_dims, qc(pres)),
+        "temp_qc": (level_dims, qc(temperature)),
+        "psal_qc": (level_dims, qc(salinity)),
+    })
+
+
+def write_float(out_dir, float_id, n_cycles, n_levels, start, seed):
+    """Write every profile of one float; returns the number of files written."""
+    rng = np.random.default_rng([seed, float_id])
+    levels = pressure_levels(n_levels)
+    lat, lon, dates = float_track(rng, n_cycles, start)
+    for cycle in range(n_cycles):
+        # Some profiles stop short of the deepest level, leaving fill-value padding
+        depth = n_levels if rng.random() < 0.7 else int(rng.integers(n_levels // 2, n_levels + 1))
+        pres = levels[:depth]
+        temperature, salinity = profile_values(rng, lat[cycle], dates[cycle], pres)
+        date = dates[cycle]
+        month_dir = Path(out_dir) / str(date.year) / f"{date.month:02d}"
+        month_dir.mkdir(parents=True, exist_ok=True)
+        ds = profile_dataset(float_id, cycle + 1, lat[cycle], lon[cycle], date, pres, temperature, salinity,
+                             n_levels)
+        ds.to_netcdf(month_dir / f"nodc_D{float_id}_{cycle + 1:03d}.nc")
+    return n_cycles
+
+
+def generate(out_dir, floats=100, cycles=100, levels=100, start="2013-01-01", seed=0, workers=None):
+    """Write floats × cycles profile files of `levels` levels; returns the number of files."""
+    start = pd.Timestamp(start)
+    float_ids = 2900000 + np.arange(floats)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_float, out_dir, int(f), cycles, levels, start, seed) for f in float_ids]
+        return sum(future.result() for future in futures)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", type=Path, default=Path("synth_argo"))
+    parser.add_argument("--floats", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=100, help="profiles per float, ~10 days apart")
+    parser.add_argument("--levels", type=int, default=100, help="pressure levels per profile")
+    parser.add_argument("--start", default="2013-01-01", help="date of every float's first profile")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    args = parser.parse_args()
+
+    n = generate(args.out, args.floats, args.cycles, args.levels, args.start, args.seed, args.workers)
+    print(f"✅ {n} profile files ({args.floats} floats × {args.cycles} cycles × {args.levels} levels) in {args.out}")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules are top-level scripts, not a package: make them importable from the tests
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
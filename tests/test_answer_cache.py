@@ -0,0 +1,16 @@
+"""AnswerCache keys: an answer is reused only for the same rows, context, model and options."""
+from answer_cache import AnswerCache
+
+OPTIONS = {"temperature": 0.1}
+
+
+def test_hit_needs_the_same_context(tmp_path):
+    cache = AnswerCache(tmp_path / "answers.sqlite")
+    cache.put([3, 1, 2], "Float 1 at 10, 20", "Which floats?", "llama3", OPTIONS, "Float 1.")
+
+    assert cache.get([1, 2, 3, 3], "Float 1 at 10, 20", "which floats", "llama3", OPTIONS) == "Float 1."
+    # A smaller token budget or a climatology update changes the context over the same rows
+    assert cache.get([1, 2, 3], "Float 1 at 10, 20 (anomaly +0.4)", "Which floats?", "llama3", OPTIONS) is None
+    assert cache.get([1, 2, 3], "Float 1 at 10, 20", "Which floats?", "mistral", OPTIONS) is None
+    assert cache.stats()["hits"] == 1
+    cache.close()
@@ -0,0 +1,40 @@
+"""Incremental climatology updates end where a rebuild from scratch does."""
+import numpy as np
+import pandas as pd
+
+from climatology import build
+from profile_store import ProfileStore, ProfileStoreWriter
+
+
+def batch(cycles, temperature):
+    rows = pd.DataFrame({"float_id": 1900001, "cycle_number": cycles, "latitude": -35.5, "longitude": 95.5,
+                         "datetime": pd.Timestamp("2013-10-04")})
+    levels = rows.loc[rows.index.repeat(3), ["float_id", "cycle_number"]].assign(
+        pressure=np.tile([5.0, 50.0, 150.0], len(rows)), temperature=temperature, salinity=35.0,
+        pres_qc=b"1", temp_qc=b"1", sal_qc=b"1")
+    return rows, levels
+
+
+def test_updates_with_only_the_new_rows_match_a_rebuild(tmp_path):
+    root = tmp_path / "store"
+    writer = ProfileStoreWriter(root)
+    first, levels = batch([1, 2, 3], 20.0)
+    writer.append_frame(levels, "aaaaaaaaaaaa")
+    climatology, _ = build(tmp_path / "cube.zarr", store=ProfileStore(root), metadata=first)
+
+    # Re-ingest cycle 3 warmer and add cycle 4, passing only that batch's rows; then drop cycle 2's batch entry
+    second, levels = batch([3, 4], 22.0)
+    writer.append_frame(levels, "bbbbbbbbbbbb")
+    climatology, binned = build(tmp_path / "cube.zarr", store=ProfileStore(root), metadata=second)
+    assert binned == 2
+    writer.drop(["aaaaaaaaaaaa"], [1900001], [2])
+    climatology, binned = build(tmp_path / "cube.zarr", store=ProfileStore(root), metadata=second.iloc[:0])
+    assert binned == 0
+    assert climatology.n_profiles == 3
+
+    rebuilt, _ = build(tmp_path / "full.zarr", full=True, store=ProfileStore(root),
+                       metadata=pd.concat([first, second], ignore_index=True))
+    updated, expected = climatology.lookup([-35.5], [95.5], [10]), rebuilt.lookup([-35.5], [95.5], [10])
+    for name in expected:
+        np.testing.assert_allclose(updated[name], expected[name], err_msg=name)
+    assert updated["profiles"][0, 0] == 3
@@ -0,0 +1,43 @@
+"""Context lines for rows with missing positions or times, with and without a climatology."""
+import numpy as np
+import pandas as pd
+
+from climatology import build as build_climatology
+from context_builder import build_context
+from profile_store import ProfileStore, ProfileStoreWriter
+
+
+def test_unlocated_rows_are_marked_not_fatal():
+    rows = pd.DataFrame({
+        "float_id": [1900001, 1900001, 1900002, 1900003],
+        "latitude": [10.0, np.nan, np.nan, 5.0],
+        "longitude": [20.0, np.nan, np.nan, 6.0],
+        "datetime": pd.to_datetime(["2013-01-01", "2013-01-11", "2013-02-01", None]),
+    }, index=[5, 6, 7, 8])
+
+    lines = build_context(rows).splitlines()
+    assert "  - 2013-01-11 00:00 at ?°N, ?°E." in lines
+    assert "Float 1900002 was at ?°N, ?°E on 2013-02-01 00:00." in lines
+    assert "Float 1900003 was at 5.000°N, 6.000°E on ?." in lines
+
+
+def test_rows_without_a_date_are_left_out_of_the_climatology(tmp_path):
+    rows = pd.DataFrame({
+        "float_id": [1900001, 1900002, 1900003, 1900004],
+        "cycle_number": [1, 1, 1, 1],
+        "latitude": [10.1, 10.2, 10.3, 10.4],
+        "longitude": [20.1, 20.2, 20.3, 20.4],
+        "datetime": pd.to_datetime(["2013-01-01", "2013-01-05", "2013-01-09", None]),
+        "surface_temperature": [25.0, 25.5, 26.0, 26.5],
+    }, index=[5, 6, 7, 8])
+    levels = rows.loc[rows.index.repeat(3), ["float_id", "cycle_number"]].assign(
+        pressure=np.tile([5.0, 50.0, 150.0], len(rows)), temperature=25.0, salinity=35.0,
+        pres_qc=b"1", temp_qc=b"1", sal_qc=b"1")
+    ProfileStoreWriter(tmp_path / "store").append_frame(levels)
+    climatology, binned = build_climatology(tmp_path / "climatology.zarr", store=ProfileStore(tmp_path / "store"),
+                                            metadata=rows)
+    assert binned == 3
+
+    lines = build_context(rows, climatology=climatology).splitlines()
+    assert "Float 1900004 was at 10.400°N, 20.400°E on ?: surface 26.5°C." in lines
+    assert any(line.startswith("Climatology of the") and "in January" in line for line in lines)
@@ -0,0 +1,39 @@
+"""EmbeddingCheckpoint.finalize(base=...): appending to an int8 store never clips the new vectors."""
+import numpy as np
+
+from embedding_store import EmbeddingCheckpoint, EmbeddingStore
+
+
+def append(path, base, vectors, row_ids):
+    checkpoint = EmbeddingCheckpoint(path, "model", "fp", row_ids, chunk_rows=4)
+    for i in range(len(checkpoint)):
+        start, end = checkpoint.bounds(i)
+        checkpoint.save(i, vectors[start:end])
+    return checkpoint.finalize(base=base)
+
+
+def test_int8_append_widens_the_scales(tmp_path):
+    path = tmp_path / "embeddings.npy"
+    rng = np.random.default_rng(0)
+    old = rng.uniform(-0.1, 0.1, size=(6, 8)).astype(np.float32)
+    new = rng.uniform(-1.0, 1.0, size=(5, 8)).astype(np.float32)
+    EmbeddingStore.write(old, np.arange(6), "model", "fp", path, dtype="int8")
+    store = append(path, EmbeddingStore.open(path), new, np.arange(6, 11))
+
+    assert store.meta["dtype"] == "int8"
+    step = store.scale  # one quantization step per dimension, after requantizing the base rows too
+    assert np.all(np.abs(store.vectors_for(np.arange(6, 11)) - new) <= step / 2 + 1e-6)
+    assert np.all(np.abs(store.vectors_for(np.arange(6)) - old) <= step + 1e-6)
+
+
+def test_int8_append_within_the_scales_keeps_the_stored_rows(tmp_path):
+    path = tmp_path / "embeddings.npy"
+    rng = np.random.default_rng(1)
+    old = rng.uniform(-1.0, 1.0, size=(6, 8)).astype(np.float32)
+    EmbeddingStore.write(old, np.arange(6), "model", "fp", path, dtype="int8")
+    before = EmbeddingStore.open(path)
+    stored, scale = np.array(before.embeddings), before.scale.copy()
+    store = append(path, before, old[:3] * 0.5, np.arange(6, 9))
+
+    np.testing.assert_array_equal(store.scale, scale)
+    np.testing.assert_array_equal(store.embeddings[:6], stored)
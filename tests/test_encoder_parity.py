@@ -0,0 +1,52 @@
+"""ONNX exports against the reference PyTorch model (skipped without torch and onnxruntime)."""
+import shutil
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("tokenizers")
+
+from encoder import OnnxEncoder, check_parity, export, export_dir, load_encoder  # noqa: E402
+
+MODEL = "all-MiniLM-L6-v2"
+SENTENCES = [f"Float {1900000 + i} at {-40 + i * 0.7:.3f}, {20 + i * 1.3:.3f} on 2013-{i % 12 + 1:02d}-15 06:00:00"
+             for i in range(60)] + [
+    "What ARGO floats were near -41N, 96E in 2013 and what patterns do they show?",
+    "Where do floats show warm fresh surface water?",
+    "Which floats measured salinity above 35.5 near the equator?",
+]
+
+
+@pytest.fixture(scope="module")
+def exported(tmp_path_factory):
+    """(onnx_dir, reference model) with a fresh fp32 and int8 export, before any parity check."""
+    try:
+        reference = load_encoder(MODEL, "torch")
+    except OSError as e:
+        pytest.skip(f"reference model {MODEL} is not available: {e}")
+    onnx_dir = tmp_path_factory.mktemp("onnx_models")
+    export(MODEL, onnx_dir, int8=True)
+    unchecked = tmp_path_factory.mktemp("unchecked")
+    shutil.copytree(export_dir(MODEL, onnx_dir), export_dir(MODEL, unchecked))
+    return onnx_dir, unchecked, reference
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_export_matches_reference(exported, backend):
+    onnx_dir, _, reference = exported
+    result = check_parity(MODEL, backend, SENTENCES, onnx_dir=onnx_dir, reference=reference)
+    assert result["passed"], result
+
+    encoder = load_encoder(MODEL, backend, onnx_dir=onnx_dir)
+    assert encoder.reference_fingerprint is not None
+    assert encoder.encode(SENTENCES[:4]).shape == (4, reference.get_sentence_embedding_dimension())
+
+
+def test_unchecked_export_is_refused(exported):
+    _, unchecked, _ = exported
+    with pytest.raises(ValueError, match="no parity check"):
+        load_encoder(MODEL, "onnx", onnx_dir=unchecked)
+    encoder = OnnxEncoder(export_dir(MODEL, unchecked), "onnx", allow_unchecked=True)
+    assert encoder.reference_fingerprint is None
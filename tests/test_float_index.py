@@ -0,0 +1,41 @@
+"""load_or_build: a persisted float index is reused only for the rows (IDs, positions, times) it was built from."""
+import numpy as np
+import pandas as pd
+
+from float_index import load_or_build
+
+
+def metadata(row_ids):
+    n = len(row_ids)
+    return pd.DataFrame({"float_id": 1900001 + np.arange(n) % 3, "latitude": np.linspace(-40, -30, n),
+                         "longitude": np.linspace(90, 100, n),
+                         "datetime": pd.date_range("2013-01-01", periods=n, freq="10D")}, index=row_ids)
+
+
+def test_reuses_the_index_for_the_same_rows(tmp_path):
+    path = tmp_path / "float_index.npz"
+    load_or_build(metadata(np.arange(30)), path)
+    mtime = path.stat().st_mtime_ns
+    assert load_or_build(metadata(np.arange(30)), path).size == 30
+    assert path.stat().st_mtime_ns == mtime
+
+
+def test_rebuilds_when_rows_were_re_ided(tmp_path):
+    path = tmp_path / "float_index.npz"
+    load_or_build(metadata(np.arange(30)), path)
+    # A re-ingested file: same number of rows, but its rows got new IDs
+    row_ids = np.concatenate([np.arange(20), np.arange(30, 40)])
+    index = load_or_build(metadata(row_ids), path)
+    assert sorted(index.row_ids.tolist()) == row_ids.tolist()
+
+
+def test_rebuilds_when_a_row_moved(tmp_path):
+    path = tmp_path / "float_index.npz"
+    load_or_build(metadata(np.arange(30)), path)
+    # A corrected position (or time) keeps the row IDs but must still reach the index
+    moved = metadata(np.arange(30))
+    moved.loc[7, "latitude"] += 0.5
+    moved.loc[9, "datetime"] += pd.Timedelta(hours=6)
+    index = load_or_build(moved, path)
+    assert np.isclose(index.row_lat[index.row_ids == 7][0], moved.loc[7, "latitude"])
+    assert index.row_time[index.row_ids == 9][0] == moved.loc[9, "datetime"]
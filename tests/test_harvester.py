@@ -0,0 +1,90 @@
+"""Harvester against the local stand-in THREDDS server (fake_thredds.py)."""
+import asyncio
+import os
+
+from fake_thredds import start_fake_thredds
+from harvester import Harvester
+from sync_manifest import SYNC_MANIFEST_NAME, SyncManifest
+
+YEAR_MONTHS = [(2013, 1), (2013, 2)]
+
+
+def make_archive(root, files_per_month=3, size=200_000):
+    """Random .nc payloads laid out as <root>/<year>/<month>/; returns {relative path: bytes}."""
+    contents = {}
+    for year, month in YEAR_MONTHS:
+        month_dir = root / str(year) / f"{month:02d}"
+        month_dir.mkdir(parents=True)
+        for i in range(files_per_month):
+            data = os.urandom(size + i)
+            (month_dir / f"nodc_D29000{i:02d}_{month:03d}.nc").write_bytes(data)
+            contents[f"{year}/{month:02d}/nodc_D29000{i:02d}_{month:03d}.nc"] = data
+    return contents
+
+
+def harvest(src, out_dir, manifest_path=None, **server_options):
+    """One harvester run against a fresh fake server; returns (harvester stats, server request counts)."""
+    async def main():
+        runner, fake, base_url = await start_fake_thredds(src, **server_options)
+        manifest = SyncManifest(manifest_path) if manifest_path else None
+        try:
+            async with Harvester(out_dir, base_url, concurrency=4, per_host=4, retry_delay=0.01,
+                                 manifest=manifest) as harvester:
+                stats = await harvester.run(YEAR_MONTHS)
+            assert harvester.failed == []
+            return stats, fake.requests
+        finally:
+            if manifest:
+                manifest.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_interrupted_downloads_resume_with_range(tmp_path):
+    contents = make_archive(tmp_path / "src")
+    stats, requests = harvest(tmp_path / "src", tmp_path / "out", break_first=1)
+
+    assert requests["broken"] == len(contents)
+    assert requests["partial"] == len(contents)  # every retry was answered with 206
+    assert stats["resumed"] == len(contents)
+    for relative, data in contents.items():
+        assert (tmp_path / "out" / relative).read_bytes() == data
+    assert not list((tmp_path / "out").rglob("*.part"))
+
+
+def test_second_run_revalidates_with_304(tmp_path):
+    contents = make_archive(tmp_path / "src")
+    harvest(tmp_path / "src", tmp_path / "out")
+    stats, requests = harvest(tmp_path / "src", tmp_path / "out")
+
+    assert stats["downloaded"] == stats["resumed"] == 0
+    assert stats["not_modified"] == len(contents)
+    assert requests["not_modified"] == len(contents)
+    for relative, data in contents.items():
+        assert (tmp_path / "out" / relative).read_bytes() == data
+
+
+def test_changed_file_is_fetched_again(tmp_path):
+    contents = make_archive(tmp_path / "src")
+    harvest(tmp_path / "src", tmp_path / "out")
+    relative = next(iter(contents))
+    changed = tmp_path / "src" / relative
+    changed.write_bytes(b"new content")
+    os.utime(changed, (1_700_000_000, 1_700_000_000))
+    stats, _ = harvest(tmp_path / "src", tmp_path / "out")
+
+    assert stats["downloaded"] == 1
+    assert stats["not_modified"] == len(contents) - 1
+    assert (tmp_path / "out" / relative).read_bytes() == b"new content"
+
+
+def test_manifest_skips_unchanged_catalogs_and_files(tmp_path):
+    contents = make_archive(tmp_path / "src")
+    manifest_path = tmp_path / "out" / SYNC_MANIFEST_NAME
+    (tmp_path / "out").mkdir()
+    harvest(tmp_path / "src", tmp_path / "out", manifest_path)
+    stats, requests = harvest(tmp_path / "src", tmp_path / "out", manifest_path)
+
+    assert stats["catalogs_cached"] == len(YEAR_MONTHS)
+    assert stats["up_to_date"] == len(contents)
+    assert requests["file"] == 0
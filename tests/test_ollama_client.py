@@ -0,0 +1,116 @@
+"""OllamaClient against the local stand-in server (fake_ollama.py)."""
+import asyncio
+
+import pytest
+
+from fake_ollama import DEFAULT_ANSWER, FakeOllama, start_fake_ollama
+from ollama_client import OllamaClient, OllamaError
+
+
+def run_with_fake(fake, body, **client_options):
+    """Start `fake`, run `await body(client, fake)` with a client pointed at it, then stop both."""
+    async def main():
+        runner, url = await start_fake_ollama(fake=fake)
+        try:
+            async with OllamaClient(url=url, retry_delay=0.01, **client_options) as client:
+                return await body(client, fake)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_stream_yields_tokens_in_order():
+    async def body(client, fake):
+        return [token async for token in client.stream("prompt", options={"num_predict": None})]
+
+    tokens = run_with_fake(FakeOllama(token_delay=0), body)
+    assert len(tokens) > 1
+    assert "".join(tokens) == DEFAULT_ANSWER
+
+
+def test_num_predict_limits_tokens():
+    async def body(client, fake):
+        return [token async for token in client.stream("prompt", options={"num_predict": 3})]
+
+    assert len(run_with_fake(FakeOllama(token_delay=0), body)) == 3
+
+
+def test_retries_injected_503s():
+    async def body(client, fake):
+        return await client.generate("prompt", options={"num_predict": None}), fake.requests
+
+    answer, requests = run_with_fake(FakeOllama(token_delay=0, fail_first=2), body, max_retries=3)
+    assert answer == DEFAULT_ANSWER
+    assert requests == 3
+
+
+def test_gives_up_after_max_retries():
+    async def body(client, fake):
+        with pytest.raises(OllamaError, match="All 2 attempts failed"):
+            await client.generate("prompt")
+        return fake.requests
+
+    assert run_with_fake(FakeOllama(token_delay=0, fail_first=5), body, max_retries=2) == 2
+
+
+def test_interrupted_stream_raises_ollama_error():
+    async def body(client, fake):
+        tokens = []
+        with pytest.raises(OllamaError, match="Stream interrupted"):
+            async for token in client.stream("prompt"):
+                tokens.append(token)
+        return tokens, fake.requests
+
+    tokens, requests = run_with_fake(FakeOllama(token_delay=0, cut_after=2), body)
+    assert len(tokens) == 2
+    assert requests == 1  # tokens were already yielded, so nothing is replayed
+
+
+def test_cancelling_the_consumer_closes_the_stream():
+    async def body(client, fake):
+        received = []
+
+        async def consume():
+            async for token in client.stream("prompt", options={"num_predict": None}):
+                received.append(token)
+
+        task = asyncio.create_task(consume())
+        while len(received) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The server notices on its next write
+        for _ in range(100):
+            if fake.cancelled:
+                break
+            await asyncio.sleep(0.02)
+        return received, fake.cancelled
+
+    received, cancelled = run_with_fake(FakeOllama(token_delay=0.05), body)
+    assert 2 <= len(received) < len(DEFAULT_ANSWER.split(" "))
+    assert cancelled == 1
+
+
+@pytest.mark.parametrize("garbage", [False, True])
+def test_stream_ending_before_done_raises(garbage):
+    async def body(client, fake):
+        tokens = []
+        with pytest.raises(OllamaError, match="Stream interrupted"):
+            async for token in client.stream("prompt", options={"num_predict": None}):
+                tokens.append(token)
+        return tokens
+
+    tokens = run_with_fake(FakeOllama(token_delay=0, end_after=3, garbage=garbage), body)
+    assert len(tokens) == 3  # the partial answer never completes as if it were whole
+
+
+@pytest.mark.parametrize("garbage", [False, True])
+def test_stream_ending_before_the_first_token_is_retried(garbage):
+    async def body(client, fake):
+        return await client.generate("prompt", options={"num_predict": None}), fake.requests
+
+    answer, requests = run_with_fake(FakeOllama(token_delay=0, end_after=0, end_streams=2, garbage=garbage), body,
+                                     max_retries=3)
+    assert answer == DEFAULT_ANSWER
+    assert requests == 3
@@ -0,0 +1,36 @@
+"""ProfileStore keys: only (float_id, cycle_number) pairs that fit the packed key are stored or found."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from profile_store import CYCLE_FILL, MAX_CYCLE, ProfileStore, ProfileStoreWriter, profile_key
+
+
+def levels(float_id, cycle, n=3):
+    return pd.DataFrame({"float_id": str(float_id), "cycle_number": cycle, "pressure": np.arange(n) * 10.0,
+                         "temperature": 20.0, "salinity": 35.0, "pres_qc": b"1", "temp_qc": b"1",
+                         "sal_qc": b"1"}, index=range(n))
+
+
+def test_keys_are_distinct_across_floats_and_cycles():
+    keys = profile_key([1900001, 1900001, 1900002], [0, MAX_CYCLE, 0])
+    assert len(set(keys.tolist())) == 3
+    assert keys[1] < keys[2]
+
+
+@pytest.mark.parametrize("cycle", [-1, MAX_CYCLE + 1, CYCLE_FILL, np.nan, 2.5])
+def test_cycles_that_do_not_fit_are_refused(tmp_path, cycle):
+    with pytest.raises(ValueError, match="cannot be stored"):
+        profile_key([1900001], [cycle])
+    with pytest.raises(ValueError):
+        ProfileStoreWriter(tmp_path).append_frame(levels(1900001, cycle))
+    assert ProfileStore(tmp_path).find([1900001], [cycle]).tolist() == [-1]
+
+
+def test_find_returns_the_latest_entry(tmp_path):
+    writer = ProfileStoreWriter(tmp_path)
+    writer.append_frame(pd.concat([levels(1900001, 1), levels(1900001, 2)], ignore_index=True))
+    writer.append_frame(levels(1900001, 1, n=5))
+    store = ProfileStore(tmp_path)
+    assert store.find([1900001, 1900001, 1900003], [1, 2, 1]).tolist() == [2, 1, -1]
+    assert len(store.get(1900001, 1)) == 5
@@ -0,0 +1,35 @@
+"""update_summaries: only profiles whose store entry changed are summarized again."""
+import numpy as np
+import pandas as pd
+
+from profile_store import ProfileStore, ProfileStoreWriter
+from profile_summaries import load_summaries, update_summaries
+
+
+def levels(cycles, n=3):
+    return pd.DataFrame({"float_id": "1900001", "cycle_number": np.repeat(cycles, n),
+                         "pressure": np.tile(np.arange(n) * 10.0, len(cycles)), "temperature": 20.0,
+                         "salinity": 35.0, "pres_qc": b"1", "temp_qc": b"1", "sal_qc": b"1"})
+
+
+def max_depths(path):
+    summaries = load_summaries(path)
+    return dict(zip(summaries["cycle_number"].tolist(), summaries["max_depth"].tolist()))
+
+
+def test_summaries_follow_the_store(tmp_path):
+    root, path = tmp_path / "store", tmp_path / "summaries.parquet"
+    writer = ProfileStoreWriter(root)
+    writer.append_frame(levels([1, 2]), "aaaaaaaaaaaa")
+    assert update_summaries(ProfileStore(root), path) == 2
+    assert update_summaries(ProfileStore(root), path) == 0
+
+    # A new batch re-ingests cycle 2 deeper and adds cycle 3
+    writer.append_frame(levels([2, 3], n=5), "bbbbbbbbbbbb")
+    assert update_summaries(ProfileStore(root), path) == 2
+    assert max_depths(path) == {1: 20.0, 2: 40.0, 3: 40.0}
+
+    # Dropping that batch brings back the earlier cycle 2 and removes cycle 3
+    writer.drop(["bbbbbbbbbbbb"])
+    assert update_summaries(ProfileStore(root), path) == 1
+    assert max_depths(path) == {1: 20.0, 2: 20.0}
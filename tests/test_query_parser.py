@@ -0,0 +1,34 @@
+"""Date keywords in parse_query: "since"/"until" include the named period, "after"/"before" exclude it."""
+import pytest
+
+from query_parser import DATE_RANGE, parse_query
+
+
+@pytest.mark.parametrize("question, start, end", [
+    ("floats since 2013", "2013-01-01", None),
+    ("floats after 2013", "2014-01-01", None),
+    ("floats after October 2013", "2013-11-01", None),
+    ("floats after 2013-10-04", "2013-10-05", None),
+    ("floats until 2013", None, "2013-12-31"),
+    ("floats before 2013", None, "2012-12-31"),
+    ("floats before 2013-10", None, "2013-09-30"),
+    ("floats before 2013-10-04", None, "2013-10-03"),
+    ("floats in 2013", "2013-01-01", "2013-12-31"),
+    ("floats from 2012 to 2014", "2012-01-01", "2014-12-31"),
+    ("floats between 2012 and 2014", "2012-01-01", "2014-12-31"),
+    # Two periods, not a range: each keeps its own keyword
+    ("floats after 2012 and 2014", "2013-01-01", "2014-12-31"),
+])
+def test_date_keywords(question, start, end):
+    parsed = parse_query(question)
+    assert (parsed.start, parsed.end) == (start, end)
+
+
+@pytest.mark.parametrize("question, is_range", [
+    ("floats between 2012 and 2014", True),
+    ("floats in 2012 and 2014", False),
+    ("floats in March 2013 and 2014", False),
+    ("floats from 2012-2014", True),
+])
+def test_and_separates_a_range_only_after_between(question, is_range):
+    assert (DATE_RANGE.search(question) is not None) == is_range
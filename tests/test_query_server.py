@@ -0,0 +1,81 @@
+"""Query server requests: malformed input is a 400, never a 500, and blocking work stays off the event loop."""
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import query_server
+from answer_cache import AnswerCache
+from query_server import QueryService
+
+
+def post(data):
+    """POST `data` (raw bytes) to /query of a service with no assets loaded; returns (status, text)."""
+    async def main():
+        service = QueryService()
+        app = web.Application()
+        app.router.add_post("/query", service.handle_query)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/query", data=data)
+            return response.status, await response.text()
+    return asyncio.run(main())
+
+
+def test_invalid_json_is_rejected():
+    status, text = post(b'{"question": ')
+    assert status == 400
+    assert "not valid JSON" in text
+
+
+@pytest.mark.parametrize("body, field", [
+    (b'{"k": 3}', "question"),
+    (b'["Floats near 10N, 60E?"]', "question"),
+    (b'{"question": "floats?", "k": "five"}', "k"),
+    (b'{"question": "floats?", "k": 0}', "k"),
+    (b'{"question": "floats?", "context_tokens": [1]}', "context_tokens"),
+    (b'{"question": "floats?", "lat": "north"}', "lat"),
+    (b'{"question": "floats?", "radius_km": -5}', "radius_km"),
+    (b'{"question": "floats?", "start": "last tuesday-ish"}', "start"),
+    (b'{"question": "floats?", "end": 2013}', "end"),
+    (b'{"question": "floats?", "float_ids": "1900270"}', "float_ids"),
+])
+def test_bad_fields_are_rejected(body, field):
+    status, text = post(body)
+    assert status == 400
+    assert f"'{field}'" in text
+
+
+def test_context_and_question_embedding_are_built_off_the_event_loop(tmp_path, monkeypatch):
+    on_loop = {}
+
+    def recorded(name, result):
+        def call(*args, **kwargs):
+            on_loop[name] = threading.current_thread() is threading.main_thread()
+            return result
+        return call
+
+    rows = pd.DataFrame({"float_id": [1900001], "latitude": [10.0], "longitude": [60.0],
+                         "datetime": pd.to_datetime(["2013-10-04"])}, index=[7])
+    monkeypatch.setattr(query_server, "build_context", recorded("build_context", "Float 1900001 ..."))
+
+    async def main():
+        service = QueryService(answer_cache=AnswerCache(tmp_path / "answers.sqlite", similarity=0.95))
+        service.assets = SimpleNamespace(climatology=None, loaded_model=object(), embedding_model=object())
+        service._retrieve = lambda assets, body: rows
+        service.cache.get_or_encode = recorded("encode", np.ones(4, dtype=np.float32))
+        request = SimpleNamespace(json=lambda: asyncio.sleep(0, {"question": "Floats near 10N, 60E?"}))
+        _, _, context, encode = await service._prepare(request)
+        service.executor.shutdown()
+        return context, encode
+
+    context, encode = asyncio.run(main())
+    assert context == "Float 1900001 ..."
+    assert on_loop == {"build_context": False, "encode": False}
+    # The answer cache gets the precomputed vector, without encoding on the loop again
+    assert encode("Floats near 10N, 60E?").tolist() == [1.0] * 4
+    assert on_loop == {"build_context": False, "encode": False}
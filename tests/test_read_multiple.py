@@ -0,0 +1,69 @@
+"""sweep_pending / drop_files: profiles of swept or dropped batches disappear from the profile store too."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest_manifest import IngestManifest
+from profile_store import ProfileStore, batch_tag
+from read_multiple import BatchWriter, drop_files, sweep_pending
+
+
+def read(cycles, n_levels=3, float_id="1900001"):
+    """(metadata_df, profile_df) as read_nc_file returns them for one file."""
+    metadata_df = pd.DataFrame({"float_id": float_id, "cycle_number": cycles, "latitude": -35.0,
+                                "longitude": 95.0, "datetime": pd.Timestamp("2013-10-04")}, index=range(len(cycles)))
+    profile_df = pd.DataFrame({"float_id": float_id, "cycle_number": np.repeat(cycles, n_levels),
+                               "pressure": np.tile(np.arange(n_levels) * 10.0, len(cycles)), "temperature": 20.0,
+                               "salinity": 35.0, "pres_qc": b"1", "temp_qc": b"1", "sal_qc": b"1",
+                               "datetime": pd.Timestamp("2013-10-04")})
+    return metadata_df, profile_df
+
+
+@pytest.fixture
+def roots(tmp_path):
+    return {"metadata_root": str(tmp_path / "metadata"), "profiles_root": str(tmp_path / "profiles"),
+            "profile_store": str(tmp_path / "store")}
+
+
+def write(manifest, roots, files):
+    writer = BatchWriter(manifest, **roots)
+    for path, (metadata_df, profile_df) in files.items():
+        writer.add((path, 1, 1, None), metadata_df, profile_df)
+    writer.flush()
+
+
+def levels(roots, cycles):
+    store = ProfileStore(roots["profile_store"])
+    return [len(store.get(1900001, c)) if store.find(1900001, c)[0] >= 0 else None for c in cycles]
+
+
+def test_swept_batch_profiles_are_no_longer_returned(tmp_path, roots, monkeypatch):
+    manifest = IngestManifest(tmp_path / "manifest.sqlite")
+    write(manifest, roots, {"a.nc": read([1, 2])})
+    # A crash after the batch's data was written but before it was recorded
+    def crash(*args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(manifest, "record", crash)
+    with pytest.raises(KeyboardInterrupt):
+        write(manifest, roots, {"b.nc": read([2, 3], n_levels=5)})
+    monkeypatch.undo()
+    assert levels(roots, [1, 2, 3]) == [3, 5, 5]
+
+    assert sweep_pending(manifest, roots["metadata_root"], roots["profiles_root"], roots["profile_store"]) == {1900001}
+    # Cycle 2 falls back to the entry of the recorded batch
+    assert levels(roots, [1, 2, 3]) == [3, 3, None]
+
+
+def test_dropped_files_lose_their_profiles_and_the_rest_of_the_batch_keeps_them(tmp_path, roots):
+    manifest = IngestManifest(tmp_path / "manifest.sqlite")
+    write(manifest, roots, {"a.nc": read([1, 2]), "b.nc": read([3])})
+    drop_files(manifest, ["b.nc"], roots["metadata_root"], roots["profiles_root"], roots["profile_store"])
+    assert levels(roots, [1, 2, 3]) == [3, 3, None]
+
+    # The kept entries moved with their rows to the rewritten batch, so dropping that batch's file hides them
+    (batch_id, _, _), = manifest.locate(["a.nc"]).values()
+    store = ProfileStore(roots["profile_store"])
+    assert store.tags()[store.find([1900001, 1900001], [1, 2])].tolist() == [batch_tag(batch_id)] * 2
+    drop_files(manifest, ["a.nc"], roots["metadata_root"], roots["profiles_root"], roots["profile_store"])
+    assert levels(roots, [1, 2, 3]) == [None, None, None]
@@ -0,0 +1,28 @@
+"""Index manifest versions and the recall measurement."""
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from vector_index import _recall_queries, build_index, read_manifest, write_index
+
+
+def store(tmp_path, n=300, dimension=16):
+    vectors = np.random.default_rng(0).standard_normal((n, dimension)).astype(np.float32)
+    EmbeddingStore.write(vectors, np.arange(n), "model", "fp", tmp_path / "embeddings.npy")
+    return EmbeddingStore.open(tmp_path / "embeddings.npy")
+
+
+def test_version_keeps_increasing_across_rebuilds(tmp_path):
+    path = str(tmp_path / "index.faiss")
+    embeddings = store(tmp_path)
+    for expected in (1, 2, 3):
+        index, manifest = build_index(embeddings, "flat")
+        assert write_index(index, manifest, path)["version"] == expected
+    assert read_manifest(path)["version"] == 3
+
+
+def test_recall_queries_are_not_stored_vectors(tmp_path):
+    embeddings = store(tmp_path)
+    queries = _recall_queries(embeddings, 50, seed=1)
+    stored = embeddings.as_float32(np.asarray(embeddings.embeddings))
+    nearest = np.min(np.linalg.norm(queries[:, None, :] - stored[None, :, :], axis=2), axis=1)
+    assert np.all(nearest > 0.1)
@@ -0,0 +1,173 @@
+"""Lightweight tracing: timed spans with row counts and memory deltas.
+
+    with span("search.rank", rows=len(candidates)) as s:
+        hits = ...
+        s.rows = len(hits)          # or set it here, once known
+
+Every finished span is aggregated by name: count, errors, total seconds,
+a duration histogram, rows, and the last RSS delta. The aggregates are
+exported in the Prometheus text format (served by query_server.py at
+/metrics, or written to a file for the node-exporter textfile collector).
+When a log is configured, each span is also written as one JSON line.
+Spans nest, and a span records its parent, within a thread or an asyncio
+task. Memory is the process RSS before and after the span, so the deltas
+of concurrent spans overlap.
+
+Configured from the environment:
+    FLOATCHAT_TRACE_LOG   JSON-lines span log ("-" for stderr)
+    FLOATCHAT_METRICS     Prometheus text file, rewritten by write_metrics()
+"""
+import contextvars
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "floatchat"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_current = contextvars.ContextVar("floatchat_span", default=None)
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    def __init__(self, name, parent, rows, attrs):
+        self.name = name
+        self.parent = parent
+        self.rows = rows
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _Stats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.rows = 0
+        self.rss_delta = 0
+
+
+class Tracer:
+    def __init__(self, log_path=None, metrics_path=None):
+        self.metrics_path = metrics_path
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            self._log = sys.stderr if log_path == "-" else open(log_path, "a", encoding="utf-8", buffering=1)
+
+    @contextmanager
+    def span(self, name, rows=None, **attrs):
+        parent = _current.get()
+        current = Span(name, parent.name if parent is not None else None, rows, attrs)
+        token = _current.set(current)
+        rss = rss_bytes()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield current
+        except BaseException as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(current, time.perf_counter() - started, rss_bytes() - rss, error)
+
+    def record(self, name, seconds, rows=None, **attrs):
+        """Add a stage timed elsewhere (e.g. a stream consumed across many awaits) as a finished span."""
+        parent = _current.get()
+        self._finish(Span(name, parent.name if parent is not None else None, rows, attrs), seconds, 0, None)
+
+    def _finish(self, span, seconds, rss_delta, error):
+        with self._lock:
+            stats = self._stats.setdefault(span.name, _Stats())
+            stats.count += 1
+            stats.errors += error is not None
+            stats.seconds += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            stats.rows += span.rows or 0
+            stats.rss_delta = rss_delta
+        if self._log is not None:
+            record = {"ts": round(time.time(), 6), "span": span.name, "parent": span.parent,
+                      "duration_ms": round(seconds * 1000, 3), "rows": span.rows,
+                      "rss_mb": round(rss_bytes() / 2 ** 20, 1), "rss_delta_mb": round(rss_delta / 2 ** 20, 2)}
+            if error:
+                record["error"] = error
+            record.update(span.attrs)
+            line = json.dumps(record, default=str) + "\n"
+            with self._lock:
+                self._log.write(line)
+
+    def summary(self):
+        """{span name: {"count", "total_s", "mean_ms", "rows", "rss_delta_mb"}}."""
+        with self._lock:
+            return {name: {"count": s.count, "total_s": round(s.seconds, 4),
+                           "mean_ms": round(s.seconds / s.count * 1000, 3), "rows": s.rows,
+                           "rss_delta_mb": round(s.rss_delta / 2 ** 20, 2)}
+                    for name, s in self._stats.items()}
+
+    def print_summary(self, file=sys.stdout):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"\n⏱️  {'stage':<24} {'count':>6} {'total ms':>10} {'mean ms':>9} {'rows':>10} {'ΔRSS MB':>8}", file=file)
+        for name, s in summary.items():
+            print(f"   {name:<24} {s['count']:>6} {s['total_s'] * 1000:>10.1f} {s['mean_ms']:>9.2f} "
+                  f"{s['rows']:>10} {s['rss_delta_mb']:>8.1f}", file=file)
+
+    def prometheus_text(self, gauges=None):
+        """Prometheus exposition of the span aggregates, plus `gauges` ({name: value})."""
+        lines = [f"# HELP {PREFIX}_span_duration_seconds Duration of traced pipeline stages.",
+                 f"# TYPE {PREFIX}_span_duration_seconds histogram"]
+        with self._lock:
+            stats = sorted(self._stats.items())
+            for name, s in stats:
+                for bound, count in zip(BUCKETS, s.buckets):
+                    lines.append(f'{PREFIX}_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'{PREFIX}_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {s.count}')
+                lines.append(f'{PREFIX}_span_duration_seconds_sum{{span="{name}"}} {s.seconds:.6f}')
+                lines.append(f'{PREFIX}_span_duration_seconds_count{{span="{name}"}} {s.count}')
+            for metric, kind, help_text, value in [
+                    ("span_rows_total", "counter", "Rows processed by traced stages.", lambda s: s.rows),
+                    ("span_errors_total", "counter", "Traced stages that raised.", lambda s: s.errors),
+                    ("span_rss_delta_bytes", "gauge", "RSS change over the last run of a stage.",
+                     lambda s: s.rss_delta)]:
+                lines += [f"# HELP {PREFIX}_{metric} {help_text}", f"# TYPE {PREFIX}_{metric} {kind}"]
+                lines += [f'{PREFIX}_{metric}{{span="{name}"}} {value(s)}' for name, s in stats]
+        gauges = dict(gauges or {}, process_resident_memory_bytes=rss_bytes())
+        for name, value in gauges.items():
+            lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path=None, gauges=None):
+        """Atomically rewrite the Prometheus text file (no-op without a path)."""
+        path = path or self.metrics_path
+        if not path:
+            return
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text(gauges))
+        os.replace(tmp, path)
+
+
+TRACER = Tracer(os.environ.get("FLOATCHAT_TRACE_LOG"), os.environ.get("FLOATCHAT_METRICS"))
+span = TRACER.span
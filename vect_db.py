@@ -1,47 +1,172 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-import faiss
+"""Build the row embedding store and FAISS index from the float metadata.
+
+Rows are encoded in checkpointed chunks: each finished chunk is saved under
+`argo_embeddings_chunks/`, so an interrupted build resumes at the first
+missing chunk. Chunks can be encoded by several CPU processes, and the
+final store can be kept as float32, float16 or int8.
+
+The index type is selectable (see vector_index.py). --encoder picks the
+PyTorch model or its ONNX / int8 export (see encoder.py). With --append, only rows
+added since the last build are encoded and added to the existing store and
+index, without retraining or rebuilding; rows a re-ingest dropped are
+removed from both (an HNSW index cannot remove rows and must be rebuilt).
+
+Run with:  python vect_db.py --processes 8 --batch-size 256 --dtype float16 --index-type hnsw
+      or:  python vect_db.py --encoder onnx-int8 --threads 8
+Then, after each ingestion:  python vect_db.py --append
+"""
+import argparse
+import os
+from pathlib import Path
+
 import numpy as np
 
-# Load your CSV
-df = pd.read_csv("argo_metadata.csv")
+from columnar_store import load_metadata
+from embedding_store import (EMBEDDINGS_PATH, INDEX_PATH, STORAGE_DTYPES, EmbeddingCheckpoint, EmbeddingStore,
+                             model_fingerprint, search_subset)
+from encoder import BACKENDS, load_encoder
+from tracing import TRACER, span
+from vector_index import (INDEX_TYPES, append_to_index, build_index, describe, index_row_ids, load_index,
+                          remove_from_index, write_index)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def row_texts(df):
+    """'Float <id> at <lat>, <lon> on <datetime>' for every row, built column-wise."""
+    lat = df["latitude"].astype("float64").map("{:.3f}".format)
+    lon = df["longitude"].astype("float64").map("{:.3f}".format)
+    return ("Float " + df["float_id"].astype(str) + " at " + lat + ", " + lon
+            + " on " + df["datetime"].map(str))
+
+
+def encode_chunks(model, texts, checkpoint, batch_size=256, processes=1):
+    """Encode every chunk the checkpoint is missing, saving each one as soon as it is done."""
+    pending = checkpoint.pending()
+    print(f"🧮 {len(checkpoint) - len(pending)} of {len(checkpoint)} chunks already encoded")
+    if processes > 1 and not hasattr(model, "start_multi_process_pool"):
+        raise ValueError("--processes needs the torch encoder; give the ONNX encoders --threads instead")
+    pool = model.start_multi_process_pool(["cpu"] * processes) if processes > 1 else None
+    try:
+        for n, i in enumerate(pending, 1):
+            start, end = checkpoint.bounds(i)
+            sentences = texts[start:end]
+            with span("build.encode", rows=end - start, processes=processes):
+                if pool is not None:
+                    embeddings = model.encode_multi_process(sentences, pool, batch_size=batch_size)
+                else:
+                    embeddings = model.encode(sentences, batch_size=batch_size, convert_to_numpy=True)
+                checkpoint.save(i, embeddings)
+            print(f"   chunk {i + 1}/{len(checkpoint)} ({end - start} rows), {len(pending) - n} left")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+
+def build(embeddings_path=EMBEDDINGS_PATH, index_path=INDEX_PATH, model_name=MODEL_NAME,
+          chunk_rows=100_000, batch_size=256, processes=1, dtype="float32", index_type="flat",
+          nlist=None, pq_m=None, hnsw_m=32, target_recall=0.95, backend=None, threads=None):
+    # Load metadata (Parquet dataset, or the CSV if it has not been converted); indexed by row ID
+    df = load_metadata()
+    texts = row_texts(df).tolist()
+    row_ids = df.index.to_numpy()
+
+    model = load_encoder(model_name, backend, threads)
+    checkpoint = EmbeddingCheckpoint(embeddings_path, model_name, model_fingerprint(model, model_name),
+                                     row_ids, chunk_rows)
+    encode_chunks(model, texts, checkpoint, batch_size, processes)
+
+    # Save embeddings keyed by row ID, with the model that produced them
+    with span("build.store", rows=len(row_ids), dtype=dtype):
+        store = checkpoint.finalize(dtype)
+    print(f"✅ Embedding store written ({len(store)} rows, {dtype}).")
+
+    # FAISS index; search results are row IDs, and queries can be restricted to a subset of them
+    with span("build.index", rows=len(store), index_type=index_type):
+        index, manifest = build_index(store, index_type, nlist, pq_m, hnsw_m, target_recall, chunk_rows)
+        manifest = write_index(index, manifest, index_path)
+    print(f"✅ FAISS index created and saved: {describe(manifest)}")
+    return df, model, index
 
-# Create a text column for embedding
-df["text"] = df.apply(lambda row: f"Float {row['float_id']} at {row['latitude']}, {row['longitude']} on {row['datetime']}", axis=1)
 
-# Load embedding model
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def append(embeddings_path=EMBEDDINGS_PATH, index_path=INDEX_PATH, chunk_rows=100_000, batch_size=256,
+           processes=1, backend=None, threads=None):
+    """Encode rows that are not in the store yet and add them to the store and the index.
 
-# Create embeddings
-embeddings = model.encode(df["text"].tolist(), convert_to_numpy=True)
+    Rows no longer in the metadata are first removed from the index and the store."""
+    df = load_metadata()
+    store = EmbeddingStore.open(embeddings_path)
+    model_name = store.model_name or MODEL_NAME
+    model = load_encoder(model_name, backend, threads)
+    fingerprint = model_fingerprint(model, model_name)
+    store.check_model(model_name, fingerprint)
+    index, manifest = load_index(index_path, model_name, fingerprint, store)
 
-# Save embeddings for later use
-np.save("argo_embeddings.npy", embeddings)
+    # Re-ingested files get new row IDs; their old rows would otherwise match but never resolve
+    stale = np.setdiff1d(index_row_ids(index), df.index.to_numpy())
+    if len(stale):
+        manifest = write_index(index, remove_from_index(index, manifest, stale), index_path)
+        print(f"✅ Removed {len(stale)} rows no longer in the metadata: {describe(manifest)}")
+    stale = np.setdiff1d(store.row_ids, df.index.to_numpy())
+    if len(stale):
+        store = store.without(stale)
+    new = ~store.contains(df.index.to_numpy())
+    if not new.any():
+        print(f"✅ Up to date: {describe(manifest)}")
+        return df, model, index
+    new_df = df[new]
+    checkpoint = EmbeddingCheckpoint(embeddings_path, model_name, fingerprint, new_df.index.to_numpy(), chunk_rows)
+    encode_chunks(model, row_texts(new_df).tolist(), checkpoint, batch_size, processes)
+    store = checkpoint.finalize(base=store)
+    print(f"✅ Embedding store extended by {len(new_df)} rows ({len(store)} total).")
 
+    with span("build.index", rows=len(new_df), append=True):
+        for start in range(0, len(new_df), chunk_rows):
+            ids = new_df.index.to_numpy()[start:start + chunk_rows]
+            manifest = append_to_index(index, manifest, store.vectors_for(ids), ids)
+        manifest = write_index(index, manifest, index_path)
+    print(f"✅ FAISS index updated: {describe(manifest)}")
+    return df, model, index
 
-#FAISS DB
-# Create FAISS index
-dimension = embeddings.shape[1]  # embedding size
-index = faiss.IndexFlatL2(dimension)  # L2 distance
 
-# Add embeddings to index
-index.add(embeddings)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the embedding store and FAISS index.")
+    parser.add_argument("--chunk-rows", type=int, default=100_000, help="rows per checkpointed chunk")
+    parser.add_argument("--batch-size", type=int, default=256, help="sentences per encoder batch")
+    parser.add_argument("--processes", type=int, default=1,
+                        help=f"CPU encoder processes (this machine has {os.cpu_count()} cores)")
+    parser.add_argument("--encoder", choices=BACKENDS, default=None,
+                        help="encoder backend (default $FLOATCHAT_ENCODER, else torch)")
+    parser.add_argument("--threads", type=int, default=None, help="encoder threads (default: all cores)")
+    parser.add_argument("--dtype", choices=STORAGE_DTYPES, default="float32", help="on-disk precision")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF cells (default ~4·√rows)")
+    parser.add_argument("--pq-m", type=int, default=None, help="IVF-PQ sub-quantizers (bytes per vector)")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="recall@10 the search setting (nprobe/efSearch) is tuned to")
+    parser.add_argument("--append", action="store_true", help="only add rows missing from the store and index")
+    args = parser.parse_args()
 
-# Save FAISS index
-faiss.write_index(index, "argo_index.faiss")
-print("✅ FAISS index created and saved.")
+    if args.append and Path(EMBEDDINGS_PATH).exists() and Path(INDEX_PATH).exists():
+        df, model, index = append(chunk_rows=args.chunk_rows, batch_size=args.batch_size, processes=args.processes,
+                                  backend=args.encoder, threads=args.threads)
+    else:
+        df, model, index = build(chunk_rows=args.chunk_rows, batch_size=args.batch_size,
+                                 processes=args.processes, dtype=args.dtype, index_type=args.index_type,
+                                 nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+                                 target_recall=args.target_recall, backend=args.encoder, threads=args.threads)
 
-# Load index
-index = faiss.read_index("argo_index.faiss")
+    TRACER.print_summary()
+    TRACER.write_metrics()
 
-#Querying
-# Example query
-query = "Find floats at 10N, 60E on 2013"
-query_embedding = model.encode([query], convert_to_numpy=True)
+    # Example query
+    query = "Find floats at 10N, 60E on 2013"
+    query_embedding = model.encode([query], convert_to_numpy=True)
 
-# Search
-k = 5  # top results
-distances, indices = index.search(query_embedding, k)
+    # Search
+    k = 5  # top results
+    distances, indices = search_subset(index, np.asarray(query_embedding), None, k)[0]
 
-# Show results
-print(df.iloc[indices[0]])
\ No newline at end of file
+    # Show results
+    print(df.loc[indices])
@@ -0,0 +1,277 @@
+"""FAISS index types for the row embeddings, with a versioned manifest.
+
+Every index is an IndexIDMap2 over one of:
+    flat       exact L2, linear in the number of rows
+    ivf-flat   inverted lists over k-means cells; `nprobe` cells searched per query
+    ivf-pq     as ivf-flat with product-quantized vectors (m bytes per row)
+    hnsw       graph index; `efSearch` candidates explored per query
+
+so search results are metadata row IDs and new rows can be appended with
+their IDs without rebuilding (IVF cells stay as trained; rebuild when the
+data has drifted a lot). Rows whose metadata is gone (a re-ingested file
+gets new row IDs) are removed by ID, except from HNSW graphs, which cannot
+delete and must be rebuilt. The manifest next to the index,
+`argo_index_manifest.json`, records the model and fingerprint, dimension,
+metric, row count and row-ID range, the search setting and the recall@k
+measured against exact search when the index was built (for queries near,
+but not on, stored vectors). Its version increases with every write,
+rebuilds included. load_index() validates it against the query encoder and
+the embedding store.
+"""
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from embedding_store import INDEX_PATH, base_index, sidecar
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+METRIC = "l2"
+RECALL_K = 10
+RECALL_QUERIES = 200
+QUERY_NOISE = 0.25  # recall queries are stored vectors moved by this fraction of their length
+NPROBE_STEPS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+EF_SEARCH_STEPS = (16, 32, 64, 128, 256, 512, 1024)
+
+
+def manifest_path(index_path=INDEX_PATH):
+    return sidecar(index_path, "_manifest.json")
+
+
+def default_nlist(n_rows):
+    """~4·√n cells, but at least 39 training points per cell (FAISS's k-means minimum)."""
+    return int(max(1, min(4 * math.sqrt(max(n_rows, 1)), n_rows // 39)))
+
+
+def default_pq_m(dimension):
+    """Largest sub-quantizer count ≤ d/8 that divides d (48 for 384-d MiniLM)."""
+    return next(m for m in range(max(1, dimension // 8), 0, -1) if dimension % m == 0)
+
+
+def make_index(index_type, dimension, n_rows, nlist=None, pq_m=None, hnsw_m=32):
+    """Empty ID-mapped index of the requested type; returns (index, params)."""
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension)), {}
+    if index_type in ("ivf-flat", "ivf-pq"):
+        nlist = nlist or default_nlist(n_rows)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf-flat":
+            base, params = faiss.IndexIVFFlat(quantizer, dimension, nlist), {"nlist": nlist}
+        else:
+            pq_m = pq_m or default_pq_m(dimension)
+            if n_rows < 39 * 256:
+                # 256 centroids per sub-quantizer, 39 training points each
+                raise ValueError(f"ivf-pq needs at least {39 * 256} rows to train, got {n_rows}; use ivf-flat or hnsw")
+            base, params = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8), {"nlist": nlist, "pq_m": pq_m}
+        return faiss.IndexIDMap2(base), params
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        base.hnsw.efConstruction = 80
+        return faiss.IndexIDMap2(base), {"hnsw_m": hnsw_m}
+    raise ValueError(f"Unknown index type '{index_type}' (expected one of {INDEX_TYPES})")
+
+
+def set_search_effort(index, effort):
+    """Apply nprobe (IVF) or efSearch (HNSW); no-op for flat indexes."""
+    base = base_index(index)
+    if effort is None:
+        return
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = int(effort)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = int(effort)
+
+
+def _training_sample(store, size, seed=0):
+    size = min(size, len(store))
+    positions = np.sort(np.random.default_rng(seed).choice(len(store), size, replace=False))
+    return store.as_float32(store.embeddings[positions])
+
+
+def _exact_neighbours(store, queries, k, chunk_rows=100_000):
+    """Exact top-k row IDs for each query, scanning the store chunk by chunk."""
+    best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_i = np.full((len(queries), k), -1, dtype=np.int64)
+    for vectors, row_ids in store.iter_chunks(chunk_rows):
+        d, i = faiss.knn(queries, np.ascontiguousarray(vectors), min(k, len(vectors)))
+        d = np.concatenate([best_d, d], axis=1)
+        ids = np.concatenate([best_i, np.where(i >= 0, row_ids[np.maximum(i, 0)], -1)], axis=1)
+        order = np.argsort(d, axis=1, kind="stable")[:, :k]
+        best_d, best_i = np.take_along_axis(d, order, 1), np.take_along_axis(ids, order, 1)
+    return best_i
+
+
+def _recall_queries(store, n_queries, seed):
+    """Stored vectors moved in a random direction, so no query is itself indexed (its own cell is a free hit)."""
+    vectors = _training_sample(store, n_queries, seed)
+    noise = np.random.default_rng(seed).standard_normal(vectors.shape).astype(np.float32)
+    noise *= (QUERY_NOISE * np.linalg.norm(vectors, axis=1, keepdims=True)
+              / np.maximum(np.linalg.norm(noise, axis=1, keepdims=True), 1e-12))
+    return np.ascontiguousarray(vectors + noise)
+
+
+def measure_recall(index, store, k=RECALL_K, n_queries=RECALL_QUERIES, seed=1):
+    """recall@k of `index` against exact search, for perturbed stored vectors as queries."""
+    queries = _recall_queries(store, n_queries, seed)
+    truth = _exact_neighbours(store, queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(np.intersect1d(t[t >= 0], f[f >= 0])) for t, f in zip(truth, found))
+    return hits / max(int((truth >= 0).sum()), 1)
+
+
+def tune_search_effort(index, store, target_recall, k=RECALL_K):
+    """Smallest nprobe/efSearch reaching `target_recall`; returns (effort, recall)."""
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        steps = [n for n in NPROBE_STEPS if n < base.nlist] + [base.nlist]
+    elif isinstance(base, faiss.IndexHNSW):
+        steps = list(EF_SEARCH_STEPS)
+    else:
+        return None, measure_recall(index, store, k)
+    for effort in steps:
+        set_search_effort(index, effort)
+        recall = measure_recall(index, store, k)
+        if recall >= target_recall:
+            break
+    return effort, recall
+
+
+def build_index(store, index_type="flat", nlist=None, pq_m=None, hnsw_m=32, target_recall=0.95,
+                chunk_rows=100_000):
+    """Train (if needed), fill and tune an index over the whole store; returns (index, manifest)."""
+    index, params = make_index(index_type, store.dimension, len(store), nlist, pq_m, hnsw_m)
+    if not index.is_trained:
+        train_size = max(256 * params.get("nlist", 1), 50_000)
+        index.train(np.ascontiguousarray(_training_sample(store, train_size)))
+    for vectors, row_ids in store.iter_chunks(chunk_rows):
+        index.add_with_ids(np.ascontiguousarray(vectors), np.asarray(row_ids, dtype=np.int64))
+    effort, recall = tune_search_effort(index, store, target_recall)
+    manifest = {
+        "version": 0,
+        "index_type": index_type,
+        "params": params,
+        "search_effort": effort,
+        "model": store.model_name,
+        "fingerprint": store.meta.get("fingerprint"),
+        "dimension": store.dimension,
+        "metric": METRIC,
+        "recall": {"k": RECALL_K, "value": round(float(recall), 4), "rows": int(index.ntotal)},
+        "built_at": time.time(),
+    }
+    return index, _with_rows(manifest, store.row_ids)
+
+
+def _with_rows(manifest, row_ids, previous=None):
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    lo = int(row_ids.min()) if len(row_ids) else None
+    hi = int(row_ids.max()) if len(row_ids) else None
+    if previous is not None and previous.get("rows"):
+        lo = previous["row_id_min"] if lo is None else min(lo, previous["row_id_min"])
+        hi = previous["row_id_max"] if hi is None else max(hi, previous["row_id_max"])
+    manifest.update(rows=int(len(row_ids)) + (previous or {}).get("rows", 0), row_id_min=lo, row_id_max=hi)
+    return manifest
+
+
+def append_to_index(index, manifest, vectors, row_ids):
+    """Add new rows (e.g. an ingestion batch) under their row IDs, without retraining."""
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    if manifest.get("rows") and len(row_ids) and row_ids.min() <= manifest["row_id_max"]:
+        raise ValueError(f"Row IDs from {int(row_ids.min())} are already covered by the index "
+                         f"(up to {manifest['row_id_max']}); row IDs are only ever appended")
+    index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), row_ids)
+    manifest = _with_rows(dict(manifest), row_ids, previous=manifest)
+    manifest["updated_at"] = time.time()
+    return manifest
+
+
+def index_row_ids(index):
+    """Row IDs held by an index (positions for indexes from before the ID map)."""
+    return faiss.vector_to_array(index.id_map) if hasattr(index, "id_map") else np.arange(index.ntotal)
+
+
+def remove_from_index(index, manifest, row_ids):
+    """Remove rows by row ID; raises ValueError for HNSW, whose graph cannot delete."""
+    if isinstance(base_index(index), faiss.IndexHNSW) or not hasattr(index, "id_map"):
+        raise ValueError(f"{len(row_ids)} indexed rows are no longer in the metadata, and this index cannot "
+                         f"remove rows; rebuild it with: python vect_db.py")
+    index.remove_ids(faiss.IDSelectorBatch(np.asarray(row_ids, dtype=np.int64)))
+    high_water = manifest.get("row_id_max")
+    manifest = _with_rows(dict(manifest), index_row_ids(index))
+    # Row IDs are never reused: keep the high-water mark so append_to_index still rejects removed IDs
+    manifest["row_id_max"] = high_water
+    manifest["updated_at"] = time.time()
+    return manifest
+
+
+def write_index(index, manifest, path=INDEX_PATH):
+    """Write index and manifest (manifest last, with a bumped version), each atomically.
+
+    The version continues from the manifest on disk, so a rebuild does not
+    start again at 1.
+    """
+    previous = read_manifest(path) or {}
+    manifest = dict(manifest, version=max(manifest.get("version", 0), previous.get("version", 0)) + 1)
+    tmp = f"{path}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+    target = manifest_path(path)
+    tmp_manifest = target.with_name(target.name + ".tmp")
+    tmp_manifest.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_manifest, target)
+    return manifest
+
+
+def read_manifest(path=INDEX_PATH):
+    target = manifest_path(path)
+    return json.loads(target.read_text()) if target.exists() else None
+
+
+def validate_manifest(manifest, index, model_name=None, fingerprint=None, store=None):
+    """Raise ValueError if the index does not match the query encoder, itself or the store."""
+    problems = []
+    if model_name is not None and manifest.get("model") and manifest["model"] != model_name:
+        problems.append(f"index was built with '{manifest['model']}', queries are encoded with '{model_name}'")
+    if fingerprint and manifest.get("fingerprint") and manifest["fingerprint"] != fingerprint:
+        problems.append(f"model fingerprint {fingerprint} differs from the index's {manifest['fingerprint']}")
+    if manifest.get("metric", METRIC) != METRIC:
+        problems.append(f"index metric is {manifest['metric']}, expected {METRIC}")
+    if manifest.get("dimension") != index.d:
+        problems.append(f"manifest dimension {manifest.get('dimension')} but the index has {index.d}")
+    if manifest.get("rows") != index.ntotal:
+        problems.append(f"manifest lists {manifest.get('rows')} rows but the index has {index.ntotal}")
+    if store is not None:
+        if store.dimension != index.d:
+            problems.append(f"embedding store dimension {store.dimension} but the index has {index.d}")
+        if store.model_name and manifest.get("model") and store.model_name != manifest["model"]:
+            problems.append(f"embedding store model '{store.model_name}' differs from the index's '{manifest['model']}'")
+    if problems:
+        raise ValueError("Index manifest check failed: " + "; ".join(problems))
+
+
+def load_index(path=INDEX_PATH, model_name=None, fingerprint=None, store=None):
+    """Read an index and its manifest, validate them and apply the tuned search setting.
+
+    Indexes written before manifests existed get one synthesized from the
+    index itself (exact flat search, nothing to validate the model against).
+    """
+    index = faiss.read_index(str(path))
+    manifest = read_manifest(path)
+    if manifest is None:
+        manifest = {"version": 0, "index_type": "flat", "params": {}, "search_effort": None,
+                    "model": None, "fingerprint": None, "dimension": index.d, "metric": METRIC}
+        manifest = _with_rows(manifest, index_row_ids(index))
+    validate_manifest(manifest, index, model_name, fingerprint, store)
+    set_search_effort(index, manifest.get("search_effort"))
+    return index, manifest
+
+
+def describe(manifest):
+    recall = manifest.get("recall") or {}
+    effort = f", effort {manifest['search_effort']}" if manifest.get("search_effort") else ""
+    measured = f", recall@{recall['k']} {recall['value']:.3f}" if recall else ""
+    return (f"{manifest['index_type']} v{manifest.get('version', 0)}: {manifest['rows']} rows "
+            f"[{manifest.get('row_id_min')}..{manifest.get('row_id_max')}], {manifest.get('model')}"
+            f"{effort}{measured}")